@@ -0,0 +1,21 @@
+# Atomic writes of the cache and output files, readers never see a partial file
+
+import json
+import os
+from typing import IO, Callable
+
+
+def write_atomic(path: str, write: Callable[[IO[str]], None]):
+    """Call write with a temporary file next to path, then move it over path."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def save_json(path: str, data, **kwargs):
+    """Atomically write data as JSON, kwargs are passed on to json.dump."""
+    write_atomic(path, lambda f: json.dump(data, f, **kwargs))
@@ -0,0 +1,42 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from atomicfile import save_json, write_atomic
+
+
+class TestAtomicFile(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'nested', 'cache.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_save_json(self):
+        """Test that missing directories are created and no temporary file is left."""
+        save_json(self.path, {'a': [1, 2]}, separators=(',', ':'))
+
+        with open(self.path) as f:
+            self.assertEqual(f.read(), '{"a":[1,2]}')
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['cache.json'])
+
+    def test_failed_write_keeps_previous_file(self):
+        """Test that an error while writing leaves the old contents in place."""
+        save_json(self.path, {'version': 1})
+
+        def fail(f):
+            f.write('{"version": 2')
+            raise ValueError('not serializable')
+
+        with self.assertRaises(ValueError):
+            write_atomic(self.path, fail)
+        with open(self.path) as f:
+            self.assertEqual(json.load(f), {'version': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# Per-service last green commits from the workflow run history
+
+import json
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from atomicfile import save_json
+
+FAILED_CONCLUSIONS = {"failure", "cancelled", "timed_out", "action_required", "startup_failure"}
+
+# Job names come from service.yml: `<target>-<service>-<env>`, prefixed with the
+# caller job when run as a reusable workflow (`build_services (...) / build-serviceA-dev`)
+TARGETS = ("build", "publish", "deploy", "destroy")
+
+# Targets services.yml runs per output group, publish and deploy only on the default branch
+DEPLOYED_TARGETS = {"services": ("build", "publish", "deploy"), "infra": ("build", "deploy"), "docker": ("publish",)}
+BUILT_TARGETS = {"services": ("build",), "infra": ("build",), "docker": ("publish",)}
+
+
+def expected_targets(group: str, deployed: bool) -> Sequence[str]:
+    """Targets a run must finish for a service of an output group to count as green."""
+    return (DEPLOYED_TARGETS if deployed else BUILT_TARGETS).get(group, ("build",))
+
+
+def service_job_pattern(name: str, envs: List[str]) -> re.Pattern:
+    targets = "|".join(TARGETS)
+    env_names = "|".join(re.escape(env) for env in envs) or "[^/]+"
+    return re.compile(rf"(?:^|/ )({targets})-{re.escape(name)}-(?:{env_names})$")
+
+
+def service_verdict(jobs: Dict[str, str], pattern: re.Pattern, targets: Sequence[str] = ("build",)) -> Optional[bool]:
+    """Whether a run was green for one service, None when the run had no job for it.
+
+    Every expected target needs jobs that all succeeded. A skipped or missing
+    one (e.g. when the calling deploy job was skipped) is not green.
+    """
+    conclusions = {}
+    for job, conclusion in jobs.items():
+        match = pattern.search(job)
+        if match:
+            conclusions.setdefault(match.group(1), []).append(conclusion)
+    if not conclusions:
+        return None
+    if any(conclusion in FAILED_CONCLUSIONS for values in conclusions.values() for conclusion in values):
+        return False
+    return all(conclusions.get(target) and all(conclusion == "success" for conclusion in conclusions[target])
+               for target in targets)
+
+
+class BaselineResolver:
+    """Finds the last commit each service was built green at from the run/job history.
+
+    A run counts as green for a service when the whole run succeeded, or when
+    every expected target of the service succeeded even though other services
+    failed. Job
+    conclusions of completed runs never change, so they are cached by run id
+    and attempt.
+    """
+    def __init__(self, client, cache_path: Optional[str] = None, max_runs: int = 100):
+        self.client = client
+        self.cache_path = cache_path
+        self.max_runs = max_runs
+        self.jobs = {}
+        self.dirty = False
+        if cache_path and os.path.isfile(cache_path):
+            try:
+                with open(cache_path, "r") as f:
+                    self.jobs = json.load(f)
+            except (OSError, ValueError):
+                self.jobs = {}
+
+    def save(self):
+        if not self.cache_path or not self.dirty:
+            return
+        save_json(self.cache_path, self.jobs)
+        self.dirty = False
+
+    def run_jobs(self, owner: str, repo: str, run: dict) -> Dict[str, str]:
+        key = f"{run['id']}:{run.get('run_attempt', 1)}"
+        if key not in self.jobs:
+            self.jobs[key] = {job.get("name"): job.get("conclusion") for job in self.client.iter_jobs(owner, repo, run["id"])}
+            self.dirty = True
+        return self.jobs[key]
+
+    def resolve(self, owner: str, repo: str, branch: str, names: Iterable[str], envs: List[str],
+                workflow: Optional[str] = None,
+                targets: Optional[Dict[str, Sequence[str]]] = None) -> Dict[str, str]:
+        """Last green commit per service, targets maps names to expected_targets (build only by default)."""
+        targets = targets or {}
+        pending = {name: service_job_pattern(name, envs) for name in dict.fromkeys(names)}
+        baselines = {}
+        for scanned, run in enumerate(self.client.iter_runs(owner, repo, branch, workflow_ref=workflow)):
+            if not pending or scanned >= self.max_runs:
+                break
+            if run.get("status") != "completed":
+                continue
+            if run.get("conclusion") == "success":
+                green = list(pending)
+            else:
+                jobs = self.run_jobs(owner, repo, run)
+                green = [name for name, pattern in pending.items()
+                         if service_verdict(jobs, pattern, targets.get(name, ("build",)))]
+            for name in green:
+                baselines[name] = run["head_sha"]
+                del pending[name]
+        return baselines
+
@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from baselines import BaselineResolver, expected_targets, service_job_pattern, service_verdict
+
+
+class TestServiceVerdict(unittest.TestCase):
+
+    def test_job_pattern(self):
+        """Test matching service.yml job names, with and without the caller prefix."""
+        pattern = service_job_pattern('terraform-ci', ['dev', 'prod'])
+
+        self.assertTrue(pattern.search('publish-terraform-ci-dev'))
+        self.assertTrue(pattern.search('publish_docker (terraform-ci, dev) / publish-terraform-ci-prod'))
+        self.assertFalse(pattern.search('publish-ci-dev'))
+        self.assertFalse(service_job_pattern('ci', ['dev']).search('publish-terraform-ci-dev'))
+        self.assertFalse(pattern.search('publish-terraform-ci-staging'))
+
+    def test_verdict(self):
+        """Test deciding whether a run was green for a service."""
+        pattern = service_job_pattern('serviceA', ['dev'])
+
+        self.assertTrue(service_verdict({'build-serviceA-dev': 'success', 'publish-serviceA-dev': 'skipped'}, pattern))
+        self.assertFalse(service_verdict({'build-serviceA-dev': 'success', 'deploy-serviceA-dev': 'failure'}, pattern))
+        self.assertFalse(service_verdict({'build-serviceA-dev': 'skipped'}, pattern))
+        self.assertIsNone(service_verdict({'build-serviceB-dev': 'success'}, pattern))
+
+    def test_verdict_requires_every_expected_target(self):
+        """Test that a deployed service is not green when its deploy was skipped or never ran."""
+        pattern = service_job_pattern('serviceA', ['dev'])
+        deployed = expected_targets('services', True)
+
+        self.assertTrue(service_verdict({'build-serviceA-dev': 'success', 'publish-serviceA-dev': 'success',
+                                         'deploy-serviceA-dev': 'success'}, pattern, deployed))
+        self.assertFalse(service_verdict({'build-serviceA-dev': 'success', 'publish-serviceA-dev': 'success',
+                                          'deploy-serviceA-dev': 'skipped'}, pattern, deployed))
+        self.assertFalse(service_verdict({'build-serviceA-dev': 'success', 'publish-serviceA-dev': 'success',
+                                          'deploy_services': 'skipped'}, pattern, deployed))
+        self.assertTrue(service_verdict({'build-serviceA-dev': 'success'}, pattern, expected_targets('services', False)))
+        self.assertEqual(expected_targets('docker', True), ('publish',))
+
+
+class TestBaselineResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.client = MagicMock()
+        self.client.iter_runs.return_value = [
+            {'id': 5, 'status': 'completed', 'conclusion': 'failure', 'head_sha': 'c5'},
+            {'id': 4, 'status': 'in_progress', 'conclusion': None, 'head_sha': 'c4'},
+            {'id': 3, 'status': 'completed', 'conclusion': 'failure', 'head_sha': 'c3'},
+            {'id': 2, 'status': 'completed', 'conclusion': 'success', 'head_sha': 'c2'},
+            {'id': 1, 'status': 'completed', 'conclusion': 'success', 'head_sha': 'c1'},
+        ]
+        jobs = {
+            5: [{'name': 'build-serviceA-dev', 'conclusion': 'success'}, {'name': 'build-serviceB-dev', 'conclusion': 'failure'}],
+            3: [{'name': 'build-serviceB-dev', 'conclusion': 'failure'}, {'name': 'build-serviceC-dev', 'conclusion': 'success'}],
+        }
+        self.client.iter_jobs.side_effect = lambda owner, repo, run_id: jobs[run_id]
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_resolve(self):
+        """Test that each service gets the newest run that was green for it."""
+        resolver = BaselineResolver(self.client)
+
+        baselines = resolver.resolve('owner', 'repo', 'main', ['serviceA', 'serviceB', 'serviceC'], ['dev'])
+
+        self.assertEqual(baselines, {'serviceA': 'c5', 'serviceC': 'c3', 'serviceB': 'c2'})
+        self.client.iter_runs.assert_called_once_with('owner', 'repo', 'main', workflow_ref=None)
+        self.assertEqual(self.client.iter_jobs.call_count, 2)
+
+    def test_undeployed_run_is_not_green(self):
+        """Test that a failed run whose build passed but whose deploy was missing is skipped."""
+        resolver = BaselineResolver(self.client)
+
+        baselines = resolver.resolve('owner', 'repo', 'main', ['serviceA', 'serviceC'], ['dev'],
+                                     targets={'serviceA': expected_targets('services', True)})
+
+        self.assertEqual(baselines, {'serviceC': 'c3', 'serviceA': 'c2'})
+
+    def test_stops_when_all_resolved(self):
+        """Test that jobs of older runs are not fetched once every service is resolved."""
+        resolver = BaselineResolver(self.client)
+
+        self.assertEqual(resolver.resolve('owner', 'repo', 'main', ['serviceA'], ['dev']), {'serviceA': 'c5'})
+        self.client.iter_jobs.assert_called_once()
+
+    def test_max_runs(self):
+        """Test that only max_runs runs are scanned."""
+        resolver = BaselineResolver(self.client, max_runs=1)
+
+        self.assertEqual(resolver.resolve('owner', 'repo', 'main', ['serviceB'], ['dev']), {})
+
+    def test_job_cache(self):
+        """Test that job conclusions are cached between runs."""
+        cache_path = os.path.join(self.temp_dir, 'jobs.json')
+        resolver = BaselineResolver(self.client, cache_path)
+        resolver.resolve('owner', 'repo', 'main', ['serviceB'], ['dev'])
+        resolver.save()
+        self.client.iter_jobs.reset_mock()
+
+        resolver = BaselineResolver(self.client, cache_path)
+        baselines = resolver.resolve('owner', 'repo', 'main', ['serviceB'], ['dev'])
+
+        self.assertEqual(baselines, {'serviceB': 'c2'})
+        self.client.iter_jobs.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
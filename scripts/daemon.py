@@ -0,0 +1,237 @@
+# Long-lived service index kept current with inotify and queried over a Unix socket
+
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import threading
+from typing import Optional
+
+import services
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    """Non-blocking inotify file descriptor with one watch per directory."""
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths = {}
+
+    def add(self, path: str) -> bool:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            if ctypes.get_errno() in (errno.ENOENT, errno.ENOTDIR):
+                return True
+            return False
+        self.paths[wd] = path
+        return True
+
+    def read(self) -> list:
+        """Pending events as (directory, name, mask), without blocking."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, offset)
+                name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b"\0").decode()
+                offset += EVENT.size + length
+                if mask & IN_IGNORED:
+                    self.paths.pop(wd, None)
+                    continue
+                events.append((self.paths.get(wd), name, mask))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ServiceIndex:
+    """Services of one checkout, updated from inotify events before every query.
+
+    Edited Buildfiles are reloaded one by one. Added or removed Buildfiles and
+    directories, discovery settings and overflowing event queues fall back to
+    a full rescan on the next query.
+    """
+    def __init__(self, config_path: str = "services.yaml", watch: bool = True):
+        self.config_path = config_path
+        self.config = services.load_config(config_path)
+        self.services = []
+        self.envs = None
+        self.stale = True
+        self.rescans = 0
+        self.lock = threading.Lock()
+        self.inotify = None
+        if watch:
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError):
+                self.inotify = None
+
+    def watch_tree(self, top: str):
+        if self.inotify is None:
+            return
+        matcher = services.discovery_matcher(services.get_discovery_config(self.config))
+        for root, dirs, _ in os.walk(top):
+            dirs[:] = [d for d in dirs if not matcher.ignored(os.path.join(root, d))]
+            if not self.inotify.add(root):
+                # Out of watches, every query rescans instead
+                self.inotify.close()
+                self.inotify = None
+                return
+
+    def rescan(self):
+        self.services = services.detect_services(self.config)
+        self.stale = False
+        self.rescans += 1
+
+    def apply(self, directory: Optional[str], name: str, mask: int):
+        path = os.path.join(directory, name) if directory and name else directory
+        if mask & IN_Q_OVERFLOW or directory is None:
+            self.stale = True
+        elif mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self.watch_tree(path)
+            self.stale = True
+        elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            self.stale = True
+        elif directory == "." and name == os.path.basename(self.config_path):
+            self.config = services.load_config(self.config_path)
+            self.stale = True
+        elif directory == "." and name == "envs.yaml":
+            self.envs = None
+        elif directory == "." and name in services.get_discovery_config(self.config).get("ignore_files", services.DEFAULT_IGNORE_FILES):
+            self.stale = True
+        elif name == services.BUILDFILE:
+            if mask & (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO):
+                self.stale = True
+            elif not self.stale:
+                self.reload(directory)
+
+    def reload(self, directory: str):
+        for i, service in enumerate(self.services):
+            if os.path.normpath(service.path) == os.path.normpath(directory):
+                try:
+                    self.services[i] = services.Service(service.path)
+                except (OSError, ValueError):
+                    self.stale = True
+                return
+
+    def refresh(self):
+        if self.inotify is None:
+            self.stale = True
+        else:
+            for event in self.inotify.read():
+                self.apply(*event)
+        if self.stale:
+            self.rescan()
+
+    def snapshot(self) -> list:
+        """Copies of the indexed services that queries may resolve make targets on."""
+        return [service.fresh() for service in self.services]
+
+    def query(self, request: dict):
+        with self.lock:
+            self.refresh()
+            command = request.get("command")
+            make_workers = request.get("make_workers")
+            if command == "all":
+                fields = request.get("fields")
+                return [service.to_dict(fields) for service in services.resolve_saved_values(self.snapshot(), make_workers)]
+            if command == "envs":
+                if self.envs is None:
+                    self.envs = services.get_envs()
+                return self.envs
+            if command == "cmp":
+                return services.compare_services(request["cmp"], self.config, make_workers, services=self.snapshot(),
+                                                 fields=request.get("fields"))
+            raise ValueError(f"Unknown command: {command}")
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        index = self.server.index
+        try:
+            request = json.loads(self.rfile.readline())
+            if request.get("root") != os.getcwd() or request.get("config") != index.config_path:
+                # Another checkout or config, the client does the work itself
+                reply = {"ok": False, "fallback": True, "error": "index does not match the request"}
+            else:
+                reply = {"ok": True, "result": index.query(request)}
+        except Exception as e:
+            reply = {"ok": False, "error": str(e)}
+        self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path: str = services.DAEMON_SOCKET, config_path: str = "services.yaml"):
+    index = ServiceIndex(config_path)
+    index.watch_tree(".")
+    index.rescan()
+    directory = os.path.dirname(socket_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = Server(socket_path, Handler)
+    server.index = index
+    # Leave through the finally below on `kill`, so the socket does not linger
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+def query(request: dict, socket_path: str = services.DAEMON_SOCKET, timeout: float = 60):
+    """Answer from a running daemon, None when there is none to ask."""
+    request = {**request, "root": os.getcwd()}
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            sock.sendall(json.dumps(request).encode() + b"\n")
+            data = b""
+            while not data.endswith(b"\n"):
+                chunk = sock.recv(65536)
+                if not chunk:
+                    return None
+                data += chunk
+    except OSError:
+        return None
+    reply = json.loads(data)
+    if reply.get("ok"):
+        return reply["result"]
+    if reply.get("fallback"):
+        return None
+    raise RuntimeError(f"services daemon: {reply.get('error')}")
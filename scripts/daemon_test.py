@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from daemon import Handler, Server, ServiceIndex, query
+
+
+class TestServiceIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.temp_dir)
+        self.write('services/a/Buildfile.yaml', 'name: a\n')
+        self.write('envs.yaml', '- name: dev\n')
+        self.index = ServiceIndex('services.yaml')
+        self.index.watch_tree('.')
+        self.index.rescan()
+
+    def tearDown(self):
+        if self.index.inotify is not None:
+            self.index.inotify.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, name, content):
+        os.makedirs(os.path.dirname(name) or '.', exist_ok=True)
+        with open(name, 'w') as f:
+            f.write(content)
+
+    def names(self):
+        return [service['name'] for service in self.index.query({'command': 'all'})]
+
+    def test_edit_reloads_one_buildfile(self):
+        """Test that an edited Buildfile is reloaded without a rescan."""
+        if self.index.inotify is None:
+            self.skipTest('inotify is not available')
+        self.write('services/a/Buildfile.yaml', 'name: renamed\n')
+
+        self.assertEqual(self.names(), ['renamed'])
+        self.assertEqual(self.index.rescans, 1)
+
+    def test_new_service_triggers_rescan(self):
+        """Test that services in new directories are picked up."""
+        if self.index.inotify is None:
+            self.skipTest('inotify is not available')
+        self.assertEqual(self.names(), ['a'])
+        self.write('services/b/Buildfile.yaml', 'name: b\n')
+        self.assertEqual(self.names(), ['a', 'b'])
+
+        self.write('services/b/nested/Buildfile.yaml', 'name: nested\n')
+        self.assertEqual(self.names(), ['a', 'b', 'nested'])
+
+        os.remove('services/a/Buildfile.yaml')
+        self.assertEqual(self.names(), ['b', 'nested'])
+
+    def test_unrelated_changes_keep_index(self):
+        """Test that edits to other files neither reload nor rescan."""
+        self.write('services/a/main.go', 'package main\n')
+
+        self.assertEqual(self.names(), ['a'])
+        self.assertEqual(self.index.rescans, 1 if self.index.inotify is not None else 2)
+
+    def test_envs_are_cached(self):
+        """Test that envs are read once and refreshed when envs.yaml changes."""
+        self.assertEqual(self.index.query({'command': 'envs'}), ['dev'])
+        self.write('envs.yaml', '- name: dev\n- name: prod\n')
+
+        self.assertEqual(self.index.query({'command': 'envs'}), ['dev', 'prod'])
+
+    def test_socket_round_trip(self):
+        """Test answering queries over the Unix socket, and falling back when none listens."""
+        socket_path = os.path.join(self.temp_dir, 'daemon.sock')
+        self.assertIsNone(query({'command': 'all', 'config': 'services.yaml'}, socket_path))
+
+        server = Server(socket_path, Handler)
+        server.index = self.index
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            self.assertEqual(query({'command': 'all', 'config': 'services.yaml'}, socket_path),
+                             [{'name': 'a', 'path': './services/a'}])
+            self.assertIsNone(query({'command': 'all', 'config': 'other.yaml'}, socket_path))
+            with self.assertRaises(RuntimeError):
+                query({'command': 'bogus', 'config': 'services.yaml'}, socket_path)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# Input fingerprints of services and the record of fingerprints that were already built
+
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+from atomicfile import save_json
+
+FINGERPRINT_VERSION = 1
+
+
+def fingerprint(tree: Optional[str], dependencies: Dict[str, List[Optional[str]]],
+                triggers: Dict[str, str]) -> Optional[str]:
+    """Digest of a service's tree, its dependencies' fingerprints and its trigger files.
+
+    None when any input is unknown (e.g. an uncommitted service), such a service
+    is never treated as already built.
+    """
+    if tree is None or any(None in fingerprints for fingerprints in dependencies.values()):
+        return None
+    payload = json.dumps({
+        "version": FINGERPRINT_VERSION,
+        "tree": tree,
+        "dependencies": sorted((name, sorted(fingerprints)) for name, fingerprints in dependencies.items()),
+        "triggers": sorted(triggers.items()),
+    }, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class BuildCache:
+    """Fingerprints of services whose artifacts were already published.
+
+    Entries are kept in insertion order and the oldest are dropped beyond
+    max_entries, so the file stays small when kept in the CI cache.
+    """
+    VERSION = 1
+
+    def __init__(self, path: str, max_entries: int = 10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = {}
+        self.dirty = False
+        if os.path.isfile(path):
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+                if data.get("version") == self.VERSION:
+                    self.entries = data.get("built", {})
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def built(self, fingerprint: Optional[str]) -> bool:
+        return fingerprint is not None and fingerprint in self.entries
+
+    def record(self, fingerprint: str, name: Optional[str], artifact: Optional[str] = None):
+        self.entries.pop(fingerprint, None)
+        self.entries[fingerprint] = {"name": name, "artifact": artifact}
+        while len(self.entries) > self.max_entries:
+            del self.entries[next(iter(self.entries))]
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        save_json(self.path, {"version": self.VERSION, "built": self.entries})
+        self.dirty = False
@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from fingerprints import BuildCache, fingerprint
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def test_deterministic(self):
+        """Test that the fingerprint does not depend on input ordering."""
+        first = fingerprint('tree', {'a': ['1'], 'b': ['2', '3']}, {'x': 'blob1', 'y': 'blob2'})
+        second = fingerprint('tree', {'b': ['3', '2'], 'a': ['1']}, {'y': 'blob2', 'x': 'blob1'})
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, fingerprint('other', {'a': ['1'], 'b': ['2', '3']}, {'x': 'blob1', 'y': 'blob2'}))
+        self.assertNotEqual(first, fingerprint('tree', {'a': ['1'], 'b': ['2', '4']}, {'x': 'blob1', 'y': 'blob2'}))
+        self.assertNotEqual(first, fingerprint('tree', {'a': ['1'], 'b': ['2', '3']}, {'x': 'blob1'}))
+
+    def test_unknown_inputs(self):
+        """Test that a missing tree or dependency fingerprint gives no fingerprint."""
+        self.assertIsNone(fingerprint(None, {}, {}))
+        self.assertIsNone(fingerprint('tree', {'a': [None]}, {}))
+        self.assertIsNotNone(fingerprint('tree', {'external': []}, {}))
+
+
+class TestBuildCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'cache', 'built.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_round_trip(self):
+        """Test that recorded fingerprints survive a save and load."""
+        cache = BuildCache(self.path)
+        cache.record('fp1', 'serviceA', 'image_a')
+        cache.save()
+
+        cache = BuildCache(self.path)
+        self.assertTrue(cache.built('fp1'))
+        self.assertFalse(cache.built('fp2'))
+        self.assertFalse(cache.built(None))
+        self.assertEqual(cache.entries['fp1'], {'name': 'serviceA', 'artifact': 'image_a'})
+
+    def test_drops_oldest_entries(self):
+        """Test that the cache is bounded, keeping recently recorded fingerprints."""
+        cache = BuildCache(self.path, max_entries=2)
+        cache.record('fp1', 'a')
+        cache.record('fp2', 'b')
+        cache.record('fp1', 'a')
+        cache.record('fp3', 'c')
+
+        self.assertEqual(list(cache.entries), ['fp1', 'fp3'])
+
+    def test_corrupt_file(self):
+        """Test that an unreadable cache file starts empty."""
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            f.write('{broken')
+
+        self.assertEqual(BuildCache(self.path).entries, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+# Long-lived git processes for object lookups and tree diffs
+
+import os
+import subprocess
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from telemetry import tracer, GIT_DURATION
+
+
+class GitBatch:
+    """Keeps `git cat-file --batch-check`, `git cat-file --batch` and
+    `git diff-tree --stdin` running, so repeated lookups and diffs cost a pipe
+    round trip instead of a process spawn.
+
+    Processes are started on first use and stopped by close().
+    """
+    def __init__(self, cwd: Optional[str] = None):
+        self.cwd = cwd
+        self.processes = {}
+        self.lock = threading.Lock()
+        self.spawned = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        for proc in self.processes.values():
+            if proc.stdin:
+                proc.stdin.close()
+            proc.stdout.close()
+            proc.wait()
+        self.processes = {}
+
+    def process(self, name: str, *args: str) -> subprocess.Popen:
+        proc = self.processes.get(name)
+        if proc is None or proc.poll() is not None:
+            proc = subprocess.Popen(["git", *args], cwd=self.cwd, stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            self.processes[name] = proc
+            self.spawned += 1
+        return proc
+
+    def resolve(self, rev: str, kind: Optional[str] = "commit") -> Optional[str]:
+        """Full object name of rev (peeled to kind), None when it does not exist."""
+        query = f"{rev}^{{{kind}}}" if kind else rev
+        if "\n" in query:
+            return None
+        with self.lock, tracer.start_as_current_span("git_batch"), GIT_DURATION.time({"command": "cat-file --batch-check"}):
+            proc = self.process("batch-check", "cat-file", "--batch-check")
+            proc.stdin.write(query.encode() + b"\n")
+            proc.stdin.flush()
+            line = proc.stdout.readline().decode().rstrip("\n")
+        # `<oid> <type> <size>` on success, `<query> missing|ambiguous` otherwise
+        parts = line.split(" ")
+        if len(parts) != 3 or parts[1] in ("missing", "ambiguous"):
+            return None
+        return parts[0]
+
+    def commit_exists(self, rev: str) -> bool:
+        return self.resolve(rev, "commit") is not None
+
+    def read_object(self, rev: str) -> Optional[Tuple[str, bytes]]:
+        if "\n" in rev:
+            return None
+        with self.lock, tracer.start_as_current_span("git_batch"), GIT_DURATION.time({"command": "cat-file --batch"}):
+            proc = self.process("batch", "cat-file", "--batch")
+            proc.stdin.write(rev.encode() + b"\n")
+            proc.stdin.flush()
+            header = proc.stdout.readline().decode().rstrip("\n").split(" ")
+            if len(header) != 3:
+                return None
+            content = proc.stdout.read(int(header[2]))
+            proc.stdout.read(1)
+        return header[1], content
+
+    def diff_many(self, bases: Iterable[str], head: str = "HEAD") -> Dict[str, List[str]]:
+        """Names of the files that differ between every base and head.
+
+        Matches `git diff --name-only --no-renames <base> <head>`, all answered by
+        one diff-tree process.
+        """
+        bases = list(dict.fromkeys(bases))
+        head_oid = self.resolve(head)
+        if head_oid is None:
+            raise RuntimeError(f"git diff-tree failed: unknown revision {head}")
+        changes = {}
+        for base in bases:
+            base_oid = self.resolve(base)
+            if base_oid is None:
+                raise RuntimeError(f"git diff-tree failed: unknown revision {base}")
+            changes[base] = [] if base_oid == head_oid else self.diff_tree(head_oid, base_oid)
+        return changes
+
+    def diff_tree(self, head_oid: str, base_oid: str) -> List[str]:
+        with self.lock, tracer.start_as_current_span("git_batch"), GIT_DURATION.time({"command": "diff-tree --stdin"}):
+            proc = self.process("diff-tree", "diff-tree", "--stdin", "-r", "--name-only", "-z", "--always")
+            # An empty line makes diff-tree flush and echo it back, which marks the
+            # end of this answer on the pipe
+            proc.stdin.write(f"{head_oid} {base_oid}\n\n".encode())
+            proc.stdin.flush()
+            tokens = read_until_echo(proc.stdout)
+        if not tokens or tokens[0] != head_oid:
+            raise RuntimeError(f"git diff-tree {base_oid} {head_oid} failed")
+        return tokens[1:]
+
+
+def read_until_echo(stream) -> List[str]:
+    tokens = []
+    buffer = b""
+    fd = stream.fileno()
+    while True:
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            raise RuntimeError("git diff-tree exited unexpectedly")
+        buffer += chunk
+        *complete, buffer = buffer.split(b"\0")
+        tokens.extend(token.decode() for token in complete)
+        if buffer == b"\n":
+            return tokens
+
@@ -0,0 +1,106 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from gitbatch import GitBatch
+
+
+class TestGitBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        env = patch.dict(os.environ, {
+            'GIT_AUTHOR_NAME': 'test', 'GIT_AUTHOR_EMAIL': 'test@example.com',
+            'GIT_COMMITTER_NAME': 'test', 'GIT_COMMITTER_EMAIL': 'test@example.com',
+        })
+        env.start()
+        self.addCleanup(env.stop)
+        self.git('init', '-q', '-b', 'main')
+        self.batch = GitBatch(self.temp_dir)
+        self.addCleanup(self.batch.close)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def git(self, *args):
+        out = subprocess.check_output(['git', *args], cwd=self.temp_dir, stderr=subprocess.STDOUT)
+        return out.decode().strip()
+
+    def commit(self, name, content=None):
+        path = os.path.join(self.temp_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content or name)
+        self.git('add', '-A')
+        self.git('commit', '-q', '-m', name)
+        return self.git('rev-parse', 'HEAD')
+
+    def test_resolve_and_exists(self):
+        """Test resolving revisions through the long-lived batch-check process."""
+        first = self.commit('a/one.txt')
+        second = self.commit('b/two.txt')
+
+        self.assertEqual(self.batch.resolve('HEAD'), second)
+        self.assertEqual(self.batch.resolve('HEAD~1'), first)
+        self.assertEqual(self.batch.resolve(first[:10]), first)
+        self.assertTrue(self.batch.commit_exists(first))
+        self.assertFalse(self.batch.commit_exists('0' * 40))
+        self.assertFalse(self.batch.commit_exists('no-such-branch'))
+        self.assertIsNone(self.batch.resolve('HEAD:a', 'commit'))
+        self.assertEqual(self.batch.spawned, 1)
+
+    def test_read_object(self):
+        """Test reading object contents through cat-file --batch."""
+        self.commit('a/one.txt', 'hello\n')
+
+        self.assertEqual(self.batch.read_object('HEAD:a/one.txt'), ('blob', b'hello\n'))
+        kind, content = self.batch.read_object('HEAD')
+        self.assertEqual(kind, 'commit')
+        self.assertTrue(content.startswith(b'tree '))
+        self.assertIsNone(self.batch.read_object('HEAD:missing.txt'))
+        self.assertEqual(self.batch.read_object('HEAD:a/one.txt'), ('blob', b'hello\n'))
+
+    def test_diff_many_matches_git_diff(self):
+        """Test that every base gets the same files as git diff, from one process."""
+        first = self.commit('a/one.txt')
+        second = self.commit('b/two.txt')
+        self.git('checkout', '-q', '-b', 'feature')
+        self.commit('c/three file.txt')
+        self.git('checkout', '-q', 'main')
+        third = self.commit('a/four.txt')
+        self.git('merge', '-q', '--no-edit', 'feature')
+        self.commit('a/one.txt', 'changed')
+
+        changes = self.batch.diff_many([first, second, third, second, 'HEAD'])
+
+        for base in (first, second, third):
+            expected = self.git('diff', '--name-only', '--no-renames', base, 'HEAD').split('\n')
+            self.assertEqual(changes[base], expected)
+        self.assertEqual(changes['HEAD'], [])
+        self.assertEqual(self.batch.spawned, 2)
+
+    def test_diff_many_off_history_base(self):
+        """Test diffing against a base that is not part of head's history."""
+        self.commit('a/one.txt')
+        self.git('checkout', '-q', '-b', 'other')
+        other = self.commit('b/two.txt')
+        self.git('checkout', '-q', 'main')
+        self.commit('c/three.txt')
+
+        self.assertEqual(self.batch.diff_many([other]), {other: ['b/two.txt', 'c/three.txt']})
+
+    def test_diff_many_unknown_base(self):
+        """Test that an unknown base is reported instead of hanging the pipe."""
+        self.commit('a/one.txt')
+
+        with self.assertRaises(RuntimeError) as context:
+            self.batch.diff_many(['0' * 40])
+
+        self.assertIn('unknown revision', str(context.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
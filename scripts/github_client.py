@@ -0,0 +1,201 @@
+# Client for the GitHub Actions runs API used to find the last green commit
+
+import json
+import os
+import time
+from typing import Callable, Iterator, Optional
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from atomicfile import save_json
+from telemetry import tracer, bounded, HTTP_DURATION
+
+GITHUB_API = "https://api.github.com"
+
+
+def is_green(run: dict) -> bool:
+    return run.get("status") == "completed" and run.get("conclusion") == "success"
+
+
+def endpoint(url: str) -> str:
+    # Low cardinality name for metrics, ids and query strings left out
+    path = url.split("?", 1)[0]
+    return "jobs" if path.endswith("/jobs") else "runs"
+
+
+class GitHubClient:
+    """Pooled GitHub API client with lazy pagination and conditional requests.
+
+    Runs pages that carry an ETag are kept in an optional JSON cache file and
+    revalidated with If-None-Match, so unchanged pages come back as 304s which
+    do not count against the rate limit. The cache keeps the max_entries most
+    recently used pages. Jobs pages are not kept, BaselineResolver already
+    caches them per run attempt.
+    """
+    def __init__(self, token: str, api: str = GITHUB_API, cache_path: Optional[str] = None,
+                 timeout: float = 30, max_retries: int = 3, max_wait: float = 60,
+                 pool_size: int = 4, sleep: Callable[[float], None] = time.sleep,
+                 max_entries: int = 256):
+        self.api = api.rstrip("/")
+        self.cache_path = cache_path
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+        self.sleep = sleep
+        self.max_entries = max_entries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/vnd.github+json",
+        })
+        self.cache = {}
+        self.dirty = False
+        self.remaining = None
+        self.reset = None
+        self.requests = 0
+        self.not_modified = 0
+        if cache_path and os.path.isfile(cache_path):
+            try:
+                with open(cache_path, "r") as f:
+                    self.cache = json.load(f)
+            except (OSError, ValueError):
+                self.cache = {}
+            self.evict()
+
+    def close(self):
+        self.session.close()
+        self.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def save(self):
+        if not self.cache_path or not self.dirty:
+            return
+        save_json(self.cache_path, self.cache)
+        self.dirty = False
+
+    def get(self, url: str):
+        """Fetch a URL, returning the decoded body and the URL of the next page."""
+        entry = self.cache.get(url)
+        headers = {"If-None-Match": entry["etag"]} if entry else {}
+        for attempt in range(self.max_retries + 1):
+            self.wait_for_rate_limit()
+            with tracer.start_as_current_span("github_get") as span, HTTP_DURATION.time({"endpoint": endpoint(url)}):
+                span.set_attribute("url", bounded(url))
+                resp = self.session.get(url, headers=headers, timeout=self.timeout)
+                span.set_attribute("status_code", resp.status_code)
+            self.requests += 1
+            self.track_rate_limit(resp)
+            if resp.status_code == 304 and entry:
+                self.not_modified += 1
+                self.remember(url, entry)
+                return entry["body"], entry.get("next")
+            wait = self.retry_after(resp, attempt)
+            if wait is not None and attempt < self.max_retries:
+                self.sleep(wait)
+                self.remaining = None
+                continue
+            if resp.status_code != 200:
+                raise RuntimeError(f"GitHub API error {resp.status_code}: {resp.text}")
+            body = resp.json()
+            next_url = resp.links.get("next", {}).get("url")
+            if resp.headers.get("ETag") and endpoint(url) != "jobs":
+                self.remember(url, {"etag": resp.headers["ETag"], "body": body, "next": next_url})
+            return body, next_url
+        raise RuntimeError(f"GitHub API request to {url} failed after {self.max_retries} retries")
+
+    def remember(self, url: str, entry: dict):
+        # Re-inserted last, so the first key is always the least recently used
+        self.cache.pop(url, None)
+        self.cache[url] = entry
+        self.dirty = True
+        self.evict()
+
+    def evict(self):
+        while len(self.cache) > self.max_entries:
+            del self.cache[next(iter(self.cache))]
+            self.dirty = True
+
+    def track_rate_limit(self, resp):
+        remaining = resp.headers.get("X-RateLimit-Remaining")
+        reset = resp.headers.get("X-RateLimit-Reset")
+        if remaining is not None and remaining.isdigit():
+            self.remaining = int(remaining)
+        if reset is not None and reset.isdigit():
+            self.reset = int(reset)
+
+    def wait_for_rate_limit(self):
+        if self.remaining != 0 or self.reset is None:
+            return
+        wait = self.reset - time.time()
+        if wait <= 0:
+            return
+        if wait > self.max_wait:
+            raise RuntimeError(f"GitHub API rate limit exhausted for another {int(wait)}s")
+        self.sleep(wait)
+        self.remaining = None
+
+    def retry_after(self, resp, attempt: int) -> Optional[float]:
+        if resp.status_code not in (403, 429):
+            return None
+        if resp.headers.get("Retry-After", "").isdigit():
+            wait = float(resp.headers["Retry-After"])
+        elif self.remaining == 0 and self.reset is not None:
+            wait = max(0.0, self.reset - time.time())
+        elif resp.status_code == 429:
+            wait = float(2 ** attempt)
+        else:
+            # A plain 403 is a permission problem, not a rate limit
+            return None
+        return wait if wait <= self.max_wait else None
+
+    def runs_url(self, owner: str, repo: str, branch: str,
+                 workflow_id: Optional[int] = None,
+                 workflow_ref: Optional[str] = None,
+                 per_page: int = 50) -> str:
+        if workflow_id is not None or workflow_ref is not None:
+            workflow_part = str(workflow_id) if workflow_id is not None else workflow_ref
+            path = f"/repos/{owner}/{repo}/actions/workflows/{workflow_part}/runs"
+        else:
+            path = f"/repos/{owner}/{repo}/actions/runs"
+        return f"{self.api}{path}?{urlencode({'branch': branch, 'status': 'completed', 'per_page': per_page})}"
+
+    def iter_runs(self, owner: str, repo: str, branch: str,
+                  workflow_id: Optional[int] = None,
+                  workflow_ref: Optional[str] = None,
+                  per_page: int = 50,
+                  max_pages: Optional[int] = None) -> Iterator[dict]:
+        """Yield workflow runs newest first, fetching further pages only when needed."""
+        url = self.runs_url(owner, repo, branch, workflow_id, workflow_ref, per_page)
+        pages = 0
+        while url and (max_pages is None or pages < max_pages):
+            body, url = self.get(url)
+            pages += 1
+            yield from body.get("workflow_runs", [])
+
+    def first_green_run(self, owner: str, repo: str, branch: str,
+                        workflow_id: Optional[int] = None,
+                        workflow_ref: Optional[str] = None,
+                        per_page: int = 50,
+                        max_pages: Optional[int] = None) -> Optional[dict]:
+        for run in self.iter_runs(owner, repo, branch, workflow_id, workflow_ref, per_page, max_pages):
+            if is_green(run):
+                return run
+        return None
+
+    def iter_jobs(self, owner: str, repo: str, run_id: int, per_page: int = 100) -> Iterator[dict]:
+        """Yield the jobs of the latest attempt of a workflow run."""
+        url = f"{self.api}/repos/{owner}/{repo}/actions/runs/{run_id}/jobs?{urlencode({'filter': 'latest', 'per_page': per_page})}"
+        while url:
+            body, url = self.get(url)
+            yield from body.get("jobs", [])
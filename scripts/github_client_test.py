@@ -0,0 +1,189 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from github_client import GitHubClient, is_green
+
+
+class FakeGitHub(BaseHTTPRequestHandler):
+    """Stand-in for the workflow runs endpoints, serving `runs` in pages."""
+    runs = []
+    requests = []
+    rate_limited = 0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        type(self).requests.append((url.path, query, self.headers.get("If-None-Match"), self.headers.get("Authorization")))
+        if type(self).rate_limited:
+            type(self).rate_limited -= 1
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+        per_page = int(query["per_page"][0])
+        page = int(query.get("page", ["1"])[0])
+        items = self.runs[(page - 1) * per_page:page * per_page]
+        etag = f'"page-{page}-{len(self.runs)}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = json.dumps({"workflow_runs": items}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        self.send_header("X-RateLimit-Remaining", "100")
+        if page * per_page < len(self.runs):
+            next_query = f"branch={query['branch'][0]}&status=completed&per_page={per_page}&page={page + 1}"
+            self.send_header("Link", f'<http://{self.headers["Host"]}{url.path}?{next_query}>; rel="next"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestGitHubClient(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGitHub)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.api = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.temp_dir, "github.json")
+        FakeGitHub.runs = [{"id": i, "status": "completed", "conclusion": "failure", "head_sha": f"sha{i}"} for i in range(7)]
+        FakeGitHub.requests = []
+        FakeGitHub.rate_limited = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def client(self, **kwargs):
+        return GitHubClient("token", api=self.api, cache_path=self.cache_path, **kwargs)
+
+    def test_is_green(self):
+        """Test the green run predicate."""
+        self.assertTrue(is_green({"status": "completed", "conclusion": "success"}))
+        self.assertFalse(is_green({"status": "completed", "conclusion": "failure"}))
+        self.assertFalse(is_green({"status": "in_progress", "conclusion": None}))
+
+    def test_pagination_stops_at_first_green_run(self):
+        """Test that pages are only fetched until a green run is found."""
+        FakeGitHub.runs[4]["conclusion"] = "success"
+        with self.client() as client:
+            run = client.first_green_run("owner", "repo", "main", per_page=2)
+
+        self.assertEqual(run["head_sha"], "sha4")
+        self.assertEqual(len(FakeGitHub.requests), 3)
+        path, query, _, auth = FakeGitHub.requests[0]
+        self.assertEqual(path, "/repos/owner/repo/actions/runs")
+        self.assertEqual(query["branch"], ["main"])
+        self.assertEqual(auth, "Bearer token")
+
+    def test_no_green_run(self):
+        """Test that all pages are read when nothing is green."""
+        with self.client() as client:
+            self.assertIsNone(client.first_green_run("owner", "repo", "main", workflow_ref="ci.yml", per_page=3))
+
+        self.assertEqual(len(FakeGitHub.requests), 3)
+        self.assertEqual(FakeGitHub.requests[0][0], "/repos/owner/repo/actions/workflows/ci.yml/runs")
+
+    def test_conditional_requests_from_cache(self):
+        """Test that cached pages are revalidated with If-None-Match."""
+        FakeGitHub.runs[1]["conclusion"] = "success"
+        with self.client() as client:
+            client.first_green_run("owner", "repo", "main", per_page=5)
+
+        with self.client() as client:
+            run = client.first_green_run("owner", "repo", "main", per_page=5)
+            self.assertEqual(client.not_modified, 1)
+
+        self.assertEqual(run["head_sha"], "sha1")
+        self.assertIsNone(FakeGitHub.requests[0][2])
+        self.assertEqual(FakeGitHub.requests[1][2], '"page-1-7"')
+
+    def test_cache_keeps_recently_used_pages(self):
+        """Test that the cache is capped and evicts the least recently used page."""
+        with self.client(max_entries=2) as client:
+            client.first_green_run("owner", "repo", "main", per_page=3)
+            first = client.runs_url("owner", "repo", "main", per_page=3)
+            self.assertEqual(len(client.cache), 2)
+            self.assertNotIn(first, client.cache)
+
+        with open(self.cache_path) as f:
+            self.assertEqual(len(json.load(f)), 2)
+
+    def test_jobs_pages_are_not_cached(self):
+        """Test that jobs pages are left to the per attempt cache of BaselineResolver."""
+        with self.client() as client:
+            list(client.iter_jobs("owner", "repo", 1))
+            self.assertEqual(client.cache, {})
+
+        self.assertEqual(FakeGitHub.requests[0][0], "/repos/owner/repo/actions/runs/1/jobs")
+
+    def test_changed_page_is_refetched(self):
+        """Test that a stale ETag results in a fresh body."""
+        with self.client() as client:
+            client.first_green_run("owner", "repo", "main", per_page=50)
+        FakeGitHub.runs.insert(0, {"id": 99, "status": "completed", "conclusion": "success", "head_sha": "new"})
+
+        with self.client() as client:
+            run = client.first_green_run("owner", "repo", "main", per_page=50)
+            self.assertEqual(client.not_modified, 0)
+
+        self.assertEqual(run["head_sha"], "new")
+
+    def test_backs_off_when_rate_limited(self):
+        """Test that Retry-After responses are retried after sleeping."""
+        FakeGitHub.runs[0]["conclusion"] = "success"
+        FakeGitHub.rate_limited = 2
+        sleeps = []
+        with self.client(sleep=sleeps.append) as client:
+            run = client.first_green_run("owner", "repo", "main")
+
+        self.assertEqual(run["head_sha"], "sha0")
+        self.assertEqual(sleeps, [0.0, 0.0])
+
+    def test_gives_up_after_retries(self):
+        """Test that persistent rate limiting surfaces as an API error."""
+        FakeGitHub.rate_limited = 10
+        with self.client(sleep=lambda s: None, max_retries=1) as client:
+            with self.assertRaises(RuntimeError) as context:
+                client.first_green_run("owner", "repo", "main")
+
+        self.assertIn("GitHub API error 429", str(context.exception))
+
+    def test_waits_for_exhausted_rate_limit(self):
+        """Test the proactive wait when the remaining quota is zero."""
+        sleeps = []
+        client = self.client(sleep=sleeps.append)
+        client.remaining = 0
+        client.reset = int(time.time()) + 30
+        client.wait_for_rate_limit()
+        self.assertEqual(len(sleeps), 1)
+
+        client.remaining = 0
+        client.reset = int(time.time()) + 3600
+        with self.assertRaises(RuntimeError):
+            client.wait_for_rate_limit()
+        client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
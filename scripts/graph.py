@@ -0,0 +1,108 @@
+# Dependency graph between services, built from the Buildfile `dependencies` fields
+
+from collections import deque
+from typing import Dict, List, Optional
+
+
+class DependencyCycleError(RuntimeError):
+    def __init__(self, cycle: List[str]):
+        self.cycle = cycle
+        super().__init__(f"Dependency cycle detected: {' -> '.join(cycle)}")
+
+
+def service_dependencies(service) -> List[str]:
+    return service.field("dependencies") or []
+
+
+class DependencyGraph:
+    def __init__(self, services: list):
+        self.services = list(services)
+        self.position = {}
+        # Names are not guaranteed unique, so every index maps to a list of services
+        self.by_name: Dict[str, list] = {}
+        self.dependents: Dict[str, list] = {}
+        for position, service in enumerate(self.services):
+            self.position.setdefault(service, position)
+            self.by_name.setdefault(service.name, []).append(service)
+            for dependency in dict.fromkeys(service_dependencies(service)):
+                self.dependents.setdefault(dependency, []).append(service)
+
+    def get(self, name: str) -> list:
+        return self.by_name.get(name, [])
+
+    def affected(self, changed: list) -> list:
+        """Return the changed services followed by everything that transitively depends on them."""
+        seen = set(changed)
+        queue = deque(changed)
+        found = []
+        while queue:
+            service = queue.popleft()
+            for dependent in self.dependents.get(service.name, []):
+                if dependent not in seen:
+                    seen.add(dependent)
+                    found.append(dependent)
+                    queue.append(dependent)
+        found.sort(key=lambda s: self.position.get(s, len(self.position)))
+        return list(changed) + found
+
+    def find_cycle(self, services: Optional[list] = None) -> Optional[List[str]]:
+        members = set(self.services if services is None else services)
+        state = {}
+        for start in (self.services if services is None else services):
+            if start in state:
+                continue
+            # Iterative DFS, state 1 = on the current path, 2 = finished
+            path = [start]
+            state[start] = 1
+            stack = [iter(self._edges(start, members))]
+            while stack:
+                nxt = next(stack[-1], None)
+                if nxt is None:
+                    state[path.pop()] = 2
+                    stack.pop()
+                elif state.get(nxt) == 1:
+                    cycle = path[path.index(nxt):] + [nxt]
+                    return [s.name for s in cycle]
+                elif nxt not in state:
+                    state[nxt] = 1
+                    path.append(nxt)
+                    stack.append(iter(self._edges(nxt, members)))
+        return None
+
+    def waves(self, services: Optional[list] = None) -> List[list]:
+        """Group services into topological waves.
+
+        Every service only depends on services from earlier waves, so the members of
+        a wave can be built in parallel. Dependencies outside `services` are treated
+        as already built.
+        """
+        members = list(dict.fromkeys(self.services if services is None else services))
+        member_set = set(members)
+        indegree = {service: 0 for service in members}
+        for service in members:
+            for dependency in self._edges(service, member_set):
+                indegree[service] += 1
+        current = [service for service in members if indegree[service] == 0]
+        waves = []
+        done = 0
+        while current:
+            waves.append(current)
+            done += len(current)
+            following = []
+            for service in current:
+                for dependent in self.dependents.get(service.name, []):
+                    if dependent in member_set:
+                        indegree[dependent] -= 1
+                        if indegree[dependent] == 0:
+                            following.append(dependent)
+            following.sort(key=lambda s: self.position.get(s, len(self.position)))
+            current = following
+        if done != len(members):
+            raise DependencyCycleError(self.find_cycle(members) or [])
+        return waves
+
+    def _edges(self, service, members: set) -> list:
+        edges = []
+        for dependency in dict.fromkeys(service_dependencies(service)):
+            edges.extend(s for s in self.get(dependency) if s in members)
+        return edges
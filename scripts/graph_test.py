@@ -0,0 +1,91 @@
+import unittest
+from graph import DependencyGraph, DependencyCycleError
+from services import Service
+
+
+def service(name, dependencies=None):
+    return Service(f"services/{name}", fields={'name': name, 'dependencies': dependencies})
+
+
+class TestDependencyGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.x = service('X')
+        self.a = service('A', ['X'])
+        self.d = service('D', ['A'])
+        self.b = service('B')
+        self.e = service('E', ['A', 'B'])
+        self.graph = DependencyGraph([self.x, self.a, self.d, self.b, self.e])
+
+    def test_name_index(self):
+        """Test looking up services by name."""
+        self.assertEqual(self.graph.get('A'), [self.a])
+        self.assertEqual(self.graph.get('missing'), [])
+
+    def test_reverse_index(self):
+        """Test the reverse-dependency adjacency index."""
+        self.assertEqual(self.graph.dependents['A'], [self.d, self.e])
+        self.assertEqual(self.graph.dependents['X'], [self.a])
+
+    def test_affected_is_transitive(self):
+        """Test that a change reaches dependents of dependents."""
+        affected = self.graph.affected([self.x])
+
+        self.assertEqual(affected, [self.x, self.a, self.d, self.e])
+
+    def test_affected_without_dependents(self):
+        """Test that a leaf change only returns itself."""
+        self.assertEqual(self.graph.affected([self.d]), [self.d])
+
+    def test_affected_ignores_unknown_dependencies(self):
+        """Test that dependencies on unknown names are ignored."""
+        orphan = service('O', ['unknown'])
+        graph = DependencyGraph([orphan])
+
+        self.assertEqual(graph.affected([orphan]), [orphan])
+        self.assertEqual(graph.waves(), [[orphan]])
+
+    def test_affected_terminates_on_cycles(self):
+        """Test that the closure terminates when the graph has a cycle."""
+        p = service('P', ['Q'])
+        q = service('Q', ['P'])
+        graph = DependencyGraph([p, q])
+
+        self.assertEqual(graph.affected([p]), [p, q])
+
+    def test_waves(self):
+        """Test topological waves over the whole graph."""
+        waves = self.graph.waves()
+
+        self.assertEqual(waves, [[self.x, self.b], [self.a], [self.d, self.e]])
+
+    def test_waves_for_subset(self):
+        """Test that dependencies outside the subset count as built."""
+        waves = self.graph.waves([self.d, self.a])
+
+        self.assertEqual(waves, [[self.a], [self.d]])
+
+    def test_find_cycle(self):
+        """Test cycle detection."""
+        p = service('P', ['R'])
+        q = service('Q', ['P'])
+        r = service('R', ['Q'])
+        graph = DependencyGraph([p, q, r, service('S')])
+
+        self.assertIsNone(self.graph.find_cycle())
+        self.assertEqual(graph.find_cycle(), ['P', 'R', 'Q', 'P'])
+
+    def test_waves_raise_on_cycle(self):
+        """Test that waves cannot be computed for a cyclic graph."""
+        p = service('P', ['P'])
+        graph = DependencyGraph([p])
+
+        with self.assertRaises(DependencyCycleError) as context:
+            graph.waves()
+
+        self.assertEqual(context.exception.cycle, ['P', 'P'])
+        self.assertIn('P -> P', str(context.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# Workflow matrices of changed services crossed with the envs from envs.yaml they deploy to
+
+import fnmatch
+from typing import Dict, List, Optional
+
+# Service fields the env filters and expand read, kept in projected outputs when expanding
+FILTER_FIELDS = ("name", "team", "kind", "build_once")
+# Output groups with a separate publish matrix, whose services may be built once
+BUILD_ONCE = ("services",)
+
+
+def env_matches(env: dict, service: dict, branch: Optional[str]) -> bool:
+    """Whether an envs.yaml entry accepts a service on a branch.
+
+    Every filter an entry sets must match: `teams` and `kinds` list accepted
+    values, `branches` lists glob patterns (an unknown branch matches none),
+    `services` is an allow list and `exclude_services` a deny list of names.
+    """
+    name = service.get("name")
+    if "teams" in env and service.get("team") not in env["teams"]:
+        return False
+    if "kinds" in env and service.get("kind") not in env["kinds"]:
+        return False
+    if "branches" in env and (branch is None or not any(fnmatch.fnmatchcase(branch, pattern) for pattern in env["branches"])):
+        return False
+    if "services" in env and name not in env["services"]:
+        return False
+    if name in (env.get("exclude_services") or []):
+        return False
+    return True
+
+
+def service_envs(service: dict, envs: List[dict], branch: Optional[str]) -> List[str]:
+    return [env.get("name") for env in envs if env_matches(env, service, branch)]
+
+
+def expand(outputs: dict, envs: List[dict], branch: Optional[str]) -> Dict[str, list]:
+    """`{service, env}` include lists per output group, with only the pairs envs.yaml allows.
+
+    `matrix_<group>` lists every pair and drives the deploys, `matrix_build_<group>`
+    leaves out the services in the `skipped` output, whose artifacts were already
+    published, and their deploy pairs are marked `prebuilt`. Groups in BUILD_ONCE
+    also get a `matrix_publish_<group>` list whose pairs carry the env the
+    artifact was built in as `build_env`, so later targets load it.
+
+    A build may use env specific values (e.g. `ENV` in its Makefile or the save
+    state written for its env), so services are built in every env they deploy
+    to. Only a service whose Buildfile sets `build_once: true`, declaring its
+    build the same in every env, is built once in its first env.
+    """
+    skipped = set(outputs.get("skipped", []))
+    matrices = {}
+    for group in ("services", "infra", "docker"):
+        pairs = []
+        builds = []
+        publishes = []
+        for service in outputs.get(group, []):
+            names = service_envs(service, envs, branch)
+            if not names:
+                continue
+            if service.get("name") in skipped:
+                pairs.extend({"service": service, "env": name, "prebuilt": True} for name in names)
+            elif group in BUILD_ONCE:
+                once = service.get("build_once") is True
+                builds.extend({"service": service, "env": name} for name in (names[:1] if once else names))
+                built = [{"service": service, "env": name, "build_env": names[0] if once else name} for name in names]
+                publishes.extend(built)
+                pairs.extend(built)
+            else:
+                built = [{"service": service, "env": name} for name in names]
+                builds.extend(built)
+                pairs.extend(built)
+        matrices[f"matrix_build_{group}"] = builds
+        if group in BUILD_ONCE:
+            matrices[f"matrix_publish_{group}"] = publishes
+        matrices[f"matrix_{group}"] = pairs
+    return matrices
@@ -0,0 +1,115 @@
+import unittest
+
+from matrix import env_matches, expand, service_envs
+
+
+API = {'name': 'api', 'team': 'backend', 'kind': 'go', 'build_once': True}
+WEB = {'name': 'web', 'team': 'frontend', 'kind': 'node'}
+NET = {'name': 'net', 'team': 'sre', 'kind': 'terraform'}
+
+
+class TestEnvMatches(unittest.TestCase):
+
+    def test_no_filters(self):
+        """Test that an env without filters accepts every service."""
+        self.assertTrue(env_matches({'name': 'dev'}, API, None))
+
+    def test_filters(self):
+        """Test that every filter set on an env must match."""
+        self.assertTrue(env_matches({'teams': ['backend'], 'kinds': ['go']}, API, 'main'))
+        self.assertFalse(env_matches({'teams': ['backend'], 'kinds': ['node']}, API, 'main'))
+        self.assertFalse(env_matches({'teams': ['frontend']}, API, 'main'))
+        self.assertTrue(env_matches({'services': ['api']}, API, 'main'))
+        self.assertFalse(env_matches({'services': ['web']}, API, 'main'))
+        self.assertFalse(env_matches({'exclude_services': ['api']}, API, 'main'))
+
+    def test_branches(self):
+        """Test branch globs, and that an unknown branch matches no pattern."""
+        env = {'branches': ['main', 'release/*']}
+
+        self.assertTrue(env_matches(env, API, 'release/1.2'))
+        self.assertFalse(env_matches(env, API, 'feature/x'))
+        self.assertFalse(env_matches(env, API, None))
+
+
+class TestExpand(unittest.TestCase):
+
+    ENVS = [
+        {'name': 'dev'},
+        {'name': 'staging', 'exclude_services': ['web']},
+        {'name': 'prod', 'branches': ['main'], 'teams': ['backend', 'sre']},
+    ]
+
+    def test_service_envs(self):
+        """Test that env order from envs.yaml is kept."""
+        self.assertEqual(service_envs(API, self.ENVS, 'main'), ['dev', 'staging', 'prod'])
+        self.assertEqual(service_envs(WEB, self.ENVS, 'main'), ['dev'])
+
+    def test_expand(self):
+        """Test that only allowed pairs are listed and build_once services are built once."""
+        matrices = expand({'services': [API, WEB], 'infra': [NET], 'docker': []}, self.ENVS, 'feature/x')
+
+        self.assertEqual(matrices['matrix_build_services'], [
+            {'service': API, 'env': 'dev'},
+            {'service': WEB, 'env': 'dev'},
+        ])
+        self.assertEqual(matrices['matrix_services'], [
+            {'service': API, 'env': 'dev', 'build_env': 'dev'},
+            {'service': API, 'env': 'staging', 'build_env': 'dev'},
+            {'service': WEB, 'env': 'dev', 'build_env': 'dev'},
+        ])
+        self.assertEqual(matrices['matrix_publish_services'], matrices['matrix_services'])
+        self.assertEqual(matrices['matrix_infra'], [
+            {'service': NET, 'env': 'dev'},
+            {'service': NET, 'env': 'staging'},
+        ])
+        self.assertEqual(matrices['matrix_build_infra'], matrices['matrix_infra'])
+        self.assertEqual(matrices['matrix_docker'], [])
+
+    def test_expand_builds_per_env(self):
+        """Test that a service without build_once is built, published and deployed per env."""
+        service = {'name': 'cron', 'team': 'backend', 'kind': 'go'}
+
+        matrices = expand({'services': [service]}, self.ENVS, 'main')
+
+        self.assertEqual(matrices['matrix_build_services'], [
+            {'service': service, 'env': 'dev'},
+            {'service': service, 'env': 'staging'},
+            {'service': service, 'env': 'prod'},
+        ])
+        self.assertEqual(matrices['matrix_services'], [
+            {'service': service, 'env': 'dev', 'build_env': 'dev'},
+            {'service': service, 'env': 'staging', 'build_env': 'staging'},
+            {'service': service, 'env': 'prod', 'build_env': 'prod'},
+        ])
+        self.assertEqual(matrices['matrix_publish_services'], matrices['matrix_services'])
+
+    def test_expand_skipped(self):
+        """Test that already built services are deployed but not built or published again."""
+        outputs = {'services': [API, WEB], 'infra': [NET], 'docker': [], 'skipped': ['api', 'net']}
+
+        matrices = expand(outputs, self.ENVS, 'feature/x')
+
+        self.assertEqual(matrices['matrix_build_services'], [{'service': WEB, 'env': 'dev'}])
+        self.assertEqual(matrices['matrix_publish_services'], [{'service': WEB, 'env': 'dev', 'build_env': 'dev'}])
+        self.assertEqual(matrices['matrix_services'], [
+            {'service': API, 'env': 'dev', 'prebuilt': True},
+            {'service': API, 'env': 'staging', 'prebuilt': True},
+            {'service': WEB, 'env': 'dev', 'build_env': 'dev'},
+        ])
+        self.assertEqual(matrices['matrix_build_infra'], [])
+        self.assertEqual(matrices['matrix_infra'], [
+            {'service': NET, 'env': 'dev', 'prebuilt': True},
+            {'service': NET, 'env': 'staging', 'prebuilt': True},
+        ])
+
+    def test_expand_without_envs(self):
+        """Test that a service no env accepts is left out entirely."""
+        matrices = expand({'services': [WEB]}, [{'name': 'prod', 'teams': ['backend']}], 'main')
+
+        self.assertEqual(matrices['matrix_build_services'], [])
+        self.assertEqual(matrices['matrix_services'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
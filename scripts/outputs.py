@@ -0,0 +1,53 @@
+# Streamed forms of the change-detection outputs, as NDJSON or one JSON file per output key
+
+import json
+import os
+from collections.abc import Iterator as LazyGroup
+from typing import IO, Dict, Iterator
+
+from atomicfile import write_atomic
+
+ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+
+def write_json(value, stream: IO[str]):
+    """Encode value chunk by chunk instead of building the whole document first.
+
+    A lazy group (an iterator of items) is written as an array, item by item.
+    """
+    if not isinstance(value, LazyGroup):
+        for chunk in ENCODER.iterencode(value):
+            stream.write(chunk)
+        return
+    stream.write("[")
+    for i, item in enumerate(value):
+        if i:
+            stream.write(",")
+        write_json(item, stream)
+    stream.write("]")
+
+
+def ndjson_lines(outputs: dict) -> Iterator[str]:
+    """One `{"key": ..., "value": ...}` line per item of list or lazy outputs, one per value otherwise."""
+    for key, value in outputs.items():
+        for item in (value if isinstance(value, (list, LazyGroup)) else [value]):
+            yield ENCODER.encode({"key": key, "value": item}) + "\n"
+
+
+def write_ndjson(outputs: dict, stream: IO[str]) -> int:
+    lines = 0
+    for line in ndjson_lines(outputs):
+        stream.write(line)
+        lines += 1
+    return lines
+
+
+def write_groups(outputs: dict, directory: str) -> Dict[str, str]:
+    """Write every output key to `<directory>/<key>.json`, returns the paths by key."""
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for key, value in outputs.items():
+        path = os.path.join(directory, f"{key}.json")
+        write_atomic(path, lambda f: write_json(value, f))
+        paths[key] = path
+    return paths
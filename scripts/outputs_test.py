@@ -0,0 +1,73 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from outputs import ndjson_lines, write_groups, write_json, write_ndjson
+
+
+OUTPUTS = {
+    'services': [{'name': 'a', 'path': 'services/a'}, {'name': 'b', 'path': 'services/b'}],
+    'infra': [],
+    'waves': [['a'], ['b']],
+    'base': 'abc',
+}
+
+
+class TestOutputs(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_write_json(self):
+        """Test that the streamed document is compact JSON."""
+        stream = io.StringIO()
+        write_json(OUTPUTS, stream)
+        self.assertEqual(stream.getvalue(), json.dumps(OUTPUTS, separators=(',', ':')))
+
+    def test_ndjson_lines(self):
+        """Test one line per list item and one per scalar output."""
+        lines = [json.loads(line) for line in ndjson_lines(OUTPUTS)]
+
+        self.assertEqual(lines, [
+            {'key': 'services', 'value': {'name': 'a', 'path': 'services/a'}},
+            {'key': 'services', 'value': {'name': 'b', 'path': 'services/b'}},
+            {'key': 'waves', 'value': ['a']},
+            {'key': 'waves', 'value': ['b']},
+            {'key': 'base', 'value': 'abc'},
+        ])
+        self.assertEqual(write_ndjson(OUTPUTS, io.StringIO()), 5)
+
+    def test_write_groups(self):
+        """Test that every output key gets its own JSON file."""
+        directory = os.path.join(self.temp_dir, 'out')
+
+        paths = write_groups(OUTPUTS, directory)
+
+        self.assertEqual(sorted(paths), ['base', 'infra', 'services', 'waves'])
+        for key, path in paths.items():
+            with open(path) as f:
+                self.assertEqual(json.load(f), OUTPUTS[key])
+        self.assertFalse([name for name in os.listdir(directory) if name.endswith('.tmp')])
+
+    def test_lazy_groups(self):
+        """Test that iterator outputs are written like the lists they produce."""
+        lazy = lambda: {**OUTPUTS, 'services': iter(OUTPUTS['services']), 'infra': iter([])}
+
+        stream = io.StringIO()
+        write_json(iter(OUTPUTS['services']), stream)
+        self.assertEqual(stream.getvalue(), json.dumps(OUTPUTS['services'], separators=(',', ':')))
+        self.assertEqual(list(ndjson_lines(lazy())), list(ndjson_lines(OUTPUTS)))
+        paths = write_groups(lazy(), os.path.join(self.temp_dir, 'out'))
+        for key, path in paths.items():
+            with open(path) as f:
+                self.assertEqual(json.load(f), OUTPUTS[key])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+# Times the change-detection pipeline of services.py on generated monorepos
+
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import services
+
+KINDS = ["go", "node", "python", "terraform", "docker"]
+TEAMS = ["backend", "frontend", "sre"]
+GIT_ENV = {
+    "GIT_AUTHOR_NAME": "bench", "GIT_AUTHOR_EMAIL": "bench@example.com",
+    "GIT_COMMITTER_NAME": "bench", "GIT_COMMITTER_EMAIL": "bench@example.com",
+}
+
+def git(root: str, *args: str):
+    subprocess.run(["git", *args], cwd=root, check=True, capture_output=True, env={**os.environ, **GIT_ENV})
+
+def write(path: str, content: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+def generate_monorepo(root: str, count: int, changed: int, chain: int = 5, seed: int = 0) -> dict:
+    """Create `count` services under root/services, committed to git, then commit `changed` edits.
+
+    Every `chain` consecutive services form a dependency chain, and services.yaml gets
+    a trigger rule per kind and per team. Returns the config and the changed paths.
+    """
+    rng = random.Random(seed)
+    names = [f"svc{i:05d}" for i in range(count)]
+    for i, name in enumerate(names):
+        lines = [f"name: {name}", f"kind: {KINDS[i % len(KINDS)]}", f"team: {TEAMS[i % len(TEAMS)]}",
+                 f"artifact: {name}_image", f"artifact_path: services/{name}/image.tar"]
+        if i % chain:
+            lines.append(f"dependencies: [{names[i - 1]}]")
+        write(os.path.join(root, "services", name, "Buildfile.yaml"), "\n".join(lines) + "\n")
+        write(os.path.join(root, "services", name, "main.txt"), f"{name}\n")
+    rules = [{"name": f"{kind} services", "selector": {"attributes": {"kind": kind}},
+              "trigger": {"files": [f"{kind}.Dockerfile"]}} for kind in KINDS]
+    rules += [{"name": f"{team} services", "selector": {"attributes": {"team": team}},
+               "trigger": {"files": [f"{team}.vars"]}} for team in TEAMS]
+    rules.append({"name": "all services", "selector": {"all": True}, "trigger": {"files": ["scripts/*.py"]}})
+    config = {"additional_services": rules}
+    write(os.path.join(root, "services.yaml"), json.dumps(config))
+    for kind in KINDS:
+        write(os.path.join(root, f"{kind}.Dockerfile"), f"FROM {kind}\n")
+    write(os.path.join(root, "envs.yaml"), "- name: dev\n")
+    git(root, "init", "-q", "-b", "main")
+    git(root, "add", "-A")
+    git(root, "commit", "-q", "-m", "services")
+
+    changes = [f"services/{name}/main.txt" for name in rng.sample(names, min(changed, count))]
+    changes.append(f"{KINDS[0]}.Dockerfile")
+    for change in changes:
+        with open(os.path.join(root, change), "a") as f:
+            f.write("changed\n")
+    git(root, "commit", "-q", "-am", "changes")
+    return {"config": config, "changes": changes}
+
+def timed(fn: Callable, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(samples), 2)
+
+def retained_kib(fn: Callable) -> float:
+    """Memory still allocated by the result of fn once it returns, in KiB."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = fn()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    return round((after - before) / 1024, 1)
+
+def unit(stage: str) -> str:
+    return "KiB" if stage.endswith("_kib") else "ms"
+
+def bench_size(count: int, changed: int, repeat: int) -> Dict[str, float]:
+    root = tempfile.mkdtemp(prefix=f"services-bench-{count}-")
+    cwd = os.getcwd()
+    try:
+        repo = generate_monorepo(root, count, changed)
+        config, changes = repo["config"], repo["changes"]
+        os.chdir(root)
+        all_services = services.detect_services(config)
+        parallel = {**config, "discovery": {"workers": max(2, os.cpu_count() or 1)}}
+        selectors = [rule["selector"] for rule in config["additional_services"]]
+        return {
+            "detect_services": timed(lambda: services.detect_services(config), repeat),
+            "detect_services_workers": timed(lambda: services.detect_services(parallel), repeat),
+            "get_changed_services": timed(lambda: services.get_changed_services(changes, config), repeat),
+            "get_services_by_selector": timed(
+                lambda: [services.get_services_by_selector(selector, all_services) for selector in selectors], repeat),
+            "compare_services": timed(lambda: services.compare_services("HEAD~1", config), repeat),
+            "detect_services_kib": retained_kib(lambda: services.detect_services(config)),
+        }
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+def compare_results(results: dict, baseline: dict, tolerance: float, min_ms: float) -> List[str]:
+    """Stages that got slower, or retain more memory, than the baseline by more than
+    tolerance (and min_ms of noise for timings)."""
+    regressions = []
+    for size, stages in results.items():
+        for stage, value in stages.items():
+            before = baseline.get(size, {}).get(stage)
+            if before is None:
+                continue
+            noise = min_ms if unit(stage) == "ms" else 0
+            if value > before * (1 + tolerance) and value - before > noise:
+                regressions.append(f"{stage} at {size} services: {before}{unit(stage)} -> {value}{unit(stage)}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the change-detection pipeline on synthetic monorepos")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000], help="Number of services per repo")
+    parser.add_argument("--changed", type=int, default=20, help="Changed service files per repo")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage, the median is reported")
+    parser.add_argument("--output", type=str, help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", type=str, help="Fail when a stage is slower or retains more memory than in this results file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown relative to the baseline")
+    parser.add_argument("--min-ms", type=float, default=5.0, help="Slowdowns below this many milliseconds are noise")
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes:
+        results[str(size)] = bench_size(size, args.changed, args.repeat)
+        print(f"{size:>6} services  " + "  ".join(f"{stage} {value:.1f}{unit(stage)}" for stage, value in results[str(size)].items()))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare_results(results, json.load(f), args.tolerance, args.min_ms)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
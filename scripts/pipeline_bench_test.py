@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pipeline_bench import compare_results, generate_monorepo, retained_kib
+from services import detect_services, get_changed_services
+
+
+class TestGenerateMonorepo(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.temp_dir)
+
+    def test_generate_monorepo(self):
+        """Test that the generated repo has the requested services, chains and changes."""
+        repo = generate_monorepo(self.temp_dir, 12, 3, chain=4)
+        os.chdir(self.temp_dir)
+
+        services = detect_services(repo['config'])
+
+        self.assertEqual(len(services), 12)
+        by_name = {s.data['name']: s for s in services}
+        self.assertNotIn('dependencies', by_name['svc00004'].data)
+        self.assertEqual(by_name['svc00005'].data['dependencies'], ['svc00004'])
+        self.assertEqual(len(repo['changes']), 4)
+        changed = get_changed_services(repo['changes'], repo['config'])
+        # go.Dockerfile is changed, so every go service is selected
+        self.assertTrue({'svc00000', 'svc00005', 'svc00010'} <= {s.data['name'] for s in changed['services']})
+        self.assertGreater(retained_kib(lambda: detect_services(repo['config'])), 0)
+
+
+class TestCompareResults(unittest.TestCase):
+
+    def test_compare_results(self):
+        """Test that only slowdowns beyond the tolerance and the noise floor are regressions."""
+        baseline = {'10': {'detect_services': 2.0}, '1000': {'detect_services': 100.0, 'compare_services': 100.0}}
+        results = {
+            '10': {'detect_services': 4.0},
+            '1000': {'detect_services': 130.0, 'compare_services': 110.0, 'get_services_by_selector': 50.0},
+        }
+
+        regressions = compare_results(results, baseline, tolerance=0.2, min_ms=5.0)
+
+        self.assertEqual(regressions, ['detect_services at 1000 services: 100.0ms -> 130.0ms'])
+
+    def test_compare_results_memory(self):
+        """Test that memory growth beyond the tolerance is a regression without a noise floor."""
+        baseline = {'10': {'detect_services_kib': 10.0}, '1000': {'detect_services_kib': 1000.0}}
+        results = {'10': {'detect_services_kib': 13.0}, '1000': {'detect_services_kib': 1100.0}}
+
+        regressions = compare_results(results, baseline, tolerance=0.2, min_ms=5.0)
+
+        self.assertEqual(regressions, ['detect_services_kib at 10 services: 10.0KiB -> 13.0KiB'])
+
+
+if __name__ == '__main__':
+    unittest.main()
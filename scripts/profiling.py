@@ -0,0 +1,108 @@
+# cProfile and per-stage wall-clock breakdown of a services.py run, see --profile
+
+import cProfile
+import os
+import sys
+import threading
+import time
+from typing import Dict, Optional, TextIO
+
+from telemetry import tracer
+
+# Span names by pipeline stage, time in other spans or outside any span is `other`
+STAGES = {
+    "find_buildfiles": "discovery",
+    "load_buildfile": "buildfile parse",
+    # With discovery workers the walk and the parsing overlap in one span
+    "load_services": "buildfile parse",
+    "resolve_saved_values": "makeTarget",
+    "run_make": "makeTarget",
+    "run_git": "git",
+    "git_batch": "git",
+    "github_get": "github api",
+    "list_runs": "github api",
+    "match_triggers": "matching",
+    "match_paths": "matching",
+    "select_changed_services": "matching",
+    "get_services_by_selector": "selector expansion",
+    "changed_output": "output",
+    "write_github_output": "output",
+}
+
+
+class StageClock:
+    """Exclusive wall-clock time per span name, on the thread that started it.
+
+    Spans of worker threads (e.g. parallel make targets) are left out, their
+    time shows up in the span the main thread waits in.
+    """
+    def __init__(self):
+        self.thread = threading.get_ident()
+        self.started = time.perf_counter()
+        self.stack = []
+        self.totals: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+
+    def enter(self, name: str) -> bool:
+        if threading.get_ident() != self.thread:
+            return False
+        self.stack.append([name, time.perf_counter(), 0.0])
+        return True
+
+    def exit(self):
+        name, started, children = self.stack.pop()
+        elapsed = time.perf_counter() - started
+        self.totals[name] = self.totals.get(name, 0.0) + elapsed - children
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+    def stages(self) -> Dict[str, float]:
+        """Seconds per stage, `other` makes them add up to the wall-clock time so far."""
+        stages = {}
+        for name, seconds in self.totals.items():
+            stage = STAGES.get(name, "other")
+            stages[stage] = stages.get(stage, 0.0) + seconds
+        wall = time.perf_counter() - self.started
+        stages["other"] = stages.get("other", 0.0) + wall - sum(stages.values())
+        return stages
+
+    def report(self) -> str:
+        stages = self.stages()
+        wall = sum(stages.values()) or 1.0
+        lines = [f"{'stage':<20}{'ms':>10}{'%':>7}"]
+        for stage, seconds in sorted(stages.items(), key=lambda item: -item[1]):
+            lines.append(f"{stage:<20}{seconds * 1000:>10.1f}{seconds / wall * 100:>7.1f}")
+        lines.append(f"{'total':<20}{wall * 1000:>10.1f}")
+        return "\n".join(lines) + "\n"
+
+
+class Session:
+    """Runs cProfile and a StageClock until stop, which writes `<path>` (pstats)
+    and `<path without extension>.stages.txt`, and prints the breakdown."""
+    def __init__(self, path: str):
+        self.path = path
+        self.profiler = cProfile.Profile()
+        self.clock: Optional[StageClock] = None
+
+    def start(self) -> "Session":
+        self.clock = StageClock()
+        tracer.clock = self.clock
+        self.profiler.enable()
+        return self
+
+    def stop(self, stream: TextIO = sys.stderr) -> Optional[str]:
+        if self.clock is None:
+            return None
+        self.profiler.disable()
+        tracer.clock = None
+        report = self.clock.report()
+        self.clock = None
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.profiler.dump_stats(self.path)
+        with open(f"{os.path.splitext(self.path)[0]}.stages.txt", "w") as f:
+            f.write(report)
+        stream.write(report)
+        return report
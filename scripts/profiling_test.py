@@ -0,0 +1,71 @@
+import io
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from profiling import Session, StageClock
+from telemetry import tracer
+
+
+class TestStageClock(unittest.TestCase):
+
+    def test_exclusive_stage_times(self):
+        """Test that nested spans are not counted twice and the rest is other."""
+        ticks = [0.0, 1.0, 2.0, 5.0, 6.0, 10.0]
+        with patch('profiling.time.perf_counter', side_effect=ticks):
+            clock = StageClock()
+            clock.enter('find_buildfiles')
+            clock.enter('load_buildfile')
+            clock.exit()
+            clock.exit()
+            stages = clock.stages()
+
+        self.assertEqual(stages, {'discovery': 2.0, 'buildfile parse': 3.0, 'other': 5.0})
+        self.assertEqual(clock.calls, {'load_buildfile': 1, 'find_buildfiles': 1})
+
+    def test_other_threads_ignored(self):
+        """Test that spans of worker threads are left out."""
+        clock = StageClock()
+        entered = []
+        thread = threading.Thread(target=lambda: entered.append(clock.enter('run_make')))
+        thread.start()
+        thread.join()
+
+        self.assertEqual(entered, [False])
+        self.assertEqual(clock.stack, [])
+
+
+class TestSession(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        tracer.clock = None
+        shutil.rmtree(self.temp_dir)
+
+    def test_session(self):
+        """Test that spans are clocked while profiling and both files are written."""
+        path = os.path.join(self.temp_dir, 'profile', 'run.pstats')
+        stream = io.StringIO()
+
+        session = Session(path).start()
+        with tracer.start_as_current_span('match_paths'):
+            sum(range(1000))
+        report = session.stop(stream)
+
+        self.assertIsNone(tracer.clock)
+        self.assertIn('matching', report)
+        self.assertEqual(stream.getvalue(), report)
+        with open(os.path.join(self.temp_dir, 'profile', 'run.stages.txt')) as f:
+            self.assertEqual(f.read(), report)
+        self.assertGreater(pstats.Stats(path).total_calls, 0)
+        self.assertIsNone(session.stop(stream))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+# On-disk cache of change detection results per base/head commit pair
+
+import hashlib
+import json
+import os
+from typing import List, Optional
+
+from atomicfile import save_json
+
+
+class ResultCache:
+    """One JSON file per (base, head, config) entry in a directory, least recently
+    used entries are evicted once the directory grows beyond max_bytes.
+
+    File names are `<base>-<config hash>-<head>.json`, so the entries of a base can
+    be found without reading them when head has moved on.
+    """
+    VERSION = 1
+
+    def __init__(self, directory: str, max_bytes: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def config_hash(self, config: dict) -> str:
+        payload = json.dumps({"version": self.VERSION, "config": config}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+    def path(self, base: str, config_hash: str, head: str) -> str:
+        return os.path.join(self.directory, f"{base}-{config_hash}-{head}.json")
+
+    def get(self, base: str, config_hash: str, head: str) -> Optional[dict]:
+        path = self.path(base, config_hash, head)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, base: str, config_hash: str, head: str, entry: dict):
+        save_json(self.path(base, config_hash, head), entry, separators=(",", ":"))
+        self.evict()
+
+    def heads(self, base: str, config_hash: str, limit: int = 8) -> List[str]:
+        """Heads cached for a base, most recently used first."""
+        prefix = f"{base}-{config_hash}-"
+        candidates = []
+        for entry in self.entries():
+            if entry.name.startswith(prefix):
+                candidates.append((entry.stat().st_mtime_ns, entry.name[len(prefix):-len(".json")]))
+        candidates.sort(reverse=True)
+        return [head for _, head in candidates[:limit]]
+
+    def entries(self) -> list:
+        if not os.path.isdir(self.directory):
+            return []
+        return [entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")]
+
+    def evict(self):
+        entries = sorted(((entry.stat().st_mtime_ns, entry.stat().st_size, entry.path) for entry in self.entries()))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from resultcache import ResultCache
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = ResultCache(os.path.join(self.temp_dir, 'results'))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_round_trip(self):
+        """Test storing and reading an entry, with hit and miss counts."""
+        config_hash = self.cache.config_hash({'additional_services': []})
+        self.assertIsNone(self.cache.get('base', config_hash, 'head'))
+
+        self.cache.put('base', config_hash, 'head', {'changes': ['a'], 'output': {'services': []}})
+
+        self.assertEqual(self.cache.get('base', config_hash, 'head'), {'changes': ['a'], 'output': {'services': []}})
+        self.assertIsNone(self.cache.get('base', self.cache.config_hash({}), 'head'))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+    def test_heads(self):
+        """Test listing the cached heads of a base, most recently used first."""
+        self.cache.put('base', 'cfg', 'head1', {})
+        self.cache.put('base', 'cfg', 'head2', {})
+        self.cache.put('other', 'cfg', 'head3', {})
+        os.utime(self.cache.path('base', 'cfg', 'head2'), ns=(time.time_ns() - 10**9,) * 2)
+
+        self.assertEqual(self.cache.heads('base', 'cfg'), ['head1', 'head2'])
+
+    def test_evicts_least_recently_used(self):
+        """Test that the oldest entries are removed once the size bound is exceeded."""
+        cache = ResultCache(self.cache.directory, max_bytes=300)
+        now = time.time_ns()
+        for i in range(3):
+            cache.put('base', 'cfg', f'head{i}', {'changes': ['x' * 80]})
+            os.utime(cache.path('base', 'cfg', f'head{i}'), ns=(now - (10 - i) * 10**9,) * 2)
+        os.utime(cache.path('base', 'cfg', 'head0'), ns=(now - 10**9,) * 2)
+
+        cache.put('base', 'cfg', 'head3', {'changes': ['x' * 80]})
+
+        self.assertEqual(sorted(os.listdir(cache.directory)), ['base-cfg-head0.json', 'base-cfg-head2.json', 'base-cfg-head3.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
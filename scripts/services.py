@@ -1,38 +1,247 @@
 # This script is used to detect all services in the repository
 
 import argparse
-import os, yaml, json
-from typing_extensions import List
-import subprocess, requests
-from typing import Optional
+import fnmatch
+import hashlib
+import os, re, json
+import subprocess
+import sys
+from collections.abc import Mapping
+from typing import Iterable, Iterator, List, Optional
 
-from opentelemetry import trace
+from atomicfile import save_json
+from graph import DependencyCycleError, DependencyGraph, service_dependencies
+from telemetry import tracer, bounded, GIT_DURATION, MAKE_DURATION, SERVICES_SCANNED, CHANGED_FILES
 
-# Acquire a tracer
-tracer = trace.get_tracer("github-actions-srvices")
+# requests, yaml and opentelemetry are imported where they are used so that
+# cheap modes like --envs do not pay for them at start-up
+
+def yaml_load(stream):
+    import yaml
+    # libyaml's CSafeLoader is several times faster than the pure Python loader
+    return yaml.load(stream, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+
+def read_buildfile(buildfile: str, known_digest: Optional[str] = None) -> tuple:
+    """(mtime_ns, size, sha256, data) of a Buildfile, data is None when its content
+    hashes to known_digest and does not need parsing."""
+    st = os.stat(buildfile)
+    with open(buildfile, "rb") as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()
+    return st.st_mtime_ns, st.st_size, digest, None if digest == known_digest else yaml_load(content)
+
+def read_buildfiles(requests: List[tuple]) -> List[tuple]:
+    """read_buildfile over (buildfile, known_digest) pairs, run in discovery workers."""
+    return [read_buildfile(buildfile, known_digest) for buildfile, known_digest in requests]
+
+class ManifestCache:
+    """Parsed Buildfile data persisted between runs.
+
+    Entries are keyed by Buildfile path and validated by mtime and size first,
+    then by a content hash, so a fresh CI checkout (new mtimes) still reuses them.
+    Loaded data has its interned fields interned once here and is shared with the
+    cache, Service never modifies it.
+    """
+    VERSION = 1
 
-class Service:
     def __init__(self, path: str):
         self.path = path
-        with open(os.path.join(self.path, "Buildfile.yaml"), 'r') as f:
-            self.data = yaml.safe_load(f)
-            self.data["path"] = self.path
-        if "save" in self.data:
-            if isinstance(self.data["save"], list):
-                for i, item in enumerate(self.data["save"]):
+        self.entries = {}
+        self.seen = set()
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        if os.path.isfile(path):
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+                if data.get("version") == self.VERSION:
+                    self.entries = data.get("entries", {})
+                    for entry in self.entries.values():
+                        intern_fields(entry["data"])
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def load(self, buildfile: str) -> dict:
+        data = self.lookup(buildfile)
+        if data is not None:
+            return data
+        return self.store(buildfile, *read_buildfile(buildfile, self.digest(buildfile)))
+
+    def lookup(self, buildfile: str) -> Optional[dict]:
+        """Cached data when mtime and size still match, without reading the file."""
+        key = os.path.normpath(buildfile)
+        self.seen.add(key)
+        st = os.stat(buildfile)
+        entry = self.entries.get(key)
+        if entry and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size:
+            self.hits += 1
+            return entry["data"]
+        return None
+
+    def digest(self, buildfile: str) -> Optional[str]:
+        entry = self.entries.get(os.path.normpath(buildfile))
+        return entry["sha256"] if entry else None
+
+    def store(self, buildfile: str, mtime_ns: int, size: int, digest: str, data) -> dict:
+        """Record what read_buildfile returned, data is None when the digest was known."""
+        key = os.path.normpath(buildfile)
+        entry = self.entries.get(key)
+        if entry and entry["sha256"] == digest:
+            self.hits += 1
+            entry["mtime_ns"] = mtime_ns
+            entry["size"] = size
+            self.dirty = True
+            return entry["data"]
+        self.misses += 1
+        try:
+            json.dumps(data)
+        except (TypeError, ValueError):
+            # Not representable in the cache file (e.g. YAML timestamps), parse every time
+            self.entries.pop(key, None)
+            return data
+        intern_fields(data)
+        self.entries[key] = {"mtime_ns": mtime_ns, "size": size, "sha256": digest, "data": data}
+        self.dirty = True
+        return data
+
+    def save(self):
+        stale = set(self.entries) - self.seen
+        for key in stale:
+            del self.entries[key]
+        if not self.dirty and not stale:
+            return
+        save_json(self.path, {"version": self.VERSION, "entries": self.entries})
+        self.dirty = False
+
+INTERNED_FIELDS = ("name", "kind", "team")
+
+def intern_fields(fields):
+    """Intern the INTERNED_FIELDS of parsed Buildfile data in place."""
+    if isinstance(fields, dict):
+        for key in INTERNED_FIELDS:
+            if isinstance(fields.get(key), str):
+                fields[key] = sys.intern(fields[key])
+
+class ServiceData(Mapping):
+    """Read-only dict view of a Service, as the Buildfile plus path and the values
+    resolved since loading."""
+    __slots__ = ("service",)
+
+    def __init__(self, service: "Service"):
+        self.service = service
+
+    def __getitem__(self, key):
+        service = self.service
+        if key == "path":
+            return service.path
+        if key == "save" and service.saved:
+            return service.saved_items()
+        if key == "fingerprint" and service.fingerprint is not None:
+            return service.fingerprint
+        return service.fields[key]
+
+    def get(self, key, default=None):
+        return self.service.field(key, default)
+
+    def __iter__(self):
+        yield from (key for key in self.service.fields if key != "path")
+        yield "path"
+        if self.service.fingerprint is not None and "fingerprint" not in self.service.fields:
+            yield "fingerprint"
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+class Service:
+    """One Buildfile. Name, kind, team and path are interned, since thousands of
+    services share a handful of kinds and teams, and the parsed YAML is held as
+    loaded and never modified. Values of make targets and the build fingerprint
+    are kept next to it and merged in by to_dict.
+    """
+    __slots__ = ("path", "name", "kind", "team", "fields", "saved", "fingerprint", "resolved")
+    FROZEN = frozenset(("path", "name", "kind", "team", "fields"))
+
+    def __init__(self, path: str, cache: Optional[ManifestCache] = None, fields: Optional[dict] = None):
+        if fields is None:
+            buildfile = os.path.join(path, "Buildfile.yaml")
+            with tracer.start_as_current_span("load_buildfile") as span:
+                span.set_attribute("path", bounded(path))
+                if cache is not None:
+                    fields = cache.load(buildfile)
+                else:
+                    with open(buildfile, 'r') as f:
+                        fields = yaml_load(f)
+                    intern_fields(fields)
+        if any(isinstance(fields.get(key), str) and sys.intern(fields[key]) is not fields[key]
+               for key in INTERNED_FIELDS):
+            # The data may be shared (e.g. with the caller), intern into a copy
+            fields = dict(fields)
+            intern_fields(fields)
+        object.__setattr__(self, "path", sys.intern(path))
+        object.__setattr__(self, "name", fields.get("name"))
+        object.__setattr__(self, "kind", fields.get("kind"))
+        object.__setattr__(self, "team", fields.get("team"))
+        object.__setattr__(self, "fields", fields)
+        self.saved = None
+        self.fingerprint = None
+        # save values coming from make targets are resolved lazily, see resolve_saved_values
+        self.resolved = False
+
+    def __setattr__(self, name, value):
+        if name in Service.FROZEN:
+            raise AttributeError(f"Service.{name} is read-only")
+        object.__setattr__(self, name, value)
+
+    @property
+    def data(self) -> ServiceData:
+        return ServiceData(self)
+
+    def field(self, key: str, default=None):
+        """Same as data.get, without building the view."""
+        if key == "name" or key == "kind" or key == "team":
+            value = getattr(self, key)
+            return default if value is None else value
+        if key == "path":
+            return self.path
+        if key == "save" and self.saved:
+            return self.saved_items()
+        if key == "fingerprint" and self.fingerprint is not None:
+            return self.fingerprint
+        return self.fields.get(key, default)
+
+    def make_targets(self) -> List[tuple]:
+        targets = []
+        if "save" in self.fields:
+            if isinstance(self.fields["save"], list):
+                for i, item in enumerate(self.fields["save"]):
                     if isinstance(item, dict):
                         if "valueFrom" in item:
                             if "makeTarget" in item["valueFrom"]:
-                                target = item["valueFrom"]["makeTarget"]
-                                try:
-                                    out = subprocess.check_output(["make", target], shell=False, cwd=self.path, stderr=subprocess.STDOUT)
-                                    self.data["save"][i]["value"] = out.decode().strip()
-                                except subprocess.CalledProcessError as e:
-                                    msg = e.output.decode().strip()
-                                    raise RuntimeError(f"Make target '{target}' failed: {msg}") from e
+                                targets.append((i, item["valueFrom"]["makeTarget"]))
+        return targets
+
+    def save_value(self, i: int, value: str):
+        if self.saved is None:
+            self.saved = {}
+        self.saved[i] = value
+
+    def saved_items(self) -> list:
+        return [{**item, "value": self.saved[i]} if i in self.saved else item
+                for i, item in enumerate(self.fields["save"])]
+
+    def fresh(self) -> "Service":
+        """Copy sharing the loaded fields, without resolved values or fingerprint."""
+        clone = object.__new__(Service)
+        for name in Service.FROZEN:
+            object.__setattr__(clone, name, getattr(self, name))
+        clone.saved = None
+        clone.fingerprint = None
+        clone.resolved = False
+        return clone
 
     def __repr__(self):
-        return str(self.data)
+        return f"Service(name={self.name!r}, kind={self.kind!r}, path={self.path!r})"
 
     def __eq__(self, other):
         if not isinstance(other, Service):
@@ -41,32 +250,247 @@ class Service:
 
     def __hash__(self):
         return hash(self.path)
-    def to_dict(self):
-        return self.data
+
+    def to_dict(self, fields: Optional[List[str]] = None) -> dict:
+        """Buildfile data with resolved values, only the given fields when set."""
+        if not self.resolved:
+            resolve_saved_values([self])
+        data = self.data
+        if fields is None:
+            return dict(data)
+        return {field: data[field] for field in fields if field in data}
+
+DEFAULT_MAKE_WORKERS = min(8, (os.cpu_count() or 1) + 4)
+
+def run_make(target: str, cwd: str, env: Optional[dict] = None) -> str:
+    with tracer.start_as_current_span("run_make") as span, MAKE_DURATION.time({"target": bounded(target)}):
+        span.set_attribute("target", bounded(target))
+        span.set_attribute("cwd", bounded(cwd))
+        try:
+            out = subprocess.check_output(["make", target], shell=False, cwd=cwd, stderr=subprocess.STDOUT, env=env)
+            return out.decode().strip()
+        except subprocess.CalledProcessError as e:
+            msg = e.output.decode().strip()
+            span.set_attribute("error", bounded(msg))
+            raise RuntimeError(f"Make target '{target}' failed: {msg}") from e
+
+def make_env() -> Optional[dict]:
+    # Every Makefile derives VERSION from `git describe` with `?=`, so computing it
+    # once and passing it through the environment saves a git call per target
+    if "VERSION" in os.environ:
+        return None
+    try:
+        version = run_git("describe", "--tags", "--always", "--dirty")
+    except (RuntimeError, OSError):
+        version = "dev"
+    return {**os.environ, "VERSION": version}
+
+def resolve_saved_values(services: List[Service], workers: Optional[int] = None) -> List[Service]:
+    jobs = [(service, i, target) for service in services if not service.resolved for i, target in service.make_targets()]
+    if jobs:
+        with tracer.start_as_current_span("resolve_saved_values") as span:
+            span.set_attribute("targets", len(jobs))
+            env = make_env()
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=min(workers or DEFAULT_MAKE_WORKERS, len(jobs))) as pool:
+                futures = [pool.submit(run_make, target, service.path, env) for service, _, target in jobs]
+                # Collect in submission order so the reported failure is the same one
+                # the sequential resolution would have hit first
+                for (service, i, _), future in zip(jobs, futures):
+                    try:
+                        service.save_value(i, future.result())
+                    except RuntimeError:
+                        pool.shutdown(wait=True, cancel_futures=True)
+                        raise
+    for service in services:
+        service.resolved = True
+    return services
 
 GITHUB_API = "https://api.github.com"
 
 def run_git(*args: str, cwd: Optional[str] = None) -> str:
-    with tracer.start_as_current_span("run_git") as span:
-        span.set_attribute("args", args)
-        span.set_attribute("cwd", cwd)
+    command = args[0] if args else ""
+    with tracer.start_as_current_span("run_git") as span, GIT_DURATION.time({"command": command}):
+        span.set_attribute("command", command)
+        span.set_attribute("args", bounded(args))
+        span.set_attribute("cwd", bounded(cwd))
         try:
             out = subprocess.check_output(["git", *args], cwd=cwd, stderr=subprocess.STDOUT)
             return out.decode().strip()
         except subprocess.CalledProcessError as e:
             msg = e.output.decode().strip()
-            span.set_attribute("error", msg)
+            span.set_attribute("error", bounded(msg))
             raise RuntimeError(f"git {' '.join(args)} failed: {msg}") from e
 
+_git_batch = None
+
+def git_batch():
+    """Shared long-lived git processes, closed when the interpreter exits."""
+    global _git_batch
+    if _git_batch is None:
+        import atexit
+        from gitbatch import GitBatch
+        _git_batch = GitBatch()
+        atexit.register(_git_batch.close)
+    return _git_batch
+
+
+BUILDFILE = "Buildfile.yaml"
+DEFAULT_EXCLUDES = [".git", "node_modules", ".terraform"]
+DEFAULT_IGNORE_FILES = [".gitignore", ".dockerignore"]
+
+class IgnoreMatcher:
+    """Small subset of gitignore semantics, used to prune directories during discovery.
+
+    Patterns without a slash match a directory name at any depth, patterns with a
+    slash are anchored at the repository root, and a leading '!' re-includes.
+    """
+    def __init__(self, patterns: List[str]):
+        self.rules = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            negate = pattern.startswith("!")
+            if negate:
+                pattern = pattern[1:]
+            pattern = pattern.rstrip("/")
+            anchored = "/" in pattern
+            self.rules.append((pattern.lstrip("/"), anchored, negate))
+
+    def ignored(self, path: str) -> bool:
+        if path.startswith("./"):
+            path = path[2:]
+        name = os.path.basename(path)
+        ignored = False
+        for pattern, anchored, negate in self.rules:
+            if fnmatch.fnmatchcase(path if anchored else name, pattern):
+                ignored = not negate
+        return ignored
+
+    def ignored_tree(self, path: str) -> bool:
+        # A path is excluded when it or any of its parent directories is
+        parts = path.split("/")
+        return any(self.ignored("/".join(parts[:i])) for i in range(1, len(parts) + 1))
+
+def anchor_pattern(pattern: str) -> str:
+    """Pattern matched from the repository root only, as Docker reads .dockerignore."""
+    pattern = pattern.strip()
+    if not pattern or pattern.startswith("#"):
+        return pattern
+    negate = "!" if pattern.startswith("!") else ""
+    return negate + "/" + pattern[len(negate):].lstrip("/")
+
+def read_ignore_files(files: List[str], root: str = ".") -> List[str]:
+    patterns = []
+    for name in files:
+        path = os.path.join(root, name)
+        if os.path.isfile(path):
+            with open(path, "r") as f:
+                lines = [line.rstrip("\n") for line in f]
+            # .dockerignore patterns are relative to the build context, not names at any depth
+            if os.path.basename(name) == ".dockerignore":
+                lines = [anchor_pattern(line) for line in lines]
+            patterns.extend(lines)
+    return patterns
+
+def get_discovery_config(config: Optional[dict]) -> dict:
+    return (config or {}).get("discovery", {}) or {}
+
+def discovery_matcher(discovery: dict) -> IgnoreMatcher:
+    patterns = list(DEFAULT_EXCLUDES)
+    patterns.extend(read_ignore_files(discovery.get("ignore_files", DEFAULT_IGNORE_FILES)))
+    patterns.extend(discovery.get("exclude", []))
+    return IgnoreMatcher(patterns)
 
-def detect_services():
-    with tracer.start_as_current_span("detect_services"):
+def iter_walk_buildfiles(matcher: IgnoreMatcher) -> Iterator[str]:
+    for root, dirs, files in os.walk('.'):
+        # Prune in place so os.walk never descends into excluded directories
+        dirs[:] = sorted(d for d in dirs if not matcher.ignored(os.path.join(root, d)))
+        if BUILDFILE in files:
+            yield root
+
+def walk_buildfiles(matcher: IgnoreMatcher) -> List[str]:
+    return list(iter_walk_buildfiles(matcher))
+
+def git_buildfiles(matcher: IgnoreMatcher) -> List[str]:
+    out = run_git("ls-files", "-z", "--cached", "--others", "--exclude-standard", "--", f"*{BUILDFILE}")
+    paths = set()
+    for entry in out.split("\0"):
+        if os.path.basename(entry) != BUILDFILE or not os.path.isfile(entry):
+            continue
+        directory = os.path.dirname(entry)
+        if directory and matcher.ignored_tree(directory):
+            continue
+        paths.add(directory)
+    # Same pre-order as a sorted os.walk
+    return ["./" + d if d else "." for d in sorted(paths, key=lambda d: d.split("/") if d else [])]
+
+def find_buildfiles(config: Optional[dict] = None) -> List[str]:
+    with tracer.start_as_current_span("find_buildfiles"):
+        discovery = get_discovery_config(config)
+        matcher = discovery_matcher(discovery)
+        if discovery.get("backend", "walk") == "git":
+            return git_buildfiles(matcher)
+        return walk_buildfiles(matcher)
+
+def iter_buildfiles(config: Optional[dict] = None) -> Iterator[str]:
+    """find_buildfiles, yielding each directory as soon as the walk reaches it."""
+    discovery = get_discovery_config(config)
+    if discovery.get("backend", "walk") == "git":
+        return iter(find_buildfiles(config))
+    return iter_walk_buildfiles(discovery_matcher(discovery))
+
+# Buildfiles handed to a discovery worker at a time
+LOAD_CHUNK = 64
+
+def load_services(paths: Iterable[str], cache: Optional[ManifestCache], workers: int) -> List[Service]:
+    """Services of the directories, in their order, parsed by a pool of worker processes.
+
+    Chunks are submitted while paths are still being produced, so parsing overlaps
+    the walk. Manifest cache hits by mtime and size are answered in this process.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from itertools import islice
+    paths = iter(paths)
+    chunks = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            chunk = list(islice(paths, LOAD_CHUNK))
+            if not chunk:
+                break
+            cached = [cache.lookup(os.path.join(path, BUILDFILE)) if cache is not None else None for path in chunk]
+            requests = [(os.path.join(path, BUILDFILE), cache.digest(os.path.join(path, BUILDFILE)) if cache is not None else None)
+                        for path, fields in zip(chunk, cached) if fields is None]
+            chunks.append((chunk, cached, pool.submit(read_buildfiles, requests) if requests else None))
         services = []
-        for root, dirs, files in os.walk('.'):
-            for file in files:
-                if file == "Buildfile.yaml":
-                    services.append(Service(root))
+        for chunk, cached, future in chunks:
+            loaded = iter(future.result() if future is not None else [])
+            for path, fields in zip(chunk, cached):
+                if fields is None:
+                    mtime_ns, size, digest, data = next(loaded)
+                    fields = cache.store(os.path.join(path, BUILDFILE), mtime_ns, size, digest, data) if cache is not None else data
+                services.append(Service(path, fields=fields))
+    return services
 
+def detect_services(config: Optional[dict] = None):
+    with tracer.start_as_current_span("detect_services") as span:
+        discovery = get_discovery_config(config)
+        span.set_attribute("backend", discovery.get("backend", "walk"))
+        cache = ManifestCache(discovery["manifest_cache"]) if discovery.get("manifest_cache") else None
+        workers = discovery.get("workers") or 0
+        if workers > 1:
+            span.set_attribute("workers", workers)
+            with tracer.start_as_current_span("load_services"):
+                services = load_services(iter_buildfiles(config), cache, workers)
+        else:
+            services = [Service(path, cache) for path in find_buildfiles(config)]
+        span.set_attribute("services", len(services))
+        SERVICES_SCANNED.add(len(services), {"backend": discovery.get("backend", "walk")})
+        if cache is not None:
+            span.set_attribute("manifest_cache.hits", cache.hits)
+            span.set_attribute("manifest_cache.misses", cache.misses)
+            cache.save()
         return services
 
 def is_sub_path(path1 : str, path2 : str) -> bool:
@@ -80,58 +504,506 @@ def changed_service(path : str, changes : List[str]) -> bool:
             return True
     return False
 
+def path_components(path: str) -> List[str]:
+    parts = [part for part in path.split("/") if part not in ("", ".")]
+    return ["/"] + parts if path.startswith("/") else parts
+
+class PathIndex:
+    """Prefix trie over service paths.
+
+    Maps a changed file to the services that contain it in O(path depth), with the
+    same answers as checking is_sub_path against every service.
+    """
+    def __init__(self, services: List[Service]):
+        self.root = {}
+        self.order = {}
+        for position, service in enumerate(services):
+            path = service.path[2:] if service.path.startswith("./") else service.path
+            components = path_components(path)
+            # is_sub_path compares against the normalised common path, so paths
+            # that are not already normalised (e.g. a trailing slash) never match
+            if ("/" + "/".join(components[1:]) if components[:1] == ["/"] else "/".join(components)) != path:
+                continue
+            node = self.root
+            for component in components:
+                node = node.setdefault(component, {})
+            node.setdefault(None, []).append(service)
+            self.order.setdefault(service, position)
+
+    def match(self, change: str) -> List[Service]:
+        node = self.root
+        # services registered at the root are relative and never contain absolute paths
+        matched = [] if change.startswith("/") else list(node.get(None, []))
+        for component in path_components(change):
+            node = node.get(component)
+            if node is None:
+                break
+            matched.extend(node.get(None, []))
+        return matched
+
+    def changed(self, changes: List[str]) -> List[Service]:
+        matched = set()
+        for change in set(changes):
+            matched.update(self.match(change))
+        return sorted(matched, key=self.order.__getitem__)
+
 def get_triggers(config):
     return config.get("files", [])
 
-def get_services_by_selector(selector, services) -> List[Service]:
-    with tracer.start_as_current_span("get_services_by_selector") as span:
+def get_trigger_regexes(config):
+    return config.get("regex", [])
+
+def glob_to_regex(pattern: str) -> str:
+    # `*` and `?` stay inside one path segment, `**` spans segments
+    if pattern.startswith("./"):
+        pattern = pattern[2:]
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            out.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            out.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2:]:
+            end = pattern.index("]", i + 2)
+            body = pattern[i + 1:end]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            out.append("[" + body.replace("\\", "\\\\") + "]")
+            i = end + 1
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(out)
+
+# Group numbers shift once patterns are joined, so backreferences would point at the wrong group
+BACKREFERENCE = re.compile(r"\\[1-9]|\(\?P=")
+
+def combined_pattern(patterns: List[re.Pattern]) -> Optional[re.Pattern]:
+    """One alternation of the patterns, None when they cannot be joined safely
+    (backreferences, a group name used twice or an inline global flag)."""
+    if any(BACKREFERENCE.search(p.pattern) for p in patterns):
+        return None
+    try:
+        return re.compile("|".join(f"(?:{p.pattern})" for p in patterns))
+    except re.error:
+        return None
+
+class TriggerMatcher:
+    """Matches changed files against every trigger pattern in one pass.
+
+    Plain file names go into a set. Globs and regexes are compiled one by one,
+    those compiled patterns decide a match. When they can be joined, a single
+    alternation of them rejects non-matching files before the individual
+    patterns are consulted.
+    """
+    def __init__(self):
+        self.literals = {}
+        self.patterns = []
+        self.combined = None
+        self.prefilter = False
+
+    def add_glob(self, pattern: str, key):
+        if not any(c in pattern for c in "*?["):
+            self.literals.setdefault(pattern[2:] if pattern.startswith("./") else pattern, set()).add(key)
+        else:
+            self.add_regex(glob_to_regex(pattern), key)
+
+    def add_regex(self, pattern: str, key):
+        self.patterns.append((re.compile(pattern), key))
+        self.combined = None
+        self.prefilter = False
+
+    def match(self, changes: List[str]) -> set:
+        matched = set()
+        for change in set(changes):
+            matched.update(self.match_path(change))
+        return matched
+
+    def match_path(self, path: str) -> List:
+        if not self.prefilter:
+            self.combined = combined_pattern([p for p, _ in self.patterns]) if self.patterns else None
+            self.prefilter = True
+        matched = list(self.literals.get(path, ()))
+        if self.patterns and (self.combined is None or self.combined.fullmatch(path)):
+            matched.extend(key for p, key in self.patterns if p.fullmatch(path))
+        return matched
+
+def freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+SELECTOR_KEYS = ("all", "attributes", "all_of", "any_of", "not")
+
+class AttributeIndex:
+    """Inverted index attribute -> value -> services used to answer selectors.
+
+    Attributes are indexed on first use, list-valued attributes are indexed
+    under each of their items.
+    """
+    def __init__(self, services: List[Service]):
+        self.services = services
+        self.position = {}
+        for position, service in enumerate(services):
+            self.position.setdefault(service, position)
+        self.attributes = {}
+
+    def attribute(self, name: str) -> dict:
+        if name not in self.attributes:
+            values = {}
+            for service in self.services:
+                value = service.field(name)
+                for item in (value if isinstance(value, list) else [value]):
+                    values.setdefault(freeze(item), set()).add(service)
+            self.attributes[name] = values
+        return self.attributes[name]
+
+    def lookup(self, name: str, value) -> set:
+        values = self.attribute(name)
+        matched = set()
+        for item in (value if isinstance(value, list) else [value]):
+            matched |= values.get(freeze(item), set())
+        return matched
+
+    def select(self, selector: dict) -> set:
+        unknown = set(selector) - set(SELECTOR_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown selector keys: {', '.join(sorted(unknown))}")
+        # Clauses at the same level are combined with AND, an empty selector matches nothing
+        clauses = []
         if selector.get("all"):
+            clauses.append(set(self.position))
+        if "attributes" in selector:
+            # Attributes of a single selector are OR'ed, as they always have been
+            matched = set()
+            for attribute_name, attribute_value in selector["attributes"].items():
+                matched |= self.lookup(attribute_name, attribute_value)
+            clauses.append(matched)
+        if "all_of" in selector:
+            matched = set(self.position)
+            for sub in selector["all_of"]:
+                matched &= self.select(sub)
+            clauses.append(matched)
+        if "any_of" in selector:
+            matched = set()
+            for sub in selector["any_of"]:
+                matched |= self.select(sub)
+            clauses.append(matched)
+        if "not" in selector:
+            clauses.append(set(self.position) - self.select(selector["not"]))
+        if not clauses:
+            return set()
+        return set.intersection(*clauses)
+
+    def ordered(self, services: set) -> List[Service]:
+        return sorted(services, key=self.position.__getitem__)
+
+def get_services_by_selector(selector, services, index: Optional[AttributeIndex] = None) -> List[Service]:
+    with tracer.start_as_current_span("get_services_by_selector") as span:
+        if selector.get("all") and len(selector) == 1:
             span.set_attribute("all", True)
             return services
-        span.set_attribute("selector", selector)
-        ret = []
-        for attribute_name, attribute_value in selector.get("attributes", {}).items():
-            for service in services:
-                if service.data.get(attribute_name) == attribute_value:
-                    ret.append(service)
-        return ret
+        span.set_attribute("selector", bounded(json.dumps(selector, sort_keys=True)))
+        if index is None:
+            index = AttributeIndex(services)
+        return index.ordered(index.select(selector))
+
+def trigger_matcher(services: List[Service], rules: list) -> TriggerMatcher:
+    """Matcher keyed by ("rule", i) for additional_services triggers and ("inputs", i) for Buildfile inputs."""
+    matcher = TriggerMatcher()
+    for i, c in enumerate(rules):
+        for pattern in get_triggers(c.get("trigger", {})):
+            matcher.add_glob(pattern, ("rule", i))
+        for pattern in get_trigger_regexes(c.get("trigger", {})):
+            matcher.add_regex(pattern, ("rule", i))
+    for i, service in enumerate(services):
+        for pattern in service.field("inputs") or []:
+            matcher.add_glob(pattern, ("inputs", i))
+    return matcher
+
+def select_changed_services(services: List[Service], changes: List[str], config,
+                            index: Optional[AttributeIndex] = None) -> List[Service]:
+    with tracer.start_as_current_span("select_changed_services") as span:
+        span.set_attribute("changes", len(changes))
+        CHANGED_FILES.add(len(changes))
+        index = index or AttributeIndex(services)
+        rules = config.get("additional_services", [])
+        with tracer.start_as_current_span("match_triggers"):
+            matched = trigger_matcher(services, rules).match(changes)
+        additional_services = []
+        for i, c in enumerate(rules):
+            if ("rule", i) in matched:
+                additional_services.extend(get_services_by_selector(c.get("selector", {}), services, index))
+        # Services owning a changed path or declaring a matching input, plus everything
+        # that transitively depends on them
+        with tracer.start_as_current_span("match_paths"):
+            changed = set(PathIndex(services).changed(changes))
+        changed.update(services[i] for kind, i in matched if kind == "inputs")
+        changed_services = DependencyGraph(services).affected([service for service in services if service in changed])
+
+        # Use dict.fromkeys() to preserve order while removing duplicates
+        selected = list(dict.fromkeys(changed_services + additional_services))
+        span.set_attribute("selected", len(selected))
+        return selected
+
+PARTITIONS = {"terraform": "infra", "docker": "docker"}
+
+def partition_services(all_services: List[Service]) -> dict[str, List[Service]]:
+    partitions = {"services": [], "infra": [], "docker": []}
+    for service in all_services:
+        partitions[PARTITIONS.get(service.kind, "services")].append(service)
+    return partitions
 
 def get_changed_services(changes : List[str], config) -> dict[str, List[Service]]:
-    services = detect_services()
-    additional_services = []
-    for c in config.get("additional_services", []):
-        changed_files = get_triggers(c.get("trigger", {}))
-        if any(c in changes for c in changed_files):
-            additional_services.extend(get_services_by_selector(c.get("selector", {}), services))
-    changed_services = [service for service in services if changed_service(service.path, changes)]
+    services = detect_services(config)
+    return partition_services(select_changed_services(services, changes, config))
+
+def get_changed_services_per_baseline(change_sets: dict[str, List[str]], baselines: dict[str, str],
+                                      default_base: str, config,
+                                      services: Optional[List[Service]] = None) -> dict[str, List[Service]]:
+    if services is None:
+        services = detect_services(config)
+    index = AttributeIndex(services)
+    groups = {}
     for service in services:
-        if service.data.get("dependencies", []) != []:
-            for dependency in service.data["dependencies"]:
-                if dependency in [s.data.get("name") for s in changed_services]:
-                    changed_services.append(service)
-
-    # Use dict.fromkeys() to preserve order while removing duplicates
-    all_services = changed_services + additional_services
-    infra_services = [service for service in all_services if service.data.get("kind") == "terraform"]
-    docker_services = [service for service in all_services if service.data.get("kind") == "docker"]
-    rest_services = [service for service in all_services if service.data.get("kind") != "terraform" and service.data.get("kind") != "docker"]
-    return {
-        "services": list(dict.fromkeys(rest_services)),
-        "infra": list(dict.fromkeys(infra_services)),
-        "docker": list(dict.fromkeys(docker_services)),
-    }
-
-def compare_services(cmp : str, config):
-    with tracer.start_as_current_span("compare_services") as compare_services:
-        changes = run_git("diff", "--name-only", cmp)
-        compare_services.set_attribute("cmp", cmp)
-        changed_service = get_changed_services(changes.split("\n"), config)
+        groups.setdefault(baselines.get(service.name, default_base), set()).add(service)
+    # Every service is evaluated against the changes since its own baseline
+    selected = set()
+    for base, members in groups.items():
+        selected.update(s for s in select_changed_services(services, change_sets[base], config, index) if s in members)
+    return partition_services([service for service in services if service in selected])
+
+def tracked_files(rev: str = "HEAD") -> dict[str, str]:
+    """Every file committed at rev, mapped to its blob hash."""
+    files = {}
+    for entry in run_git("ls-tree", "-r", "-z", "--full-tree", rev).split("\0"):
+        if entry:
+            meta, _, path = entry.partition("\t")
+            files[path] = meta.split(" ")[2]
+    return files
+
+def service_fingerprints(services: List[Service], candidates: List[Service], config,
+                         rev: str = "HEAD") -> dict[Service, Optional[str]]:
+    """Input fingerprints of the candidates and everything they depend on.
+
+    A fingerprint covers the git tree of the service directory, the fingerprints
+    of its dependencies and the blobs of the trigger and input files that select it.
+    """
+    from fingerprints import fingerprint
+    graph = DependencyGraph(services)
+    needed = {}
+    stack = list(candidates)
+    while stack:
+        service = stack.pop()
+        if service not in needed:
+            needed[service] = {}
+            for name in service_dependencies(service):
+                stack.extend(graph.get(name))
+    rules = config.get("additional_services", [])
+    matcher = trigger_matcher(services, rules)
+    if matcher.literals or matcher.patterns:
+        index = AttributeIndex(services)
+        selected = {}
+        for path, blob in tracked_files(rev).items():
+            for kind, i in matcher.match_path(path):
+                if kind == "inputs":
+                    owners = [services[i]]
+                else:
+                    if i not in selected:
+                        selected[i] = get_services_by_selector(rules[i].get("selector", {}), services, index)
+                    owners = selected[i]
+                for service in owners:
+                    if service in needed:
+                        needed[service][path] = blob
+    try:
+        waves = graph.waves(list(needed))
+    except DependencyCycleError:
+        # A fingerprint inside a cycle would cover itself, without an order build everything
+        return {service: None for service in needed}
+    batch = git_batch()
+    fingerprints = {}
+    for wave in waves:
+        for service in wave:
+            tree = batch.resolve(f"{rev}:./{os.path.relpath(service.path)}", None)
+            dependencies = {name: [fingerprints[d] for d in graph.get(name)]
+                            for name in service_dependencies(service)}
+            fingerprints[service] = fingerprint(tree, dependencies, needed[service])
+    return fingerprints
+
+def already_built(changed_service: dict[str, List[Service]], services: List[Service], config,
+                  build_cache) -> List[str]:
+    """Names of the changed services whose artifacts were already published for the same inputs.
+
+    They stay in the outputs so they are still deployed, only the build and
+    publish matrices leave them out.
+    """
+    with tracer.start_as_current_span("already_built") as span:
+        selected = list(dict.fromkeys(changed_service["services"] + changed_service["infra"] + changed_service["docker"]))
+        candidates = [service for service in selected if service.field("artifact")]
+        fingerprints = service_fingerprints(services, candidates, config)
+        built = []
+        for service in candidates:
+            if fingerprints[service] is not None:
+                service.fingerprint = fingerprints[service]
+                if build_cache.built(fingerprints[service]):
+                    built.append(service.name)
+        span.set_attribute("skipped", len(built))
+        return built
+
+def dependency_waves(selected: List[Service]) -> List[List[str]]:
+    """Names of the selected services in topological waves, one wave when they have a cycle."""
+    try:
+        return [[service.name for service in wave] for wave in DependencyGraph(selected).waves()]
+    except DependencyCycleError as error:
+        # The waves are informational, a cycle must not fail the comparison
+        print(f"warning: {error}, reporting a single wave", file=sys.stderr)
+        return [[service.name for service in selected]]
+
+# Fields read back from the outputs by --record-built
+REQUIRED_FIELDS = ("name", "fingerprint")
+
+def output_fields(fields: Optional[List[str]]) -> Optional[List[str]]:
+    if fields is None:
+        return None
+    return list(dict.fromkeys([*fields, *REQUIRED_FIELDS]))
+
+def changed_output(changed_service: dict[str, List[Service]], make_workers: Optional[int] = None,
+                   fields: Optional[List[str]] = None, lazy: bool = False) -> dict:
+    """Service groups and waves of the changed services.
+
+    With lazy the groups are generators that project each service only when
+    the writer reaches it, so they can be consumed once.
+    """
+    with tracer.start_as_current_span("changed_output"):
+        selected = list(dict.fromkeys(changed_service["services"] + changed_service["infra"] + changed_service["docker"]))
+        # Only the selected services pay for their make targets
+        resolve_saved_values(selected, make_workers)
+        fields = output_fields(fields)
+
+        def project(members: List[Service]):
+            dicts = (service.to_dict(fields) for service in members)
+            return dicts if lazy else list(dicts)
+
         return {
-            "services": [service.to_dict() for service in changed_service["services"]],
-            "infra": [service.to_dict() for service in changed_service["infra"]],
-            "docker": [service.to_dict() for service in changed_service["docker"]],
+            "services": project(changed_service["services"]),
+            "infra": project(changed_service["infra"]),
+            "docker": project(changed_service["docker"]),
+            "waves": dependency_waves(selected),
         }
 
+def compare_services(cmp : str, config, make_workers: Optional[int] = None, build_cache=None,
+                     services: Optional[List[Service]] = None, fields: Optional[List[str]] = None,
+                     lazy: bool = False):
+    with tracer.start_as_current_span("compare_services") as compare_services:
+        changes = diff_names(cmp)
+        compare_services.set_attribute("cmp", cmp)
+        if services is None:
+            services = detect_services(config)
+        changed_service = partition_services(select_changed_services(services, changes, config))
+        return built_output(changed_service, services, config, make_workers, build_cache, fields, lazy)
+
+def diff_names(*revs: str) -> List[str]:
+    """Paths changed between the revisions, NUL separated so git does not quote unusual names."""
+    return [name for name in run_git("diff", "--name-only", "-z", *revs).split("\0") if name]
+
+def commits_between(old: str, head: str) -> Optional[int]:
+    """Number of commits head is ahead of old, None when old is not an ancestor of head."""
+    try:
+        run_git("merge-base", "--is-ancestor", old, head)
+        return int(run_git("rev-list", "--count", f"{old}..{head}"))
+    except (RuntimeError, ValueError):
+        return None
+
+def cached_compare_services(cmp: str, config, result_cache, make_workers: Optional[int] = None,
+                            build_cache=None, max_advance: int = 20, fields: Optional[List[str]] = None):
+    """compare_services memoized per base/head commit pair.
+
+    Only used on a clean checkout, where head and the config determine every
+    Buildfile. When head moved on from a cached pair, the cached changes are
+    unioned with the diff of the new commits. The output itself is only kept
+    when no selected service has make targets, whose values (e.g. `git
+    describe` or a VERSION file) can change at the same head.
+    """
+    with tracer.start_as_current_span("cached_compare_services") as span:
+        if run_git("status", "--porcelain"):
+            span.set_attribute("dirty", True)
+            return compare_services(cmp, config, make_workers, build_cache, fields=fields)
+        base, head = run_git("rev-parse", f"{cmp}^{{commit}}", "HEAD").split("\n")
+        config_hash = result_cache.config_hash(config if fields is None else {**config, "output_fields": fields})
+        entry = result_cache.get(base, config_hash, head)
+        if entry is not None and entry.get("output") is not None and build_cache is None:
+            span.set_attribute("result_cache", "hit")
+            return entry["output"]
+        if entry is not None:
+            span.set_attribute("result_cache", "changes")
+            changes = entry["changes"]
+        else:
+            changes = None
+            advances = [(commits_between(old, head), old) for old in result_cache.heads(base, config_hash)]
+            advances = sorted((count, old) for count, old in advances if count is not None and count <= max_advance)
+            for _, old in advances:
+                previous = result_cache.get(base, config_hash, old)
+                if previous is not None:
+                    span.set_attribute("result_cache", "advance")
+                    changes = list(dict.fromkeys(previous["changes"] + diff_names(old, head)))
+                    break
+            if changes is None:
+                span.set_attribute("result_cache", "miss")
+                changes = diff_names(base)
+        services = detect_services(config)
+        changed_service = partition_services(select_changed_services(services, changes, config))
+        output = built_output(changed_service, services, config, make_workers, build_cache, fields)
+        # Outputs filtered by the build cache or holding make target values depend on more than the commit pair
+        volatile = build_cache is not None or any(service.make_targets() for members in changed_service.values() for service in members)
+        result_cache.put(base, config_hash, head, {"changes": changes, "output": None if volatile else output})
+        return output
+
+def compare_services_per_service(baselines: dict[str, str], default_base: str, config,
+                                 make_workers: Optional[int] = None,
+                                 services: Optional[List[Service]] = None,
+                                 build_cache=None, fields: Optional[List[str]] = None):
+    with tracer.start_as_current_span("compare_services_per_service") as span:
+        bases = [default_base] + [base for base in baselines.values() if base != default_base]
+        span.set_attribute("baselines", len(bases))
+        change_sets = git_batch().diff_many(bases)
+        if services is None:
+            services = detect_services(config)
+        changed_service = get_changed_services_per_baseline(change_sets, baselines, default_base, config, services)
+        return built_output(changed_service, services, config, make_workers, build_cache, fields)
+
+def built_output(changed_service: dict[str, List[Service]], services: List[Service], config,
+                 make_workers: Optional[int] = None, build_cache=None, fields: Optional[List[str]] = None,
+                 lazy: bool = False) -> dict:
+    if build_cache is None:
+        return changed_output(changed_service, make_workers, fields, lazy)
+    skipped = already_built(changed_service, services, config, build_cache)
+    return {**changed_output(changed_service, make_workers, fields, lazy), "skipped": skipped}
+
+def record_built(build_cache, groups: List[list]) -> int:
+    """Record the fingerprints of published services from matrix JSON groups."""
+    recorded = 0
+    for group in groups:
+        for service in group:
+            if service.get("fingerprint") and service.get("artifact"):
+                build_cache.record(service["fingerprint"], service.get("name"), service.get("artifact"))
+                recorded += 1
+    build_cache.save()
+    return recorded
+
+def current_commit() -> str:
+    return run_git("rev-parse", "HEAD")
+
 def previous_commit() -> str:
     return run_git("rev-parse", "HEAD~1")
 
@@ -146,47 +1018,159 @@ def list_runs(owner: str, repo: str, branch: str, token: str,
               workflow_id: Optional[int] = None,
               workflow_ref: Optional[str] = None,
               per_page: int = 50) -> list:
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/vnd.github+json",
-    }
-
-    # If a specific workflow is given (file name or ID), use the workflow-runs endpoint for that workflow.
-    if workflow_id is not None or workflow_ref is not None:
-        workflow_part = str(workflow_id) if workflow_id is not None else workflow_ref
-        url = f"{GITHUB_API}/repos/{owner}/{repo}/actions/workflows/{workflow_part}/runs"
-        params = {"branch": branch, "status": "completed", "per_page": per_page}
-    else:
-        # Otherwise query all workflow runs for the repo
-        url = f"{GITHUB_API}/repos/{owner}/{repo}/actions/runs"
-        params = {"branch": branch, "status": "completed", "per_page": per_page}
-
-    resp = requests.get(url, headers=headers, params=params, timeout=30)
-    if resp.status_code != 200:
-        raise RuntimeError(f"GitHub API error {resp.status_code}: {resp.text}")
-
-    data = resp.json()
-    runs = data.get("workflow_runs", [])
-    return runs
+    """The first page of completed runs on branch, newest first."""
+    with github_client(token) as client:
+        return list(client.iter_runs(owner, repo, branch, workflow_id, workflow_ref, per_page, max_pages=1))
 
 def get_last_green_commit(owner: str, repo: str, branch: str, token: str,
                           workflow: Optional[str] = None,
-                          workflow_id: Optional[int] = None) -> str:
-    runs = list_runs(owner, repo, branch, token, workflow_id=workflow_id, workflow_ref=workflow)
-    run = pick_first_success_run(runs)
+                          workflow_id: Optional[int] = None,
+                          client=None) -> str:
+    if client is not None:
+        # Pages through the run history until the first green run
+        run = client.first_green_run(owner, repo, branch, workflow_id=workflow_id, workflow_ref=workflow)
+    else:
+        runs = list_runs(owner, repo, branch, token, workflow_id=workflow_id, workflow_ref=workflow)
+        run = pick_first_success_run(runs)
     if not run:
         return previous_commit()
     return run.get("head_sha")
 
+def load_envs() -> List[dict]:
+    """envs.yaml entries, with the filters matrix.expand applies."""
+    with open("envs.yaml", "r") as f:
+        return yaml_load(f) or []
+
 def get_envs():
     with tracer.start_as_current_span("get_envs"):
         envs = []
-        with open("envs.yaml", "r") as f:
-            data = yaml.safe_load(f)
-            for env in data:
-                envs.append(env.get("name"))
+        for env in load_envs():
+            envs.append(env.get("name"))
         return envs
 
+def commit_exists(commit: str) -> bool:
+    return git_batch().commit_exists(commit)
+
+def github_client(token: str, cache_path: Optional[str] = None):
+    from github_client import GitHubClient
+    return GitHubClient(token, api=GITHUB_API, cache_path=cache_path)
+
+def resolve_baseline(owner: str, repo: str, branch: str, token: str,
+                     workflow: Optional[str] = None, default_branch: str = "main",
+                     github_cache: Optional[str] = None) -> str:
+    with tracer.start_as_current_span("resolve_baseline") as span:
+        with github_client(token, github_cache) as client:
+            commit = get_last_green_commit(owner, repo, branch, token, workflow, client=client)
+        if not commit_exists(commit):
+            # The last green commit is not part of this checkout (e.g. force-pushed away),
+            # compare with the fork point from the default branch instead
+            span.set_attribute("fallback", True)
+            run_git("fetch", "origin", default_branch)
+            commit = run_git("merge-base", "HEAD", f"origin/{default_branch}")
+        span.set_attribute("commit", commit)
+        return commit
+
+def resolve_service_baselines(owner: str, repo: str, branch: str, token: str, services: List[Service],
+                              workflow: Optional[str] = None, github_cache: Optional[str] = None,
+                              baseline_cache: Optional[str] = None, default_branch: str = "main") -> dict[str, str]:
+    with tracer.start_as_current_span("resolve_service_baselines") as span:
+        from baselines import BaselineResolver, expected_targets
+        # Publish and deploy only run on the default branch, a service is green there once deployed
+        targets = {service.name: expected_targets(group, branch == default_branch)
+                   for group, members in partition_services(services).items() for service in members}
+        with github_client(token, github_cache) as client:
+            resolver = BaselineResolver(client, baseline_cache)
+            baselines = resolver.resolve(owner, repo, branch, list(targets), get_envs(), workflow, targets)
+            resolver.save()
+        # Commits that are gone from this checkout cannot be diffed against
+        baselines = {name: commit for name, commit in baselines.items() if commit_exists(commit)}
+        span.set_attribute("resolved", len(baselines))
+        return baselines
+
+def plan_fields(fields: Optional[List[str]], expand_envs: bool) -> Optional[List[str]]:
+    if expand_envs and fields is not None:
+        from matrix import FILTER_FIELDS
+        return list(dict.fromkeys([*fields, *FILTER_FIELDS]))
+    return fields
+
+def plan_outputs(outputs: dict, changed: dict, branch: Optional[str], expand_envs: bool = False) -> dict:
+    """Add the branch, changed services and envs (or env matrices) to outputs."""
+    with tracer.start_as_current_span("plan_outputs") as span:
+        if branch is not None:
+            outputs["GIT_BRANCH"] = branch
+        outputs.update(changed)
+        if expand_envs:
+            import matrix
+            envs = load_envs()
+            matrices = matrix.expand(changed, envs, branch)
+            span.set_attribute("pairs", sum(len(pairs) for pairs in matrices.values()))
+            outputs.update(matrices)
+            outputs["envs"] = [env.get("name") for env in envs]
+        else:
+            outputs["envs"] = get_envs()
+        return outputs
+
+def plan(base: str, branch: Optional[str], config, make_workers: Optional[int] = None,
+         baselines: Optional[dict] = None, services: Optional[List[Service]] = None,
+         build_cache=None, result_cache=None,
+         fields: Optional[List[str]] = None, expand_envs: bool = False) -> dict:
+    with tracer.start_as_current_span("plan"):
+        fields = plan_fields(fields, expand_envs)
+        if baselines is None and result_cache is not None:
+            changed = cached_compare_services(base, config, result_cache, make_workers, build_cache, fields=fields)
+        elif baselines is None:
+            changed = compare_services(base, config, make_workers, build_cache, fields=fields)
+        else:
+            changed = compare_services_per_service(baselines, base, config, make_workers, services, build_cache, fields)
+        outputs = {"base": base}
+        if baselines is not None:
+            outputs["baselines"] = baselines
+        return plan_outputs(outputs, changed, branch, expand_envs)
+
+def dispatch_plan(requested: List[dict], branch: Optional[str], config, make_workers: Optional[int] = None,
+                  fields: Optional[List[str]] = None, expand_envs: bool = False) -> dict:
+    """The plan outputs for services picked by hand, each given by name or path, without diffing."""
+    with tracer.start_as_current_span("dispatch_plan") as span:
+        span.set_attribute("requested", len(requested))
+        fields = plan_fields(fields, expand_envs)
+        services = detect_services(config)
+        by_name = {service.name: service for service in services}
+        by_path = {os.path.normpath(service.path): service for service in services}
+        selected = []
+        for entry in requested:
+            service = by_name.get(entry.get("name")) or by_path.get(os.path.normpath(entry.get("path") or "."))
+            if service is None:
+                raise ValueError(f"Unknown service {json.dumps(entry)}")
+            selected.append(service)
+        changed = changed_output(partition_services(list(dict.fromkeys(selected))), make_workers, fields)
+        return plan_outputs({}, changed, branch, expand_envs=expand_envs)
+
+def format_outputs(outputs: dict) -> str:
+    lines = []
+    for key, value in outputs.items():
+        if not isinstance(value, str):
+            value = json.dumps(value, separators=(",", ":"))
+        lines.append(f"{key}={value}\n")
+    return "".join(lines)
+
+def write_github_output(outputs: dict, path: Optional[str] = None):
+    with tracer.start_as_current_span("write_github_output"):
+        path = path or os.environ.get("GITHUB_OUTPUT")
+        text = format_outputs(outputs)
+        if path:
+            with open(path, "a") as f:
+                f.write(text)
+        return text
+
+# Socket of the `--serve` daemon, relative to the checkout
+DAEMON_SOCKET = os.path.join(".cache", "services", "daemon.sock")
+
+def load_config(path: str) -> dict:
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r") as f:
+        return yaml_load(f) or {}
+
 def main():
     with tracer.start_as_current_span("main") as span:
         parser = argparse.ArgumentParser(description='Detect services in the repository')
@@ -199,19 +1183,82 @@ def main():
         parser.add_argument("--repo", type=str, help="Github repository name")
         parser.add_argument("--owner", type=str, help="Github repository owner")
         parser.add_argument("--workflow", type=str, help="Github workflow name")
+        parser.add_argument("--manifest-cache", type=str, help="File used to cache parsed Buildfiles between runs")
+        parser.add_argument("--discovery-workers", type=int, help="Processes parsing Buildfiles during discovery, overrides discovery.workers (0 or 1 parses in this process)")
+        parser.add_argument("--make-workers", type=int, help="Number of make targets resolved concurrently", default=DEFAULT_MAKE_WORKERS)
+        parser.add_argument("--plan", action="store_true", help="Resolve the baseline, changed services and envs and write them to GITHUB_OUTPUT")
+        parser.add_argument("--base", type=str, help="Baseline commit for --plan, skips the last green lookup")
+        parser.add_argument("--dispatch", type=str, help="Like --plan for a JSON list of services given by name or path, without diffing")
+        parser.add_argument("--github-cache", type=str, help="File used to cache GitHub API responses for conditional requests")
+        parser.add_argument("--per-service", action="store_true", help="With --plan, diff every service against its own last green commit")
+        parser.add_argument("--baseline-cache", type=str, help="File used to cache job conclusions for --per-service")
+        parser.add_argument("--default-branch", type=str, help="Branch to fork from when the last green commit is missing", default="main")
+        parser.add_argument("--build-cache", type=str, help="File of fingerprints already built, matching services are left out of --plan")
+        parser.add_argument("--record-built", type=str, nargs="+", help="JSON service lists whose fingerprints are added to --build-cache")
+        parser.add_argument("--result-cache", type=str, help="Directory caching --cmp/--plan results per base/head commit pair")
+        parser.add_argument("--serve", action="store_true", help="Keep the service index in memory and answer --all/--envs/--cmp over a Unix socket")
+        parser.add_argument("--socket", type=str, help="Unix socket of the --serve daemon", default=DAEMON_SOCKET)
+        parser.add_argument("--no-daemon", action="store_true", help="Do not ask a running --serve daemon")
+        parser.add_argument("--fields", type=str, help="Comma-separated Buildfile fields kept in --all/--cmp/--plan service lists (name and fingerprint are always kept)")
+        parser.add_argument("--format", type=str, choices=["json", "ndjson"], default="json", help="--cmp output as one JSON document or one line per service")
+        parser.add_argument("--expand-envs", action="store_true", help="With --plan, also output matrix_* include lists of the service/env pairs envs.yaml allows")
+        parser.add_argument("--profile", type=str, nargs="?", const="services.pstats", help="Run under cProfile, write the stats to this file and print the time spent per stage")
+        parser.add_argument("--output-dir", type=str, help="Write every --cmp/--plan output key to <dir>/<key>.json")
         args = parser.parse_args()
+        if args.profile:
+            import atexit
+            import profiling
+            atexit.register(profiling.Session(args.profile).start().stop)
+        fields = [field.strip() for field in args.fields.split(",") if field.strip()] if args.fields else None
+
+        def config_with_cache():
+            config = load_config(args.config)
+            if args.manifest_cache:
+                config["discovery"] = {**get_discovery_config(config), "manifest_cache": args.manifest_cache}
+            if args.discovery_workers is not None:
+                config["discovery"] = {**get_discovery_config(config), "workers": args.discovery_workers}
+            return config
+
+        def from_daemon(command: str, **request):
+            # Only pay for the client when a daemon has left its socket behind
+            if args.no_daemon or not os.path.exists(args.socket):
+                return None
+            import daemon
+            result = daemon.query({"command": command, "config": args.config, "make_workers": args.make_workers, **request}, args.socket)
+            span.set_attribute("daemon", result is not None)
+            return result
 
+        if args.serve:
+            import daemon
+            daemon.serve(args.socket, args.config)
         if args.all:
             span.set_attribute("all", True)
-            print(detect_services())
+            result = from_daemon("all", fields=output_fields(fields))
+            print(result if result is not None else [service.to_dict(output_fields(fields)) for service in resolve_saved_values(detect_services(config_with_cache()), args.make_workers)])
         if args.envs:
             span.set_attribute("envs", True)
-            print(get_envs())
+            result = from_daemon("envs")
+            print(result if result is not None else get_envs())
         if args.cmp:
             span.set_attribute("cmp", args.cmp)
-            with open(args.config, "r") as f:
-                config = yaml.safe_load(f)
-                print(json.dumps(compare_services(args.cmp, config)))
+            result = from_daemon("cmp", cmp=args.cmp, fields=fields)
+            if result is None and args.result_cache:
+                from resultcache import ResultCache
+                result = cached_compare_services(args.cmp, config_with_cache(), ResultCache(args.result_cache), args.make_workers,
+                                                 fields=fields)
+            elif result is None:
+                # The streamed formats write each service as it is projected
+                result = compare_services(args.cmp, config_with_cache(), args.make_workers, fields=fields,
+                                          lazy=bool(args.output_dir) or args.format == "ndjson")
+            if args.output_dir:
+                import outputs
+                print(json.dumps(outputs.write_groups(result, args.output_dir)))
+            elif args.format == "ndjson":
+                import outputs
+                outputs.write_ndjson(result, sys.stdout)
+            else:
+                json.dump(result, sys.stdout)
+                print()
         if args.last_green:
             span.set_attribute("last_green", True)
             if args.branch is None or args.repo is None or args.owner is None:
@@ -223,8 +1270,60 @@ def main():
             token = os.environ.get("GITHUB_TOKEN")
             if token is None:
                 raise ValueError("GITHUB_TOKEN environment variable is not set")
-            last_green_commit = get_last_green_commit(args.owner, args.repo, args.branch, token, args.workflow)
+            with github_client(token, args.github_cache) as client:
+                last_green_commit = get_last_green_commit(args.owner, args.repo, args.branch, token, args.workflow, client=client)
             print(last_green_commit)
+        if args.plan:
+            span.set_attribute("plan", True)
+            base = args.base
+            if base is None:
+                if args.branch is None or args.repo is None or args.owner is None:
+                    raise ValueError("Branch, repo and owner must be specified")
+                token = os.environ.get("GITHUB_TOKEN")
+                if token is None:
+                    raise ValueError("GITHUB_TOKEN environment variable is not set")
+                base = resolve_baseline(args.owner, args.repo, args.branch, token, args.workflow, args.default_branch, args.github_cache)
+            span.set_attribute("base", base)
+            config = config_with_cache()
+            baselines = None
+            services = None
+            if args.per_service:
+                if args.branch is None or args.repo is None or args.owner is None:
+                    raise ValueError("Branch, repo and owner must be specified")
+                token = os.environ.get("GITHUB_TOKEN")
+                if token is None:
+                    raise ValueError("GITHUB_TOKEN environment variable is not set")
+                services = detect_services(config)
+                baselines = resolve_service_baselines(args.owner, args.repo, args.branch, token, services,
+                                                      args.workflow, args.github_cache, args.baseline_cache,
+                                                      args.default_branch)
+            build_cache = None
+            if args.build_cache:
+                from fingerprints import BuildCache
+                build_cache = BuildCache(args.build_cache)
+            result_cache = None
+            if args.result_cache:
+                from resultcache import ResultCache
+                result_cache = ResultCache(args.result_cache)
+            planned = plan(base, args.branch, config, args.make_workers, baselines, services,
+                           build_cache, result_cache, fields, args.expand_envs)
+            if args.output_dir:
+                import outputs
+                outputs.write_groups(planned, args.output_dir)
+            print(write_github_output(planned), end="")
+        if args.dispatch:
+            span.set_attribute("dispatch", True)
+            planned = dispatch_plan(json.loads(args.dispatch), args.branch, config_with_cache(), args.make_workers,
+                                    fields, args.expand_envs)
+            if args.output_dir:
+                import outputs
+                outputs.write_groups(planned, args.output_dir)
+            print(write_github_output(planned), end="")
+        if args.record_built:
+            if args.build_cache is None:
+                raise ValueError("--build-cache must be specified")
+            from fingerprints import BuildCache
+            print(record_built(BuildCache(args.build_cache), [json.loads(group) for group in args.record_built]))
 
 if __name__ == '__main__':
     main()
@@ -9,8 +9,24 @@ from services import (
     get_triggers, get_services_by_selector,
     get_changed_services, compare_services, current_commit,
     pick_first_success_run, list_runs, get_last_green_commit,
-    run_git
+    run_git, IgnoreMatcher, find_buildfiles, ManifestCache,
+    resolve_saved_values, PathIndex, AttributeIndex,
+    glob_to_regex, TriggerMatcher, resolve_baseline, plan,
+    write_github_output, get_changed_services_per_baseline,
+    service_fingerprints, already_built, record_built, cached_compare_services,
+    partition_services, dispatch_plan
 )
+from fingerprints import BuildCache
+from resultcache import ResultCache
+from gitbatch import GitBatch
+import matrix
+import re
+import random
+import subprocess
+
+
+def make_service(path, fields):
+    return Service(path, fields=dict(fields))
 
 
 class TestService(unittest.TestCase):
@@ -46,6 +62,15 @@ class TestService(unittest.TestCase):
         self.assertEqual(service.data['team'], 'backend')
         self.assertEqual(service.data['path'], self.service_path)
 
+    def test_field_matches_data(self):
+        """Test that reading a field directly gives the same value as the data view."""
+        service = Service(self.service_path)
+        service.fingerprint = 'abc'
+
+        self.assertEqual({key: service.field(key) for key in service.data}, dict(service.data))
+        self.assertEqual(service.field('missing', 'default'), 'default')
+        self.assertEqual(partition_services([service])['services'], [service])
+
     def test_service_repr(self):
         """Test Service string representation."""
         service = Service(self.service_path)
@@ -81,6 +106,205 @@ class TestService(unittest.TestCase):
         service_set = {service1, service2}
         self.assertEqual(len(service_set), 1)
 
+    def test_service_fields_are_interned_and_read_only(self):
+        """Test that common fields are shared strings and cannot be reassigned."""
+        service1 = Service(self.service_path)
+        service2 = Service(self.service_path)
+
+        self.assertIs(service1.kind, service2.kind)
+        self.assertIs(service1.team, service2.team)
+        self.assertEqual(service1.name, 'test_service')
+        with self.assertRaises(AttributeError):
+            service1.kind = 'go'
+        with self.assertRaises(AttributeError):
+            service1.extra = True
+
+    def test_service_to_dict_is_a_copy(self):
+        """Test that to_dict builds a new dict with the fingerprint merged in."""
+        service = Service(self.service_path)
+        service.fingerprint = 'abc'
+
+        data = service.to_dict()
+        data['name'] = 'changed'
+        self.assertEqual(service.to_dict(), {**self.buildfile_data, 'path': self.service_path, 'fingerprint': 'abc'})
+        self.assertNotIn('fingerprint', service.fresh().to_dict())
+
+    def test_service_to_dict_fields(self):
+        """Test that to_dict keeps only the requested fields that are set."""
+        service = Service(self.service_path)
+
+        self.assertEqual(service.to_dict(['path', 'name', 'missing']),
+                         {'path': self.service_path, 'name': 'test_service'})
+
+
+class TestResolveSavedValues(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def create_service(self, name, makefile, targets):
+        path = os.path.join(self.temp_dir, name)
+        os.makedirs(path)
+        with open(os.path.join(path, "Makefile"), 'w') as f:
+            f.write(makefile)
+        save = [{'key': t, 'valueFrom': {'makeTarget': t}} for t in targets]
+        with open(os.path.join(path, "Buildfile.yaml"), 'w') as f:
+            yaml.dump({'name': name, 'save': [{'key': 'static', 'value': 'x'}] + save}, f)
+        return Service(path)
+
+    def test_make_targets_not_run_on_init(self):
+        """Test that constructing a Service does not run make."""
+        with patch('services.run_make') as mock_make:
+            service = self.create_service('svc', "version:\n\t@echo 1.2.3\n", ['version'])
+            mock_make.assert_not_called()
+        self.assertEqual(service.make_targets(), [(1, 'version')])
+        self.assertNotIn('value', service.data['save'][1])
+
+    def test_resolve_saved_values(self):
+        """Test that make output is stored as the save value."""
+        service = self.create_service('svc', "version:\n\t@echo 1.2.3\ncommit:\n\t@echo $(VERSION)\n", ['version', 'commit'])
+
+        with patch.dict(os.environ, {'VERSION': 'v9'}):
+            resolve_saved_values([service], workers=2)
+
+        self.assertEqual(service.data['save'][1]['value'], '1.2.3')
+        self.assertEqual(service.data['save'][2]['value'], 'v9')
+        self.assertTrue(service.resolved)
+
+    def test_to_dict_resolves_lazily_once(self):
+        """Test that to_dict resolves values on first use only."""
+        service = self.create_service('svc', "version:\n\t@echo 1.2.3\n", ['version'])
+        with patch('services.run_make', return_value='1.2.3') as mock_make:
+            self.assertEqual(service.to_dict()['save'][1]['value'], '1.2.3')
+            service.to_dict()
+            mock_make.assert_called_once()
+
+    def test_resolve_reports_first_failure_in_order(self):
+        """Test that the first failing target in service order is reported."""
+        first = self.create_service('a', "ok:\n\t@echo ok\nbad:\n\t@echo first-error; exit 1\n", ['ok', 'bad'])
+        second = self.create_service('b', "bad:\n\t@echo second-error; exit 1\n", ['bad'])
+
+        with self.assertRaises(RuntimeError) as context:
+            resolve_saved_values([first, second], workers=4)
+
+        self.assertIn("Make target 'bad' failed", str(context.exception))
+        self.assertIn('first-error', str(context.exception))
+
+    @patch('services.run_git')
+    @patch('services.detect_services')
+    def test_compare_services_resolves_only_selected(self, mock_detect_services, mock_run_git):
+        """Test that only services in the compare output run their make targets."""
+        selected = self.create_service('selected', "v:\n\t@echo 1\n", ['v'])
+        skipped = self.create_service('skipped', "v:\n\t@echo 2\n", ['v'])
+        mock_detect_services.return_value = [selected, skipped]
+        mock_run_git.return_value = os.path.join(selected.path, 'main.go')
+
+        with patch('services.run_make', return_value='1') as mock_make:
+            result = compare_services('HEAD~1', {'additional_services': []})
+
+        mock_make.assert_called_once_with('v', selected.path, unittest.mock.ANY)
+        self.assertEqual(result['services'][0]['save'][1]['value'], '1')
+        self.assertFalse(skipped.resolved)
+
+
+class TestManifestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.service_path = os.path.join(self.temp_dir, "svc")
+        os.makedirs(self.service_path)
+        self.buildfile = os.path.join(self.service_path, "Buildfile.yaml")
+        with open(self.buildfile, 'w') as f:
+            yaml.dump({'name': 'svc', 'kind': 'go'}, f)
+        self.cache_path = os.path.join(self.temp_dir, "cache", "manifests.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_cache_round_trip(self):
+        """Test that a second run is served from the cache file without parsing."""
+        cache = ManifestCache(self.cache_path)
+        Service(self.service_path, cache)
+        cache.save()
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+        cache = ManifestCache(self.cache_path)
+        with patch('services.yaml_load') as mock_load:
+            service = Service(self.service_path, cache)
+            mock_load.assert_not_called()
+        self.assertEqual(service.data['name'], 'svc')
+        self.assertEqual(service.data['path'], self.service_path)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+    def test_cached_data_is_read_only(self):
+        """Test that Services sharing cached data cannot modify it."""
+        cache = ManifestCache(self.cache_path)
+        with self.assertRaises(TypeError):
+            Service(self.service_path, cache).data['name'] = 'changed'
+        self.assertEqual(Service(self.service_path, cache).data['name'], 'svc')
+
+    def test_cached_data_is_interned_on_load(self):
+        """Test that Services share the interned cache entry and leave other data untouched."""
+        cache = ManifestCache(self.cache_path)
+        Service(self.service_path, cache)
+        cache.save()
+
+        cache = ManifestCache(self.cache_path)
+        data = cache.load(self.buildfile)
+        self.assertIs(Service(self.service_path, cache).fields, data)
+        self.assertIs(data['kind'], 'go')
+
+        kind = ''.join(['g', 'o'])
+        fields = {'name': 'svc', 'kind': kind}
+        service = Service(self.service_path, fields=fields)
+        self.assertIs(fields['kind'], kind)
+        self.assertIs(service.kind, 'go')
+
+    def test_cache_reuses_entry_when_only_mtime_changes(self):
+        """Test that a fresh checkout with new mtimes is validated by content hash."""
+        cache = ManifestCache(self.cache_path)
+        Service(self.service_path, cache)
+        cache.save()
+        os.utime(self.buildfile, ns=(1, 1))
+
+        cache = ManifestCache(self.cache_path)
+        Service(self.service_path, cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+    def test_cache_reparses_changed_buildfile(self):
+        """Test that a modified Buildfile is parsed again."""
+        cache = ManifestCache(self.cache_path)
+        Service(self.service_path, cache)
+        cache.save()
+        with open(self.buildfile, 'w') as f:
+            yaml.dump({'name': 'renamed', 'kind': 'go', 'team': 'sre'}, f)
+
+        cache = ManifestCache(self.cache_path)
+        service = Service(self.service_path, cache)
+        self.assertEqual(service.data['name'], 'renamed')
+        self.assertEqual(cache.misses, 1)
+
+    def test_cache_drops_removed_buildfiles(self):
+        """Test that entries for Buildfiles not seen in a run are pruned on save."""
+        cache = ManifestCache(self.cache_path)
+        Service(self.service_path, cache)
+        cache.save()
+
+        cache = ManifestCache(self.cache_path)
+        cache.save()
+        self.assertEqual(ManifestCache(self.cache_path).entries, {})
+
+    def test_cache_ignores_corrupt_file(self):
+        """Test that an unreadable cache file is treated as empty."""
+        os.makedirs(os.path.dirname(self.cache_path))
+        with open(self.cache_path, 'w') as f:
+            f.write('not json')
+        cache = ManifestCache(self.cache_path)
+        self.assertEqual(Service(self.service_path, cache).data['name'], 'svc')
+
 
 class TestRunGit(unittest.TestCase):
 
@@ -174,6 +398,85 @@ class TestDetectServices(unittest.TestCase):
         self.assertIn('service2', service_names)
         self.assertIn('service3', service_names)
 
+    def test_detect_services_prunes_default_excludes(self):
+        """Test that node_modules, .terraform and .git are never descended into."""
+        self.create_service('service1', {'name': 'service1'})
+        self.create_service('service1/node_modules/pkg', {'name': 'pkg'})
+        self.create_service('infra/.terraform/modules/m', {'name': 'module'})
+        self.create_service('.git/hooks', {'name': 'hooks'})
+
+        services = detect_services()
+
+        self.assertEqual([s.data['name'] for s in services], ['service1'])
+
+    def test_detect_services_honours_ignore_files(self):
+        """Test that .gitignore and .dockerignore directories are pruned."""
+        self.create_service('service1', {'name': 'service1'})
+        self.create_service('build/service2', {'name': 'service2'})
+        self.create_service('dist/service3', {'name': 'service3'})
+        with open(os.path.join(self.temp_dir, '.gitignore'), 'w') as f:
+            f.write("# comment\n/build/\n")
+        with open(os.path.join(self.temp_dir, '.dockerignore'), 'w') as f:
+            f.write("dist\n")
+
+        services = detect_services()
+
+        self.assertEqual([s.data['name'] for s in services], ['service1'])
+
+    def test_detect_services_dockerignore_is_anchored(self):
+        """Test that .dockerignore names only match at the repository root."""
+        self.create_service('dist/service1', {'name': 'service1'})
+        self.create_service('services/dist', {'name': 'service2'})
+        self.create_service('services/tmp', {'name': 'service3'})
+        with open(os.path.join(self.temp_dir, '.dockerignore'), 'w') as f:
+            f.write("dist\n/tmp\n")
+
+        services = detect_services()
+
+        self.assertEqual([s.data['name'] for s in services], ['service2', 'service3'])
+
+    def test_detect_services_config_exclude(self):
+        """Test that the exclude list from services.yaml prunes directories."""
+        self.create_service('service1', {'name': 'service1'})
+        self.create_service('examples/service2', {'name': 'service2'})
+
+        services = detect_services({'discovery': {'exclude': ['examples']}})
+
+        self.assertEqual([s.data['name'] for s in services], ['service1'])
+
+    def test_find_buildfiles_git_backend_matches_walk(self):
+        """Test that the git index backend returns the same paths as the walk."""
+        self.create_service('b', {'name': 'b'})
+        self.create_service('a/nested', {'name': 'nested'})
+        self.create_service('a-x', {'name': 'ax'})
+        self.create_service('a', {'name': 'a'})
+        self.create_service('untracked', {'name': 'untracked'})
+        self.create_service('b/node_modules/pkg', {'name': 'pkg'})
+        subprocess.check_call(['git', 'init', '-q'])
+        subprocess.check_call(['git', 'add', 'a', 'a-x', 'b'])
+
+        walked = find_buildfiles({})
+        listed = find_buildfiles({'discovery': {'backend': 'git'}})
+
+        self.assertEqual(walked, ['./a', './a/nested', './a-x', './b', './untracked'])
+        self.assertEqual(listed, walked)
+
+    def test_detect_services_workers_keep_order(self):
+        """Test that parsing in worker processes gives the same services in the same order."""
+        for name in ['c', 'a', 'b/nested', 'b', 'd', 'e']:
+            self.create_service(name, {'name': name.replace('/', '-'), 'kind': 'go'})
+        cache_path = os.path.join(self.temp_dir, 'manifests.json')
+
+        with patch('services.LOAD_CHUNK', 2):
+            sequential = detect_services({})
+            parallel = detect_services({'discovery': {'workers': 2, 'manifest_cache': cache_path}})
+            cached = detect_services({'discovery': {'workers': 2, 'manifest_cache': cache_path}})
+
+        self.assertEqual([s.path for s in parallel], [s.path for s in sequential])
+        self.assertEqual([s.to_dict() for s in parallel], [s.to_dict() for s in sequential])
+        self.assertEqual([s.to_dict() for s in cached], [s.to_dict() for s in sequential])
+        self.assertEqual(len(ManifestCache(cache_path).entries), 6)
+
 
 class TestUtilityFunctions(unittest.TestCase):
 
@@ -188,6 +491,19 @@ class TestUtilityFunctions(unittest.TestCase):
         self.assertFalse(is_sub_path('services/serviceA', 'services/serviceB/main.go'))
         self.assertFalse(is_sub_path('src/module', 'src/other/file.py'))
 
+    def test_ignore_matcher(self):
+        """Test the gitignore subset used for pruning."""
+        matcher = IgnoreMatcher(['node_modules', '/build/', 'docs/*', '*.egg-info/', '!docs/keep'])
+
+        self.assertTrue(matcher.ignored('./services/serviceB/node_modules'))
+        self.assertTrue(matcher.ignored('build'))
+        self.assertFalse(matcher.ignored('services/build'))
+        self.assertTrue(matcher.ignored('docs/api'))
+        self.assertFalse(matcher.ignored('docs/keep'))
+        self.assertTrue(matcher.ignored('pkg.egg-info'))
+        self.assertTrue(matcher.ignored_tree('build/service'))
+        self.assertFalse(matcher.ignored_tree('services/serviceA'))
+
     def test_changed_service_true(self):
         """Test changed_service function returns True when service is affected."""
         changes = ['services/serviceA/main.go', 'services/serviceB/config.yaml']
@@ -201,6 +517,36 @@ class TestUtilityFunctions(unittest.TestCase):
 
         self.assertFalse(changed_service('services/serviceC', changes))
 
+    def test_path_index_matches_is_sub_path(self):
+        """Test that the path trie gives the same answers as is_sub_path."""
+        paths = ['services/serviceA', './services/serviceB', 'services', 'services/serviceA/sub',
+                 'services/serviceAB', '.', '', 'docs/', 'a/./b', '/abs/service', '/']
+        services = [MagicMock(path=p) for p in paths]
+        index = PathIndex(services)
+        rng = random.Random(4)
+        names = ['services', 'serviceA', 'serviceB', 'serviceAB', 'sub', 'docs', 'a', 'b', 'abs', 'service', 'main.go', '.']
+        changes = ['', 'services', 'services/serviceA', 'docs/x.md', 'a/b/c', '/abs/service/x', '/other']
+        changes += ['/'.join(rng.choice(names) for _ in range(rng.randint(1, 4))) for _ in range(300)]
+
+        for change in changes:
+            expected = []
+            for service in services:
+                try:
+                    if is_sub_path(service.path, change):
+                        expected.append(service)
+                except ValueError:
+                    pass
+            self.assertEqual(sorted(map(id, index.match(change))), sorted(map(id, expected)), change)
+
+    def test_path_index_changed_preserves_service_order(self):
+        """Test that changed services come back in discovery order without duplicates."""
+        services = [MagicMock(path='./b'), MagicMock(path='./a'), MagicMock(path='./a/nested')]
+        index = PathIndex(services)
+
+        changed = index.changed(['a/nested/x', 'b/y', 'a/z', 'b/y'])
+
+        self.assertEqual(changed, services)
+
     def test_get_triggers(self):
         """Test extracting triggers from config."""
         config = {
@@ -233,9 +579,9 @@ class TestUtilityFunctions(unittest.TestCase):
     def test_get_services_by_selector_attributes(self):
         """Test selecting services by attributes."""
         services = [
-            MagicMock(data={'team': 'backend', 'kind': 'python'}),
-            MagicMock(data={'team': 'frontend', 'kind': 'node'}),
-            MagicMock(data={'team': 'backend', 'kind': 'go'}),
+            make_service('services/a', {'team': 'backend', 'kind': 'python'}),
+            make_service('services/b', {'team': 'frontend', 'kind': 'node'}),
+            make_service('services/c', {'team': 'backend', 'kind': 'go'}),
         ]
         selector = {
             'attributes': {
@@ -250,14 +596,164 @@ class TestUtilityFunctions(unittest.TestCase):
         self.assertEqual(selected[1].data['team'], 'backend')
 
 
+class TestTriggerMatcher(unittest.TestCase):
+
+    def test_glob_to_regex(self):
+        """Test glob translation."""
+        cases = [
+            ('go.mod', 'go.mod', True),
+            ('go.mod', 'services/go.mod', False),
+            ('*.proto', 'api.proto', True),
+            ('*.proto', 'api/v1/api.proto', False),
+            ('**/*.proto', 'api.proto', True),
+            ('**/*.proto', 'api/v1/api.proto', True),
+            ('libs/shared/**', 'libs/shared/a/b.go', True),
+            ('libs/shared/**', 'libs/sharedx/b.go', False),
+            ('./scripts/*.py', 'scripts/graph.py', True),
+            ('file?.txt', 'file1.txt', True),
+            ('file?.txt', 'file/.txt', False),
+            ('[!a]*.go', 'b.go', True),
+            ('[!a]*.go', 'a.go', False),
+            ('a+b(c).txt', 'a+b(c).txt', True),
+        ]
+        for pattern, path, expected in cases:
+            self.assertEqual(bool(re.fullmatch(glob_to_regex(pattern), path)), expected, (pattern, path))
+
+    def test_match_returns_all_keys(self):
+        """Test that a file matching several patterns reports all of them."""
+        matcher = TriggerMatcher()
+        matcher.add_glob('go.mod', 'literal')
+        matcher.add_glob('**/*.mod', 'glob')
+        matcher.add_regex(r'go\.(mod|sum)', 'regex')
+        matcher.add_glob('**/*.proto', 'proto')
+
+        self.assertEqual(matcher.match(['go.mod']), {'literal', 'glob', 'regex'})
+        self.assertEqual(matcher.match(['go.sum', 'docs/README.md']), {'regex'})
+        self.assertEqual(matcher.match([]), set())
+
+    def test_regexes_that_cannot_be_joined(self):
+        """Test named groups used twice, inline global flags and backreferences."""
+        cases = [
+            ([r'(?P<dir>docs)/.*\.md', r'(?P<dir>api)/.*\.proto'], 'api/v1.proto', {1}),
+            ([r'services/.*\.go', r'(?i)readme\.md'], 'README.MD', {1}),
+            ([r'(a)/x', r'(b+)/\1'], 'bb/bb', {1}),
+            ([r'(a)/x', r'(?P<n>b+)/(?P=n)'], 'bb/bb', {1}),
+        ]
+        for patterns, path, expected in cases:
+            matcher = TriggerMatcher()
+            for i, pattern in enumerate(patterns):
+                matcher.add_regex(pattern, i)
+            self.assertEqual(matcher.match([path, 'other']), expected, patterns)
+
+    @patch('services.detect_services')
+    def test_get_changed_services_glob_trigger(self, mock_detect_services):
+        """Test that glob triggers select additional services."""
+        go = make_service('services/go', {'name': 'go', 'kind': 'go'})
+        node = make_service('services/node', {'name': 'node', 'kind': 'node'})
+        mock_detect_services.return_value = [go, node]
+        config = {'additional_services': [
+            {'trigger': {'files': ['**/*.proto']}, 'selector': {'attributes': {'kind': 'go'}}},
+            {'trigger': {'regex': [r'package(-lock)?\.json']}, 'selector': {'attributes': {'kind': 'node'}}},
+        ]}
+
+        self.assertEqual(get_changed_services(['api/v1/x.proto'], config)['services'], [go])
+        self.assertEqual(get_changed_services(['package-lock.json'], config)['services'], [node])
+
+    @patch('services.detect_services')
+    def test_get_changed_services_service_inputs(self, mock_detect_services):
+        """Test that Buildfile inputs mark a service and its dependents as changed."""
+        lib = make_service('services/lib', {'name': 'lib', 'inputs': ['go.mod', 'libs/shared/**']})
+        app = make_service('services/app', {'name': 'app', 'dependencies': ['lib']})
+        other = make_service('services/other', {'name': 'other'})
+        mock_detect_services.return_value = [app, lib, other]
+
+        result = get_changed_services(['libs/shared/util/x.go'], {})
+
+        self.assertEqual(result['services'], [lib, app])
+        self.assertEqual(get_changed_services(['go.sum'], {})['services'], [])
+
+
+class TestAttributeIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.a = make_service('services/a', {'name': 'a', 'team': 'backend', 'kind': 'go', 'tags': ['grpc', 'public']})
+        self.b = make_service('services/b', {'name': 'b', 'team': 'frontend', 'kind': 'node', 'tags': ['public']})
+        self.c = make_service('services/c', {'name': 'c', 'team': 'backend', 'kind': 'python', 'authentication': {'azure': 'enabled'}})
+        self.d = make_service('services/d', {'name': 'd', 'team': 'sre', 'kind': 'terraform', 'authentication': {'azure': 'enabled'}})
+        self.services = [self.a, self.b, self.c, self.d]
+        self.index = AttributeIndex(self.services)
+
+    def select(self, selector):
+        return get_services_by_selector(selector, self.services, self.index)
+
+    def test_attributes_are_deduplicated(self):
+        """Test that a service matching several attributes is returned once."""
+        self.assertEqual(self.select({'attributes': {'team': 'backend', 'kind': 'go'}}), [self.a, self.c])
+
+    def test_list_values(self):
+        """Test list-valued service attributes and selector values."""
+        self.assertEqual(self.select({'attributes': {'tags': 'grpc'}}), [self.a])
+        self.assertEqual(self.select({'attributes': {'tags': 'public'}}), [self.a, self.b])
+        self.assertEqual(self.select({'attributes': {'kind': ['go', 'terraform']}}), [self.a, self.d])
+
+    def test_mapping_values(self):
+        """Test attributes holding a mapping."""
+        self.assertEqual(self.select({'attributes': {'authentication': {'azure': 'enabled'}}}), [self.c, self.d])
+
+    def test_all_of(self):
+        """Test AND of sub selectors."""
+        selector = {'all_of': [{'attributes': {'team': 'backend'}}, {'attributes': {'tags': 'public'}}]}
+        self.assertEqual(self.select(selector), [self.a])
+
+    def test_any_of(self):
+        """Test OR of sub selectors."""
+        selector = {'any_of': [{'attributes': {'team': 'sre'}}, {'attributes': {'kind': 'node'}}]}
+        self.assertEqual(self.select(selector), [self.b, self.d])
+
+    def test_not(self):
+        """Test negation, combined with AND at the same level."""
+        self.assertEqual(self.select({'not': {'attributes': {'team': 'backend'}}}), [self.b, self.d])
+        selector = {'attributes': {'team': 'backend'}, 'not': {'attributes': {'kind': 'go'}}}
+        self.assertEqual(self.select(selector), [self.c])
+        self.assertEqual(self.select({'all': True, 'not': {'attributes': {'team': 'sre'}}}), [self.a, self.b, self.c])
+
+    def test_empty_selector(self):
+        """Test that an empty selector matches nothing."""
+        self.assertEqual(self.select({}), [])
+
+    def test_unknown_key(self):
+        """Test that misspelt selector keys are reported."""
+        with self.assertRaises(ValueError):
+            self.select({'atributes': {'team': 'sre'}})
+
+    def test_attributes_indexed_on_demand(self):
+        """Test that only attributes used by selectors are indexed."""
+        self.select({'attributes': {'team': 'sre'}})
+        self.select({'attributes': {'team': 'backend'}})
+        self.assertEqual(list(self.index.attributes), ['team'])
+
+
+class TestPartitionServices(unittest.TestCase):
+
+    def test_partition_services(self):
+        """Test splitting services by kind, keeping their order."""
+        go = make_service('services/go', {'kind': 'go'})
+        tf = make_service('infra/tf', {'kind': 'terraform'})
+        image = make_service('images/image', {'kind': 'docker'})
+        bare = make_service('services/bare', {})
+
+        self.assertEqual(partition_services([go, tf, image, bare]),
+                         {'services': [go, bare], 'infra': [tf], 'docker': [image]})
+
+
 class TestGetChangedServices(unittest.TestCase):
 
     @patch('services.detect_services')
     def test_get_changed_services_basic(self, mock_detect_services):
         """Test basic changed services detection."""
         mock_services = [
-            MagicMock(path='services/serviceA', data={'name': 'serviceA'}),
-            MagicMock(path='services/serviceB', data={'name': 'serviceB'}),
+            make_service('services/serviceA', {'name': 'serviceA'}),
+            make_service('services/serviceB', {'name': 'serviceB'}),
         ]
         mock_detect_services.return_value = mock_services
 
@@ -277,8 +773,8 @@ class TestGetChangedServices(unittest.TestCase):
     def test_get_changed_services_with_additional(self, mock_get_by_selector, mock_detect_services):
         """Test changed services with additional services triggered."""
         mock_services = [
-            MagicMock(path='services/serviceA', data={'name': 'serviceA'}),
-            MagicMock(path='services/serviceB', data={'name': 'serviceB'}),
+            make_service('services/serviceA', {'name': 'serviceA'}),
+            make_service('services/serviceB', {'name': 'serviceB'}),
         ]
         mock_detect_services.return_value = mock_services
         mock_get_by_selector.return_value = [mock_services[1]]  # serviceB
@@ -302,7 +798,7 @@ class TestGetChangedServices(unittest.TestCase):
     @patch('services.detect_services')
     def test_get_changed_services_deduplication(self, mock_detect_services):
         """Test that duplicate services are removed while preserving order."""
-        mock_service = MagicMock(path='services/serviceA', data={'name': 'serviceA'})
+        mock_service = make_service('services/serviceA', {'name': 'serviceA'})
         mock_detect_services.return_value = [mock_service]
 
         changes = ['services/serviceA/main.go']
@@ -323,6 +819,39 @@ class TestGetChangedServices(unittest.TestCase):
                 self.assertEqual(len(result), 2)
 
 
+    @patch('services.detect_services')
+    def test_get_changed_services_transitive_dependencies(self, mock_detect_services):
+        """Test that dependents of dependents are included."""
+        mock_detect_services.return_value = [
+            make_service('services/serviceD', {'name': 'serviceD', 'dependencies': ['serviceA']}),
+            make_service('services/serviceA', {'name': 'serviceA', 'dependencies': ['X']}),
+            make_service('lib/x', {'name': 'X'}),
+            make_service('services/other', {'name': 'other'}),
+        ]
+
+        result = get_changed_services(['lib/x/x.go'], {'additional_services': []})
+
+        self.assertEqual([s.data['name'] for s in result['services']], ['X', 'serviceD', 'serviceA'])
+
+
+    @patch('services.detect_services')
+    def test_get_changed_services_per_baseline(self, mock_detect_services):
+        """Test that each service is compared against the changes since its own baseline."""
+        a = make_service('services/a', {'name': 'a'})
+        b = make_service('services/b', {'name': 'b'})
+        c = make_service('services/c', {'name': 'c', 'dependencies': ['b']})
+        mock_detect_services.return_value = [a, b, c]
+        change_sets = {
+            'old': ['services/a/x', 'services/b/y'],
+            'new': ['services/a/x'],
+        }
+
+        result = get_changed_services_per_baseline(change_sets, {'a': 'new', 'b': 'new'}, 'old', {})
+
+        # b has not changed since its own baseline, but c (on the default baseline) sees b's change
+        self.assertEqual(result['services'], [a, c])
+
+
 class TestCompareServices(unittest.TestCase):
     #TODO: fixme
     #@patch('services.run_git')
@@ -345,8 +874,8 @@ class TestCompareServices(unittest.TestCase):
     def test_compare_services_with_dependencies(self, mock_detect_services, mock_run_git):
         """Test that a changed service causes dependent services to be included."""
         # Create two mock services: dep1 (changed) and test_service (depends on dep1)
-        mock_dep = MagicMock(path='services/dep1', data={'name': 'dep1', 'dependencies': []})
-        mock_service = MagicMock(path='services/test_service', data={'name': 'test_service', 'dependencies': ['dep1']})
+        mock_dep = make_service('services/dep1', {'name': 'dep1', 'dependencies': []})
+        mock_service = make_service('services/test_service', {'name': 'test_service', 'dependencies': ['dep1']})
         # Order doesn't matter much, but include both in detect_services
         mock_detect_services.return_value = [mock_dep, mock_service]
 
@@ -356,14 +885,32 @@ class TestCompareServices(unittest.TestCase):
         config = {'additional_services': []}
         result = compare_services('HEAD~1', config)
 
-        mock_run_git.assert_called_once_with('diff', '--name-only', 'HEAD~1')
+        mock_run_git.assert_called_once_with('diff', '--name-only', '-z', 'HEAD~1')
         # Expect both the changed service and the dependent service to be returned
-        result_names = [r.data['name'] for r in result["services"]]
-        #self.assertIn('dep1', result_names) #TODO: fixme
-        #self.assertIn('test_service', result_names)
+        result_names = [r['name'] for r in result["services"]]
+        self.assertIn('dep1', result_names)
+        self.assertIn('test_service', result_names)
         self.assertEqual(len(result_names), 2)
 
 
+    @patch('services.run_git')
+    @patch('services.detect_services')
+    def test_compare_services_with_dependency_cycle(self, mock_detect_services, mock_run_git):
+        """Test that a dependency cycle is reported as a single wave instead of failing."""
+        mock_detect_services.return_value = [
+            make_service('services/a', {'name': 'a', 'dependencies': ['b']}),
+            make_service('services/b', {'name': 'b', 'dependencies': ['a']}),
+            make_service('services/c', {'name': 'c', 'dependencies': ['c']}),
+        ]
+        mock_run_git.return_value = 'services/a/main.go\0services/c/main.go'
+
+        with patch('sys.stderr'):
+            result = compare_services('HEAD~1', {'additional_services': []})
+
+        self.assertEqual([r['name'] for r in result['services']], ['a', 'c', 'b'])
+        self.assertEqual(result['waves'], [['a', 'c', 'b']])
+
+
 class TestCurrentCommit(unittest.TestCase):
 
     @patch('services.run_git')
@@ -411,11 +958,13 @@ class TestPickFirstSuccessRun(unittest.TestCase):
 
 class TestListRuns(unittest.TestCase):
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_list_runs_with_workflow_id(self, mock_get):
         """Test listing runs for a specific workflow ID."""
         mock_response = MagicMock()
         mock_response.status_code = 200
+        mock_response.headers = {}
+        mock_response.links = {}
         mock_response.json.return_value = {
             'workflow_runs': [
                 {'id': 1, 'status': 'completed'},
@@ -430,13 +979,15 @@ class TestListRuns(unittest.TestCase):
         mock_get.assert_called_once()
         args, kwargs = mock_get.call_args
         self.assertIn('workflows/12345/runs', args[0])
-        self.assertEqual(kwargs['params']['branch'], 'main')
+        self.assertIn('branch=main', args[0])
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_list_runs_with_workflow_ref(self, mock_get):
         """Test listing runs for a specific workflow file reference."""
         mock_response = MagicMock()
         mock_response.status_code = 200
+        mock_response.headers = {}
+        mock_response.links = {}
         mock_response.json.return_value = {'workflow_runs': []}
         mock_get.return_value = mock_response
 
@@ -445,11 +996,13 @@ class TestListRuns(unittest.TestCase):
         args, kwargs = mock_get.call_args
         self.assertIn('workflows/ci.yml/runs', args[0])
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_list_runs_all_workflows(self, mock_get):
         """Test listing runs for all workflows."""
         mock_response = MagicMock()
         mock_response.status_code = 200
+        mock_response.headers = {}
+        mock_response.links = {}
         mock_response.json.return_value = {'workflow_runs': []}
         mock_get.return_value = mock_response
 
@@ -459,11 +1012,12 @@ class TestListRuns(unittest.TestCase):
         self.assertIn('actions/runs', args[0])
         self.assertNotIn('workflows', args[0])
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_list_runs_api_error(self, mock_get):
         """Test handling GitHub API errors."""
         mock_response = MagicMock()
         mock_response.status_code = 404
+        mock_response.headers = {}
         mock_response.text = 'Not Found'
         mock_get.return_value = mock_response
 
@@ -502,6 +1056,18 @@ class TestGetLastGreenCommit(unittest.TestCase):
         self.assertEqual(result, 'current_commit_456')
         mock_current.assert_called_once()
 
+    @patch('services.list_runs')
+    def test_get_last_green_commit_with_client(self, mock_list):
+        """Test that a GitHub client pages through runs instead of list_runs."""
+        client = MagicMock()
+        client.first_green_run.return_value = {'head_sha': 'paged_green'}
+
+        result = get_last_green_commit('owner', 'repo', 'main', 'token', workflow='ci.yml', client=client)
+
+        self.assertEqual(result, 'paged_green')
+        client.first_green_run.assert_called_once_with('owner', 'repo', 'main', workflow_id=None, workflow_ref='ci.yml')
+        mock_list.assert_not_called()
+
     @patch('services.list_runs')
     def test_get_last_green_commit_with_workflow(self, mock_list):
         """Test getting last green commit with specific workflow."""
@@ -515,5 +1081,313 @@ class TestGetLastGreenCommit(unittest.TestCase):
         )
 
 
+class TestPlan(unittest.TestCase):
+
+    @patch('services.run_git')
+    @patch('services.commit_exists', return_value=True)
+    @patch('services.get_last_green_commit', return_value='green123')
+    def test_resolve_baseline_existing_commit(self, mock_green, mock_exists, mock_run_git):
+        """Test that an existing last green commit is used as is."""
+        self.assertEqual(resolve_baseline('owner', 'repo', 'main', 'token'), 'green123')
+        mock_exists.assert_called_once_with('green123')
+        mock_run_git.assert_not_called()
+
+    @patch('services.run_git')
+    @patch('services.commit_exists', return_value=False)
+    @patch('services.get_last_green_commit', return_value='gone123')
+    def test_resolve_baseline_missing_commit(self, mock_green, mock_exists, mock_run_git):
+        """Test falling back to the merge base with the default branch."""
+        mock_run_git.side_effect = lambda *args: 'base456' if args[0] == 'merge-base' else ''
+
+        self.assertEqual(resolve_baseline('owner', 'repo', 'feature', 'token', default_branch='main'), 'base456')
+        mock_run_git.assert_any_call('fetch', 'origin', 'main')
+        mock_run_git.assert_any_call('merge-base', 'HEAD', 'origin/main')
+
+    @patch('services.get_envs', return_value=['dev', 'prod'])
+    @patch('services.compare_services')
+    def test_plan_writes_all_outputs(self, mock_compare, mock_envs):
+        """Test that the plan writes every output key in one go."""
+        mock_compare.return_value = {'services': [{'name': 'a'}], 'infra': [], 'docker': [], 'waves': [['a']]}
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        output = os.path.join(temp_dir, 'github_output')
+
+        outputs = plan('abc', 'main', {})
+        write_github_output(outputs, output)
+
+        mock_compare.assert_called_once_with('abc', {}, None, None, fields=None)
+        with open(output) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines, [
+            'base=abc',
+            'GIT_BRANCH=main',
+            'services=[{"name":"a"}]',
+            'infra=[]',
+            'docker=[]',
+            'waves=[["a"]]',
+            'envs=["dev","prod"]',
+        ])
+
+    @patch('services.load_envs', return_value=[{'name': 'dev'}, {'name': 'prod', 'teams': ['backend']}])
+    @patch('services.compare_services')
+    def test_plan_expand_envs(self, mock_compare, mock_envs):
+        """Test that the plan outputs the allowed service/env pairs and keeps filter fields."""
+        api = {'name': 'api', 'team': 'backend', 'build_once': True}
+        web = {'name': 'web', 'team': 'frontend'}
+        mock_compare.return_value = {'services': [api, web], 'infra': [], 'docker': [], 'waves': [['api', 'web']]}
+
+        outputs = plan('abc', 'main', {}, fields=['path'], expand_envs=True)
+
+        mock_compare.assert_called_once_with('abc', {}, None, None, fields=['path', 'name', 'team', 'kind', 'build_once'])
+        self.assertEqual(outputs['envs'], ['dev', 'prod'])
+        self.assertEqual(outputs['matrix_build_services'], [{'service': api, 'env': 'dev'}, {'service': web, 'env': 'dev'}])
+        self.assertEqual([(pair['service']['name'], pair['env']) for pair in outputs['matrix_services']],
+                         [('api', 'dev'), ('api', 'prod'), ('web', 'dev')])
+
+
+    @patch('services.load_envs', return_value=[{'name': 'dev'}, {'name': 'prod', 'kinds': ['terraform']}])
+    def test_dispatch_plan(self, mock_envs):
+        """Test that dispatched services, given by name or path, get the same outputs as a plan."""
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        cwd = os.getcwd()
+        os.chdir(temp_dir)
+        self.addCleanup(os.chdir, cwd)
+        for name, kind in (('api', 'go'), ('net', 'terraform'), ('web', 'node')):
+            os.makedirs(f'services/{name}')
+            with open(f'services/{name}/Buildfile.yaml', 'w') as f:
+                f.write(f'name: {name}\nkind: {kind}\n')
+
+        outputs = dispatch_plan([{'name': 'api'}, {'path': 'services/net/'}], 'main', {}, fields=['path'], expand_envs=True)
+
+        self.assertEqual([s['name'] for s in outputs['services']], ['api'])
+        self.assertEqual([s['name'] for s in outputs['infra']], ['net'])
+        self.assertEqual(outputs['GIT_BRANCH'], 'main')
+        self.assertEqual([pair['env'] for pair in outputs['matrix_build_services']], ['dev'])
+        self.assertEqual([pair['env'] for pair in outputs['matrix_infra']], ['dev', 'prod'])
+        with self.assertRaises(ValueError):
+            dispatch_plan([{'name': 'missing'}], 'main', {})
+
+
+class TestBuildAvoidance(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        env = patch.dict(os.environ, {
+            'GIT_AUTHOR_NAME': 'test', 'GIT_AUTHOR_EMAIL': 'test@example.com',
+            'GIT_COMMITTER_NAME': 'test', 'GIT_COMMITTER_EMAIL': 'test@example.com',
+        })
+        env.start()
+        self.addCleanup(env.stop)
+        cwd = os.getcwd()
+        os.chdir(self.temp_dir)
+        self.addCleanup(os.chdir, cwd)
+        batch = GitBatch(self.temp_dir)
+        self.addCleanup(batch.close)
+        git_batch = patch('services._git_batch', batch)
+        git_batch.start()
+        self.addCleanup(git_batch.stop)
+        self.git('init', '-q', '-b', 'main')
+        self.write('services/base/Buildfile.yaml', 'name: base\nkind: go\nartifact: base_image\n')
+        self.write('services/app/Buildfile.yaml', 'name: app\nkind: node\nartifact: app_image\ndependencies: [base]\n')
+        self.write('services/infra/Buildfile.yaml', 'name: infra\nkind: terraform\n')
+        self.write('go.Dockerfile', 'FROM golang')
+        self.config = {'additional_services': [
+            {'name': 'go', 'selector': {'attributes': {'kind': 'go'}}, 'trigger': {'files': ['go.Dockerfile']}},
+        ]}
+        self.commit()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def git(self, *args):
+        return subprocess.check_output(['git', *args], cwd=self.temp_dir).decode().strip()
+
+    def write(self, name, content):
+        os.makedirs(os.path.dirname(name) or '.', exist_ok=True)
+        with open(name, 'w') as f:
+            f.write(content)
+
+    def commit(self):
+        self.git('add', '-A')
+        self.git('commit', '-q', '-m', 'change')
+
+    def fingerprints(self):
+        services = detect_services({})
+        return {s.data['name']: fp for s, fp in service_fingerprints(services, services, self.config).items()}
+
+    def test_fingerprints(self):
+        """Test that fingerprints follow the service tree, dependencies and trigger files."""
+        before = self.fingerprints()
+        self.assertEqual(self.fingerprints(), before)
+
+        self.write('README.md', 'unrelated')
+        self.commit()
+        self.assertEqual(self.fingerprints(), before)
+
+        self.write('go.Dockerfile', 'FROM golang:1.22')
+        self.commit()
+        after_trigger = self.fingerprints()
+        self.assertNotEqual(after_trigger['base'], before['base'])
+        self.assertNotEqual(after_trigger['app'], before['app'])
+        self.assertEqual(after_trigger['infra'], before['infra'])
+
+        self.write('services/app/main.js', 'console.log(1)')
+        self.commit()
+        after_app = self.fingerprints()
+        self.assertNotEqual(after_app['app'], after_trigger['app'])
+        self.assertEqual(after_app['base'], after_trigger['base'])
+
+    def test_dependency_cycle_has_no_fingerprint(self):
+        """Test that services in a dependency cycle are never treated as built."""
+        self.write('services/base/Buildfile.yaml', 'name: base\nkind: go\nartifact: base_image\ndependencies: [app]\n')
+        self.commit()
+
+        self.assertEqual(self.fingerprints(), {'base': None, 'app': None, 'infra': None})
+
+    def test_uncommitted_service_has_no_fingerprint(self):
+        """Test that services missing from the commit are never treated as built."""
+        self.write('services/new/Buildfile.yaml', 'name: new\nartifact: new_image\n')
+
+        self.assertIsNone(self.fingerprints()['new'])
+
+    def test_already_built(self):
+        """Test finding the services whose fingerprint was recorded as built."""
+        services = detect_services({})
+        changed = {'services': [s for s in services if s.data['name'] != 'infra'],
+                   'infra': [s for s in services if s.data['name'] == 'infra'], 'docker': []}
+        cache = BuildCache(os.path.join(self.temp_dir, 'built.json'))
+
+        self.assertEqual(already_built(changed, services, self.config, cache), [])
+        groups = [[s.data for s in members] for members in changed.values()]
+        self.assertEqual(record_built(cache, groups), 2)
+
+        built = already_built(changed, detect_services({}), self.config, BuildCache(cache.path))
+        self.assertEqual(sorted(built), ['app', 'base'])
+
+    def test_revert_is_deployed(self):
+        """Test that going back to a built fingerprint skips the build but not the deploy."""
+        cache = BuildCache(os.path.join(self.temp_dir, 'built.json'))
+        cache.record(self.fingerprints()['app'], 'app', 'app_image')
+        self.write('services/app/main.js', 'console.log(1)')
+        self.commit()
+        cache.record(self.fingerprints()['app'], 'app', 'app_image')
+        os.remove('services/app/main.js')
+        self.commit()
+
+        changed = compare_services('HEAD~1', self.config, build_cache=cache)
+        matrices = matrix.expand(changed, [{'name': 'dev'}], 'main')
+
+        self.assertEqual([s['name'] for s in changed['services']], ['app'])
+        self.assertEqual(changed['skipped'], ['app'])
+        self.assertEqual(matrices['matrix_build_services'], [])
+        self.assertEqual(matrices['matrix_publish_services'], [])
+        self.assertEqual(matrices['matrix_services'], [{'service': changed['services'][0], 'env': 'dev', 'prebuilt': True}])
+
+
+class TestCachedCompareServices(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        env = patch.dict(os.environ, {
+            'GIT_AUTHOR_NAME': 'test', 'GIT_AUTHOR_EMAIL': 'test@example.com',
+            'GIT_COMMITTER_NAME': 'test', 'GIT_COMMITTER_EMAIL': 'test@example.com',
+        })
+        env.start()
+        self.addCleanup(env.stop)
+        cwd = os.getcwd()
+        os.chdir(self.temp_dir)
+        self.addCleanup(os.chdir, cwd)
+        self.git('init', '-q', '-b', 'main')
+        for name in ('a', 'b', 'c'):
+            self.write(f'services/{name}/Buildfile.yaml', f'name: {name}\n')
+        self.write('.gitignore', '.cache/\n')
+        self.base = self.commit()
+        self.cache = ResultCache(os.path.join(self.temp_dir, '.cache', 'results'))
+        self.config = {'additional_services': []}
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def git(self, *args):
+        return subprocess.check_output(['git', *args], cwd=self.temp_dir).decode().strip()
+
+    def write(self, name, content):
+        os.makedirs(os.path.dirname(name) or '.', exist_ok=True)
+        with open(name, 'w') as f:
+            f.write(content)
+
+    def commit(self):
+        self.git('add', '-A')
+        self.git('commit', '-q', '-m', 'change')
+        return self.git('rev-parse', 'HEAD')
+
+    def names(self, output):
+        return [service['name'] for service in output['services']]
+
+    def test_hit_skips_detection(self):
+        """Test that a repeated commit pair is answered from the cache."""
+        self.write('services/a/main.go', 'package main')
+        self.commit()
+        first = cached_compare_services(self.base, self.config, self.cache)
+
+        with patch('services.detect_services') as mock_detect:
+            second = cached_compare_services(self.base, self.config, self.cache)
+
+        mock_detect.assert_not_called()
+        self.assertEqual(second, first)
+        self.assertEqual(self.names(second), ['a'])
+
+    def test_make_target_values_are_not_cached(self):
+        """Test that a hit still runs make targets, whose values can change at the same head."""
+        self.write('services/a/Buildfile.yaml',
+                   'name: a\nsave:\n  - key: label\n    valueFrom:\n      makeTarget: label\n')
+        self.write('services/a/Makefile', 'label:\n\t@echo $$BUILD_LABEL\n')
+        self.commit()
+
+        with patch.dict(os.environ, {'BUILD_LABEL': 'one'}):
+            first = cached_compare_services(self.base, self.config, self.cache)
+        with patch.dict(os.environ, {'BUILD_LABEL': 'two'}), patch('services.run_git', wraps=run_git) as mock_git:
+            second = cached_compare_services(self.base, self.config, self.cache)
+
+        self.assertEqual(first['services'][0]['save'][0]['value'], 'one')
+        self.assertEqual(second['services'][0]['save'][0]['value'], 'two')
+        self.assertNotIn(unittest.mock.call('diff', '--name-only', '-z', self.base), mock_git.call_args_list)
+
+    def test_advanced_head_reuses_changes(self):
+        """Test that moving head only diffs the new commits."""
+        self.write('services/a/main.go', 'package main')
+        self.commit()
+        cached_compare_services(self.base, self.config, self.cache)
+        self.write('services/b/main.go', 'package main')
+        self.commit()
+
+        with patch('services.run_git', wraps=run_git) as mock_git:
+            output = cached_compare_services(self.base, self.config, self.cache)
+
+        self.assertEqual(self.names(output), ['a', 'b'])
+        self.assertNotIn(unittest.mock.call('diff', '--name-only', '-z', self.base), mock_git.call_args_list)
+        self.assertEqual(self.names(compare_services(self.base, self.config)), ['a', 'b'])
+
+    def test_unusual_paths_are_not_quoted(self):
+        """Test that paths git would quote or split still map to their service."""
+        self.write('services/b/caf\u00e9 notes.txt', 'x')
+        self.write('services/c/line\nbreak.txt', 'x')
+        self.commit()
+
+        output = cached_compare_services(self.base, self.config, self.cache)
+
+        self.assertEqual(self.names(output), ['b', 'c'])
+
+    def test_dirty_checkout_is_not_cached(self):
+        """Test that uncommitted changes bypass the cache."""
+        self.write('services/c/Buildfile.yaml', 'name: c\nkind: go\n')
+
+        output = cached_compare_services(self.base, self.config, self.cache)
+
+        self.assertEqual(self.names(output), ['c'])
+        self.assertEqual(self.cache.entries(), [])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,72 @@
+# Measures the cold start-up of each services.py CLI mode with `python -X importtime`
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "services.py")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    "help": ["--help"],
+    "envs": ["--envs"],
+    "all": ["--all"],
+    "cmp": ["--cmp", "HEAD"],
+}
+
+def parse_importtime(stderr: str) -> Dict[str, int]:
+    """Return the cumulative import time in microseconds of every top-level import."""
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip() == "cumulative":
+            continue
+        # Nested imports are indented below the module that triggered them
+        if not name.startswith("  "):
+            imports[name.strip()] = imports.get(name.strip(), 0) + int(cumulative)
+    return imports
+
+def run_mode(args: List[str], repeat: int) -> dict:
+    walls = []
+    imports = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime", SCRIPT, *args],
+                              cwd=ROOT, capture_output=True, text=True)
+        walls.append((time.perf_counter() - start) * 1000)
+        if proc.returncode != 0:
+            raise RuntimeError(f"services.py {' '.join(args)} failed: {proc.stderr.strip()[-500:]}")
+        imports = parse_importtime(proc.stderr)
+    return {
+        "wall_ms": round(statistics.median(walls), 1),
+        "import_ms": round(sum(imports.values()) / 1000, 1),
+        "imports_ms": {name: round(us / 1000, 1) for name, us in sorted(imports.items(), key=lambda i: -i[1])},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start-up benchmark for services.py")
+    parser.add_argument("--modes", nargs="+", choices=sorted(MODES), default=list(MODES))
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per mode, the median is reported")
+    parser.add_argument("--top", type=int, default=5, help="Slowest imports to show per mode")
+    parser.add_argument("--output", type=str, help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.modes:
+        results[mode] = run_mode(MODES[mode], args.repeat)
+        result = results[mode]
+        top = ", ".join(f"{name} {ms}ms" for name, ms in list(result["imports_ms"].items())[:args.top])
+        print(f"{mode:<6} wall {result['wall_ms']:>7.1f}ms  imports {result['import_ms']:>7.1f}ms  {top}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
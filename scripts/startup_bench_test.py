@@ -0,0 +1,25 @@
+import unittest
+from startup_bench import parse_importtime
+
+
+class TestParseImporttime(unittest.TestCase):
+
+    def test_parse_importtime(self):
+        """Test that only top-level imports are summed, with their cumulative time."""
+        stderr = "\n".join([
+            "import time: self [us] | cumulative | imported package",
+            "import time:       120 |        120 |   _io",
+            "import time:       300 |       1500 | yaml",
+            "import time:       200 |        200 |     yaml.error",
+            "import time:        80 |        900 |   yaml.loader",
+            "import time:        50 |         50 | graph",
+            "['dev']",
+        ])
+
+        imports = parse_importtime(stderr)
+
+        self.assertEqual(imports, {'yaml': 1500, 'graph': 50})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+# OpenTelemetry spans and metrics that cost nothing when telemetry is off
+
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+# Set to `off` to keep spans and metrics no-ops even under opentelemetry-instrument
+TELEMETRY_ENV = "SERVICES_TELEMETRY"
+MAX_ATTRIBUTE_LENGTH = 256
+MAX_ATTRIBUTE_ITEMS = 16
+
+
+def enabled() -> bool:
+    # Without opentelemetry-instrument nothing has imported the API and no provider
+    # is configured, so importing it here would only cost start-up time
+    if "opentelemetry" not in sys.modules:
+        return False
+    return os.environ.get(TELEMETRY_ENV, "").lower() not in ("0", "off", "false", "no")
+
+
+def bounded(value):
+    """Attribute value with strings truncated and sequences capped, so arbitrary input
+    (paths, argument lists, selectors) cannot blow up span size."""
+    if isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (list, tuple)):
+        items = [str(item)[:MAX_ATTRIBUTE_LENGTH] for item in value[:MAX_ATTRIBUTE_ITEMS]]
+        if len(value) > MAX_ATTRIBUTE_ITEMS:
+            items.append(f"... {len(value) - MAX_ATTRIBUTE_ITEMS} more")
+        return items
+    value = "" if value is None else str(value)
+    return value if len(value) <= MAX_ATTRIBUTE_LENGTH else value[:MAX_ATTRIBUTE_LENGTH] + "..."
+
+
+class NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def add_event(self, name, attributes=None):
+        pass
+
+    def record_exception(self, exception, attributes=None):
+        pass
+
+    def set_status(self, status, description=None):
+        pass
+
+NOOP_SPAN = NoopSpan()
+
+
+class ClockedSpan:
+    """Span context manager that also reports its wall-clock time to a clock (see profiling)."""
+    def __init__(self, span, name: str, clock):
+        self.span = span
+        self.name = name
+        self.clock = clock
+        self.entered = False
+
+    def __enter__(self):
+        self.entered = self.clock.enter(self.name)
+        return self.span.__enter__()
+
+    def __exit__(self, *exc):
+        try:
+            return self.span.__exit__(*exc)
+        finally:
+            if self.entered:
+                self.clock.exit()
+
+
+class LazyTracer:
+    """Tracer that resolves the OpenTelemetry tracer on first use.
+
+    While telemetry is off every span is the shared NOOP_SPAN, so the API is
+    never imported. A clock, when set, is told when every span starts and ends.
+    """
+    def __init__(self, name: str, provider=None):
+        self.name = name
+        self.provider = provider
+        self.tracer = None
+        self.clock = None
+
+    def start_as_current_span(self, name: str, *args, **kwargs):
+        if self.tracer is None and self.provider is None and not enabled():
+            span = NOOP_SPAN
+        else:
+            if self.tracer is None:
+                from opentelemetry import trace
+                self.tracer = trace.get_tracer(self.name, tracer_provider=self.provider)
+            span = self.tracer.start_as_current_span(name, *args, **kwargs)
+        if self.clock is not None:
+            return ClockedSpan(span, name, self.clock)
+        return span
+
+
+class LazyInstrument:
+    """Counter or histogram created on the first measurement while telemetry is on."""
+    def __init__(self, meter: "LazyMeter", kind: str, name: str, unit: str, description: str):
+        self.meter = meter
+        self.kind = kind
+        self.name = name
+        self.unit = unit
+        self.description = description
+        self.instrument = None
+
+    def resolve(self):
+        if self.instrument is None:
+            meter = self.meter.resolve()
+            if meter is None:
+                return None
+            create = meter.create_counter if self.kind == "counter" else meter.create_histogram
+            self.instrument = create(self.name, unit=self.unit, description=self.description)
+        return self.instrument
+
+    def add(self, amount, attributes: Optional[dict] = None):
+        instrument = self.resolve()
+        if instrument is not None:
+            instrument.add(amount, attributes)
+
+    def record(self, amount, attributes: Optional[dict] = None):
+        instrument = self.resolve()
+        if instrument is not None:
+            instrument.record(amount, attributes)
+
+    @contextmanager
+    def time(self, attributes: Optional[dict] = None):
+        """Record the duration of the block in milliseconds."""
+        if self.resolve() is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.instrument.record((time.perf_counter() - start) * 1000, attributes)
+
+
+class LazyMeter:
+    def __init__(self, name: str, provider=None):
+        self.name = name
+        self.provider = provider
+        self.meter = None
+
+    def resolve(self):
+        if self.meter is None:
+            if self.provider is None and not enabled():
+                return None
+            from opentelemetry import metrics
+            self.meter = metrics.get_meter(self.name, meter_provider=self.provider)
+        return self.meter
+
+    def counter(self, name: str, unit: str = "1", description: str = "") -> LazyInstrument:
+        return LazyInstrument(self, "counter", name, unit, description)
+
+    def histogram(self, name: str, unit: str = "ms", description: str = "") -> LazyInstrument:
+        return LazyInstrument(self, "histogram", name, unit, description)
+
+
+tracer = LazyTracer("github-actions-srvices")
+meter = LazyMeter("github-actions-srvices")
+
+GIT_DURATION = meter.histogram("services.git.duration", description="Duration of git commands")
+MAKE_DURATION = meter.histogram("services.make.duration", description="Duration of make targets")
+HTTP_DURATION = meter.histogram("services.http.duration", description="Duration of GitHub API requests")
+SERVICES_SCANNED = meter.counter("services.scanned", description="Buildfiles loaded")
+CHANGED_FILES = meter.counter("services.changed_files", description="Changed files matched against services")
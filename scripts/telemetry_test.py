@@ -0,0 +1,68 @@
+import os
+import unittest
+from unittest.mock import patch
+
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import InMemoryMetricReader
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from telemetry import (
+    MAX_ATTRIBUTE_ITEMS, MAX_ATTRIBUTE_LENGTH, NOOP_SPAN, LazyMeter, LazyTracer, bounded, enabled
+)
+
+
+class TestTelemetry(unittest.TestCase):
+
+    def test_bounded(self):
+        """Test that attribute values are capped in length and item count."""
+        self.assertEqual(bounded(('diff', '--name-only')), ['diff', '--name-only'])
+        self.assertEqual(len(bounded('x' * 1000)), MAX_ATTRIBUTE_LENGTH + 3)
+        self.assertEqual(bounded(None), '')
+        self.assertEqual(bounded(3), 3)
+        capped = bounded([f'file{i}' for i in range(100)])
+        self.assertEqual(len(capped), MAX_ATTRIBUTE_ITEMS + 1)
+        self.assertEqual(capped[-1], f'... {100 - MAX_ATTRIBUTE_ITEMS} more')
+
+    def test_switched_off(self):
+        """Test that the env switch makes spans and instruments no-ops."""
+        with patch.dict(os.environ, {'SERVICES_TELEMETRY': 'off'}):
+            self.assertFalse(enabled())
+            self.assertIs(LazyTracer('test').start_as_current_span('span'), NOOP_SPAN)
+            histogram = LazyMeter('test').histogram('duration')
+            with histogram.time({'command': 'diff'}):
+                pass
+            self.assertIsNone(histogram.instrument)
+
+    def test_spans_and_metrics(self):
+        """Test recording spans and metrics through configured providers."""
+        exporter = InMemorySpanExporter()
+        provider = TracerProvider()
+        provider.add_span_processor(SimpleSpanProcessor(exporter))
+        reader = InMemoryMetricReader()
+        tracer = LazyTracer('test', provider)
+        meter = LazyMeter('test', MeterProvider(metric_readers=[reader]))
+        histogram = meter.histogram('services.git.duration')
+        counter = meter.counter('services.scanned')
+
+        with tracer.start_as_current_span('run_git') as span, histogram.time({'command': 'diff'}):
+            span.set_attribute('args', bounded(('diff', '--name-only')))
+        counter.add(3)
+
+        spans = exporter.get_finished_spans()
+        self.assertEqual([s.name for s in spans], ['run_git'])
+        self.assertEqual(spans[0].attributes['args'], ('diff', '--name-only'))
+        metrics = {
+            metric.name: metric.data.data_points[0]
+            for resource in reader.get_metrics_data().resource_metrics
+            for scope in resource.scope_metrics
+            for metric in scope.metrics
+        }
+        self.assertEqual(metrics['services.git.duration'].count, 1)
+        self.assertEqual(dict(metrics['services.git.duration'].attributes), {'command': 'diff'})
+        self.assertEqual(metrics['services.scanned'].value, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
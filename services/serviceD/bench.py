@@ -0,0 +1,46 @@
+# Latency of the item store operations as the store grows, see `make bench`
+
+import argparse
+import random
+import time
+
+from store import ItemStore
+
+
+def per_op_us(fn, ops: int) -> float:
+    start = time.perf_counter()
+    for _ in range(ops):
+        fn()
+    return (time.perf_counter() - start) / ops * 1e6
+
+
+def bench(size: int, ops: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    store = ItemStore()
+    for i in range(size):
+        store.add(f"item{i}")
+    ids = [rng.randrange(1, size + 1) for _ in range(ops)]
+    lookups = iter(ids)
+    requests = iter(ids)
+    deletes = iter(ids)
+    import main
+    main.STORE = store
+    client = main.app.test_client()
+    return {
+        "add": per_op_us(lambda: store.add("new"), ops),
+        "get": per_op_us(lambda: store.get(next(lookups)), ops),
+        "GET /items/<id>": per_op_us(lambda: client.get(f"/items/{next(requests)}"), min(ops, 1000)),
+        "GET /items page": per_op_us(lambda: client.get(f"/items?limit=100&after={size // 2}"), min(ops, 200)),
+        "GET /items 304": per_op_us(lambda: client.get("/items", headers={"If-None-Match": f'"{store.etag}"'}), min(ops, 1000)),
+        "delete": per_op_us(lambda: store.delete(next(deletes)), ops),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the serviceD item store")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--ops", type=int, default=10_000)
+    args = parser.parse_args()
+    for size in args.sizes:
+        results = bench(size, args.ops)
+        print(f"{size:>9} items  " + "  ".join(f"{op} {us:.2f}us" for op, us in results.items()))
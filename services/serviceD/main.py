@@ -1,17 +1,23 @@
+import json
 import os
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+
+from store import ItemStore
 
 app = Flask(__name__)
 
 # Simple in-memory store (reset on every restart)
-ITEMS: list[dict] = []
+STORE = ItemStore()
+MAX_PAGE = 1000
+# Items serialised per chunk of a streamed full listing
+STREAM_CHUNK = 500
 
 @app.get("/")
 def index():
     return jsonify({
         "app": "simple-test-app",
         "version": "1.0",
-        "endpoints": ["/health", "/echo (GET/POST)", "/items (GET/POST/DELETE)"]
+        "endpoints": ["/health", "/echo (GET/POST)", "/items (GET ?limit=&after=, POST)", "/items/<id> (GET/DELETE)"]
     })
 
 @app.get("/health")
@@ -29,9 +35,48 @@ def echo_post():
     msg = data.get("msg") or data.get("message") or ""
     return jsonify({"echo": msg})
 
+def stream_items(items: list[dict]):
+    """A snapshot of the store as a JSON array, serialised chunk by chunk."""
+    yield "["
+    for start in range(0, len(items), STREAM_CHUNK):
+        chunk = ",".join(json.dumps(item) for item in items[start:start + STREAM_CHUNK])
+        yield chunk if start == 0 else "," + chunk
+    yield "]"
+
 @app.get("/items")
 def get_items():
-    return jsonify(ITEMS)
+    # The tag changes with every mutation, so a matching tag means the
+    # listing is unchanged and nothing has to be serialised
+    etag = STORE.etag
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    if "limit" not in request.args and "after" not in request.args:
+        # The item list is copied up front, so the body matches its tag even
+        # when the store changes while it streams
+        etag, items = STORE.snapshot()
+        response = Response(stream_items(items), mimetype="application/json")
+        response.set_etag(etag)
+        return response
+    try:
+        limit = int(request.args.get("limit", 100))
+        after = int(request.args.get("after", 0))
+    except ValueError:
+        return jsonify({"error": "limit and after must be integers"}), 400
+    if not 1 <= limit <= MAX_PAGE or after < 0:
+        return jsonify({"error": f"limit must be between 1 and {MAX_PAGE}, after must not be negative"}), 400
+    etag, page = STORE.page(after, limit)
+    response = jsonify({"items": page, "next": page[-1]["id"] if len(page) == limit else None})
+    response.set_etag(etag)
+    return response
+
+@app.get("/items/<int:item_id>")
+def get_item(item_id: int):
+    item = STORE.get(item_id)
+    if item is None:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(item)
 
 @app.post("/items")
 def add_item():
@@ -43,16 +88,12 @@ def add_item():
         name = data["item"]
     else:
         name = data
-    item = {"id": len(ITEMS) + 1, "name": name}
-    ITEMS.append(item)
+    item = STORE.add(name)
     return jsonify(item), 201
 
 @app.delete("/items/<int:item_id>")
 def delete_item(item_id: int):
-    global ITEMS
-    before = len(ITEMS)
-    ITEMS = [i for i in ITEMS if i["id"] != item_id]
-    return jsonify({"deleted": len(ITEMS) != before})
+    return jsonify({"deleted": STORE.delete(item_id)})
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", "8000")))
@@ -0,0 +1,96 @@
+import json
+import unittest
+
+import main
+from store import ItemStore
+
+
+class TestItems(unittest.TestCase):
+
+    def setUp(self):
+        self.store = ItemStore()
+        self.original = main.STORE
+        main.STORE = self.store
+        self.addCleanup(setattr, main, "STORE", self.original)
+        self.client = main.app.test_client()
+
+    def add(self, name):
+        return self.client.post("/items", json={"name": name}).get_json()
+
+    def test_ids_stay_unique_after_delete(self):
+        """Test that a deleted id is never handed out again."""
+        first = self.add("a")
+        second = self.add("b")
+
+        self.assertEqual(self.client.delete(f"/items/{second['id']}").get_json(), {"deleted": True})
+        third = self.add("c")
+
+        self.assertNotIn(third["id"], (first["id"], second["id"]))
+        self.assertEqual([item["id"] for item in self.client.get("/items").get_json()], [first["id"], third["id"]])
+        self.assertEqual(self.client.delete(f"/items/{second['id']}").get_json(), {"deleted": False})
+
+    def test_get_item(self):
+        """Test looking up a single item and a missing one."""
+        item = self.add("a")
+
+        response = self.client.get(f"/items/{item['id']}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), item)
+        self.assertEqual(self.client.get(f"/items/{item['id'] + 1}").status_code, 404)
+
+    def test_cursor_pages(self):
+        """Test that limit/after pages walk every item once and skip deleted ones."""
+        ids = [self.add(f"item{i}")["id"] for i in range(7)]
+        self.client.delete(f"/items/{ids[3]}")
+
+        seen = []
+        after = 0
+        while after is not None:
+            body = self.client.get(f"/items?limit=2&after={after}").get_json()
+            seen.extend(item["id"] for item in body["items"])
+            after = body["next"]
+
+        self.assertEqual(seen, ids[:3] + ids[4:])
+
+    def test_invalid_page_arguments(self):
+        """Test that out of range or non-integer paging arguments are rejected."""
+        for query in ("limit=0", f"limit={main.MAX_PAGE + 1}", "after=-1", "limit=x", "after=1.5"):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(f"/items?{query}").status_code, 400)
+
+    def test_if_none_match(self):
+        """Test that an unchanged listing answers 304 and a mutation invalidates the tag."""
+        self.add("a")
+        etag = self.client.get("/items").headers["ETag"]
+
+        response = self.client.get("/items", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+
+        self.add("b")
+        response = self.client.get("/items", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()), 2)
+
+    def test_etag_differs_between_stores(self):
+        """Test that a tag from another store (e.g. before a restart) never matches."""
+        etag = self.client.get("/items").headers["ETag"]
+        main.STORE = ItemStore()
+
+        self.assertEqual(self.client.get("/items", headers={"If-None-Match": etag}).status_code, 200)
+
+    def test_stream_matches_its_etag(self):
+        """Test that a mutation while the listing streams does not leak into its body."""
+        self.add("a")
+        response = self.client.get("/items", buffered=False)
+        chunks = response.response
+        first = next(chunks)
+        self.add("b")
+
+        body = first + b"".join(chunks)
+        self.assertEqual(len(json.loads(body)), 1)
+        response.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
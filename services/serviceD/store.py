@@ -0,0 +1,77 @@
+import bisect
+import itertools
+import threading
+import uuid
+from typing import Any, Optional
+
+
+class ItemStore:
+    """In-memory items keyed by id.
+
+    Ids come from a counter and are never reused, so they stay unique after
+    deletes. Insert, lookup and delete are O(1), and every mutation holds the
+    lock so the store is safe under a threaded server. `version` changes with
+    every mutation and, prefixed with a nonce drawn per store, backs the ETag
+    of item listings, so tags from a restarted process never match.
+    """
+
+    def __init__(self):
+        self._items: dict[int, dict] = {}
+        # Ids in ascending order for cursor pages, deleted ids are dropped lazily
+        self._order: list[int] = []
+        self._deleted = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.version = 0
+        self.nonce = uuid.uuid4().hex
+
+    def add(self, name: Any) -> dict:
+        with self._lock:
+            item = {"id": next(self._ids), "name": name}
+            self._items[item["id"]] = item
+            self._order.append(item["id"])
+            self.version += 1
+        return item
+
+    def get(self, item_id: int) -> Optional[dict]:
+        return self._items.get(item_id)
+
+    def delete(self, item_id: int) -> bool:
+        with self._lock:
+            if self._items.pop(item_id, None) is None:
+                return False
+            self.version += 1
+            self._deleted += 1
+            if self._deleted > len(self._order) // 2:
+                self._order = [i for i in self._order if i in self._items]
+                self._deleted = 0
+            return True
+
+    @property
+    def etag(self) -> str:
+        return f"{self.nonce}-{self.version}"
+
+    def items(self) -> list[dict]:
+        """All items in insertion (id) order."""
+        with self._lock:
+            return list(self._items.values())
+
+    def snapshot(self) -> tuple[str, list[dict]]:
+        """ETag and all items, taken together so the tag describes the list."""
+        with self._lock:
+            return self.etag, list(self._items.values())
+
+    def page(self, after: int = 0, limit: int = 100) -> tuple[str, list[dict]]:
+        """ETag and up to limit items with ids above after, in id order."""
+        with self._lock:
+            page = []
+            for i in range(bisect.bisect_right(self._order, after), len(self._order)):
+                item = self._items.get(self._order[i])
+                if item is not None:
+                    page.append(item)
+                    if len(page) == limit:
+                        break
+            return self.etag, page
+
+    def __len__(self) -> int:
+        return len(self._items)